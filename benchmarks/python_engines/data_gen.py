@@ -0,0 +1,37 @@
+import argparse
+import os
+import random
+
+
+def generate_data(output_data_dir: str, num_rows: int, num_companies: int):
+    with open(os.path.join(output_data_dir, "sales.csv"), "w") as f:
+        f.write('"companyID","price","quantity"\n')
+        for _ in range(num_rows):
+            row = [str(random.randint(0, num_companies - 1)), str(random.randint(0, 200)), str(random.randint(1, 10))]
+            f.write(",".join(row) + "\n")
+    with open(os.path.join(output_data_dir, "companies.csv"), "w") as f:
+        f.write('"companyID","region"\n')
+        for company_id in range(num_companies):
+            f.write(",".join([str(company_id), str(random.randint(0, 9))]) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-n", "--num_rows", type=int,
+                        help="number of sales rows", required=True)
+    parser.add_argument("-c", "--num_companies", type=int,
+                        help="number of companies", required=False, default=1000)
+    parser.add_argument("-o", "--output", type=str,
+                        help="output directory", required=True)
+    parser.add_argument("-s", "--seed", type=int,
+                        help="random seed", required=False, default=42)
+
+    args = parser.parse_args()
+    random.seed(args.seed)
+    os.makedirs(args.output, exist_ok=True)
+    generate_data(args.output, args.num_rows, args.num_companies)
+
+
+if __name__ == "__main__":
+    main()
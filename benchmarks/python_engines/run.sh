@@ -0,0 +1,13 @@
+#!/bin/bash
+
+SIZE=$1
+PARTITIONS=$2
+DATA_ROOT_DIR=/tmp/python_engines_data/${SIZE}
+DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
+
+if [ ! -f ${DATA_ROOT_DIR}/sales.csv ]
+then
+    python ${DIR}/data_gen.py --num_rows ${SIZE} --output ${DATA_ROOT_DIR}
+fi
+
+python ${DIR}/workload.py ${DATA_ROOT_DIR} ${PARTITIONS}
@@ -0,0 +1,75 @@
+import contextlib
+import io
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import conclave.lang as cc
+from conclave import CodeGenConfig, generate_code
+from conclave.config import PythonConfig
+from conclave.utils import defCol
+
+
+def protocol():
+    sales = cc.create("sales", [
+        defCol("companyID", "INTEGER", [1]),
+        defCol("price", "INTEGER", [1]),
+        defCol("quantity", "INTEGER", [1])
+    ], {1})
+    companies = cc.create("companies", [
+        defCol("companyID", "INTEGER", [1]),
+        defCol("region", "INTEGER", [1])
+    ], {1})
+
+    large = cc.cc_filter(sales, "large", "quantity", "<", scalar=9)
+    revenue = cc.multiply(large, "revenue", "price", ["price", "quantity"])
+    with_region = cc.join(revenue, companies, "with_region", ["companyID"], ["companyID"])
+    by_region = cc.aggregate(with_region, "by_region", ["region"], "price", "sum", "total")
+    cc.collect(cc.sort_by(by_region, "sorted_by_region", "region"), 1)
+    by_company = cc.aggregate(revenue, "by_company", ["companyID"], "price", "sum", "total")
+    cc.collect(by_company, 1)
+
+    return {sales, companies}
+
+
+def run(data_root: str, engine: str, num_partitions: [int, None]):
+    """ Generates the workload for engine and runs it, returning its wall-clock and CPU seconds. """
+    workflow_name = "python-engines-{}".format(engine)
+    conclave_config = CodeGenConfig(workflow_name, 1) \
+        .with_python_config(PythonConfig(engine=engine, num_partitions=num_partitions))
+    conclave_config.code_path = os.path.join(data_root, workflow_name)
+    conclave_config.input_path = data_root
+    conclave_config.output_path = os.path.join(data_root, engine)
+    os.makedirs(conclave_config.output_path, exist_ok=True)
+    # only local jobs come out of the protocol, so any MPC framework will do
+    with contextlib.redirect_stdout(io.StringIO()):
+        job = generate_code(protocol, conclave_config, ["obliv-c"], ["python"], apply_optimizations=True)[0]
+
+    # includes the worker processes of the parallel engine, which the job waits for
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.time()
+    subprocess.run([sys.executable, os.path.join(job.code_dir, "workflow.py")], check=True,
+                   stdout=subprocess.DEVNULL)
+    wall = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return wall, cpu
+
+
+def main():
+    data_root = sys.argv[1]
+    num_partitions = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    times = {engine: run(data_root, engine, num_partitions) for engine in ["rows", "parallel"]}
+    for engine, (wall, cpu) in times.items():
+        print("{:>8}: {:.2f}s wall-clock, {:.2f}s CPU".format(engine, wall, cpu))
+    for name in ["sorted_by_region.csv", "by_company.csv"]:
+        outputs = [sorted(open(os.path.join(data_root, engine, name)).readlines()) for engine in times]
+        if outputs[0] != outputs[1]:
+            raise Exception("{} differs between engines".format(name))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,10 +8,11 @@ from conclave.codegen.spark import SparkCodeGen
 from conclave.codegen.oblivc import OblivcCodeGen
 from conclave.codegen.jiff import JiffCodeGen
 from conclave.codegen.single_party import SinglePartyCodegen
-from conclave.config import CodeGenConfig
+from conclave.config import CodeGenConfig, PythonConfig
+from conclave.partition.cost import CostModel, estimate_rows
 from conclave.dispatch import dispatch_all
 from conclave.net import SalmonPeer
-from conclave.net import setup_peer
+from conclave.net import get_peer
 
 
 def generate_code(protocol: callable, cfg: CodeGenConfig, mpc_frameworks: list,
@@ -32,15 +33,31 @@ def generate_code(protocol: callable, cfg: CodeGenConfig, mpc_frameworks: list,
 
     if "single-party-spark" not in set(mpc_frameworks) and "single-party-python" not in set(mpc_frameworks):
 
-        # currently only allow one local and one mpc framework
-        assert len(mpc_frameworks) == 1 and len(local_frameworks) == 1
+        # currently only allow one mpc framework
+        assert len(mpc_frameworks) == 1 and local_frameworks
 
         # only apply optimizations if required
         if apply_optimizations:
             dag = comp.rewrite_dag(dag, cfg)
 
+        # with more than one local framework, each local sub-dag goes to the one it is estimated to run fastest in.
+        # Rows are estimated before partitioning, which adds nodes for relations passed between sub-dags,
+        # and only then, as it scans the inputs whose statistics aren't known yet
+        if len(local_frameworks) > 1:
+            rows = {node.out_rel.name: num_rows for node, num_rows in estimate_rows(dag, cfg.input_path).items()}
+
         # partition into sub-dags that will run in specific frameworks
-        mapping = part.heupart(dag, mpc_frameworks, local_frameworks)
+        mapping = part.heupart(dag, mpc_frameworks, local_frameworks[:1])
+
+        if len(local_frameworks) > 1:
+            cost_model = cfg.cost_model if cfg.cost_model is not None else \
+                CostModel(python_worker_pool=cfg.system_configs.get("python", PythonConfig()).worker_pool)
+            mapping = part.assign_backends(mapping, local_frameworks, cost_model, rows)
+
+        # relations passed between python jobs never leave the local backend
+        intermediate_rels = _local_handoffs(mapping, "python")
+        # and those passed between spark jobs are stored as parquet
+        parquet_rels = _local_handoffs(mapping, "spark")
 
         # for each sub-dag run code gen and add resulting job to job queue
         for job_num, (framework, sub_dag, stored_with) in enumerate(mapping):
@@ -51,11 +68,11 @@ def generate_code(protocol: callable, cfg: CodeGenConfig, mpc_frameworks: list,
                 job_queue.append(job)
             elif framework == "spark":
                 name = "{}-spark-job-{}".format(cfg.name, job_num)
-                job = SparkCodeGen(cfg, sub_dag).generate(name, cfg.output_path)
+                job = SparkCodeGen(cfg, sub_dag, parquet_rels=parquet_rels).generate(name, cfg.output_path)
                 job_queue.append(job)
             elif framework == "python":
                 name = "{}-python-job-{}".format(cfg.name, job_num)
-                job = PythonCodeGen(cfg, sub_dag).generate(name, cfg.output_path)
+                job = PythonCodeGen(cfg, sub_dag, intermediate_rels=intermediate_rels).generate(name, cfg.output_path)
                 job_queue.append(job)
             elif framework == "obliv-c":
                 name = "{}-oblivc-job-{}".format(cfg.name, job_num)
@@ -68,6 +85,10 @@ def generate_code(protocol: callable, cfg: CodeGenConfig, mpc_frameworks: list,
             else:
                 raise Exception("Unknown framework: " + framework)
 
+            # lets the dispatcher run jobs that don't depend on each other concurrently
+            job.input_rels = {root.out_rel.name for root in sub_dag.roots}
+            job.output_rels = {node.out_rel.name for node in sub_dag.top_sort() if node.is_leaf()}
+
             # TODO: this probably doesn't belong here
             if cfg.pid not in stored_with:
                 job.skip = True
@@ -95,6 +116,23 @@ def generate_code(protocol: callable, cfg: CodeGenConfig, mpc_frameworks: list,
     return job_queue
 
 
+def _local_handoffs(mapping: list, framework: str):
+    """
+    Returns names of relations that are written by a sub-dag mapped to framework and
+    only read by other sub-dags mapped to the same framework.
+    """
+
+    produced = set()
+    consumers = {}
+    for fmwk, sub_dag, _ in mapping:
+        for node in sub_dag.top_sort():
+            if node.is_leaf() and fmwk == framework:
+                produced.add(node.out_rel.name)
+            if node.is_root() and isinstance(node, condag.Create):
+                consumers.setdefault(node.out_rel.name, set()).add(fmwk)
+    return {name for name in produced if consumers.get(name) == {framework}}
+
+
 def dispatch_jobs(job_queue: list, conclave_config: CodeGenConfig, time_dispatch: bool = False):
     """
     Dispatches jobs to respective backends.
@@ -105,9 +143,10 @@ def dispatch_jobs(job_queue: list, conclave_config: CodeGenConfig, time_dispatch
 
     networked_peer = None
 
-    # if more than one party is involved in the protocol, we need a networked peer
+    # if more than one party is involved in the protocol, we need a networked peer;
+    # connections set up for earlier workflows are reused
     if len(conclave_config.all_pids) > 1:
-        networked_peer = _setup_networked_peer(conclave_config.network_config)
+        networked_peer = _setup_networked_peer(conclave_config.network_config).session(conclave_config.workflow_id)
 
     if time_dispatch:
         # TODO use timeit
@@ -139,4 +178,4 @@ def generate_and_dispatch(protocol: callable, conclave_config: CodeGenConfig, mp
 
 
 def _setup_networked_peer(network_config):
-    return setup_peer(network_config)
+    return get_peer(network_config)
@@ -4,6 +4,10 @@ from conclave.dag import *
 class CodeGen:
     """ Base class for code generation. """
 
+    # Subclasses that implement _generate_fused set this to emit chains marked
+    # by comp.FuseRowOps as one operation
+    fuse_ops = False
+
     def __init__(self, config, dag):
         """ Initialize CodeGen with DAG and config. """
 
@@ -33,6 +37,14 @@ class CodeGen:
             if node.skip:
                 print("Skipping inactive node", node)
                 continue
+            if self.fuse_ops:
+                if self._fused_into_child(node):
+                    # generated as part of the chain that ends at one of its descendants
+                    continue
+                chain = self._fused_chain(node)
+                if len(chain) > 1:
+                    op_code += self._generate_fused(chain)
+                    continue
             if isinstance(node, HybridAggregate):
                 op_code += self._generate_hybrid_aggregate(node)
             elif isinstance(node, LeakyIndexAggregate):
@@ -105,6 +117,23 @@ class CodeGen:
         # expand top-level job template and return code
         return self._generate_job(job_name, self.config.code_path, op_code)
 
+    @staticmethod
+    def _fused_into_child(node: OpNode):
+        """ Returns whether node is evaluated as part of its only child's fused chain. """
+        if len(node.children) != 1:
+            return False
+        child = next(iter(node.children))
+        return child.fuse_with_parent and child.parent is node
+
+    def _fused_chain(self, node: OpNode):
+        """ Returns the ops of the fused chain that ends at node, in evaluation order. """
+        chain = [node]
+        while chain[0].fuse_with_parent \
+                and isinstance(chain[0].parent, ROW_LOCAL_OPS) \
+                and self._fused_into_child(chain[0].parent):
+            chain.insert(0, chain[0].parent)
+        return chain
+
     def _write_code(self, code, job_name):
         """ Overridden in subclasses. """
         pass
@@ -87,7 +87,8 @@ class JiffCodeGen(CodeGen):
 
         data = {
             "OP_CODE": op_code,
-            "JIFF_PATH": self.jiff_config.jiff_path
+            "JIFF_PATH": self.jiff_config.jiff_path,
+            "SORT_METHOD": self.jiff_config.sort_method
         }
 
         op_code = pystache.render(template, data)
@@ -350,7 +351,7 @@ class JiffCodeGen(CodeGen):
     def _generate_sort_by(self, sort_op: SortBy):
 
         template = open(
-            "{0}/bubbleSort.tmpl".format(self.template_directory), 'r').read()
+            "{0}/sort.tmpl".format(self.template_directory), 'r').read()
 
         data = {
             "INREL": sort_op.get_in_rel().name,
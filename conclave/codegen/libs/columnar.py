@@ -0,0 +1,299 @@
+"""
+Columnar runtime for generated Python code.
+
+A relation is a list of columns, each of which is a contiguous int64 NumPy array.
+Operators mirror those in conclave.codegen.libs.python and produce the same rows
+in the same order, so the two runtimes can be swapped via PythonConfig.
+"""
+import mmap
+import warnings
+
+import numpy as np
+
+import conclave.codegen.libs.python as _rows
+
+INT_TYPE = np.int64
+BIN_INT_TYPE = np.dtype("<i8")
+
+
+def _empty_rel(num_cols: int):
+    return [np.empty(0, dtype=INT_TYPE) for _ in range(num_cols)]
+
+
+def num_rows(rel: list):
+    return len(rel[0]) if rel else 0
+
+
+def to_rows(rel: list):
+    return np.column_stack(rel).tolist() if num_rows(rel) else []
+
+
+def from_rows(rows: list, num_cols: int):
+    if not rows:
+        return _empty_rel(num_cols)
+    return list(np.ascontiguousarray(np.array(rows, dtype=INT_TYPE).T))
+
+
+def write_rel(job_dir, rel_name, rel, schema_header):
+    print("Will write to {}/{}".format(job_dir, rel_name))
+    path = "{}/{}".format(job_dir, rel_name)
+    with open(path, "w") as f:
+        # hack header
+        f.write(schema_header + "\n")
+        if num_rows(rel):
+            np.savetxt(f, np.column_stack(rel), fmt="%d", delimiter=",")
+    _rows.write_rel_meta(path, num_rows(rel), schema_header)
+
+
+def read_rel(path_to_rel, num_cols=None):
+    with open(path_to_rel, "r") as f:
+        first_row = f.readline()
+    try:
+        [int(val) for val in first_row.split(",")]
+        skip = 0
+    except ValueError:
+        print("skipped header")
+        skip = 1
+    with warnings.catch_warnings():
+        # loadtxt warns on files that only hold a header
+        warnings.simplefilter("ignore")
+        data = np.loadtxt(path_to_rel, delimiter=",", dtype=INT_TYPE, skiprows=skip, ndmin=2)
+    if not data.size and num_cols is not None:
+        return _empty_rel(num_cols)
+    return list(np.ascontiguousarray(data.T))
+
+
+def write_rel_bin(job_dir, rel_name, rel, schema_header):
+    print("Will write to {}/{}".format(job_dir, rel_name))
+    path = "{}/{}".format(job_dir, rel_name)
+    with open(path, "wb") as f:
+        _rows._write_bin_header(f, len(rel), num_rows(rel), schema_header)
+        for col in rel:
+            f.write(np.ascontiguousarray(col, dtype=BIN_INT_TYPE).tobytes())
+
+
+def read_rel_bin(path_to_rel):
+    """ Columns are read-only views into the mapped file, nothing is parsed or copied. """
+    with open(path_to_rel, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    num_cols, num_rows, offset = _rows._read_bin_header(buf, path_to_rel)
+    block_size = num_rows * BIN_INT_TYPE.itemsize
+    return [np.frombuffer(buf, dtype=BIN_INT_TYPE, count=num_rows, offset=offset + idx * block_size)
+            for idx in range(num_cols)]
+
+
+def project(rel, selected_cols):
+    return [rel[idx] for idx in selected_cols]
+
+
+def concat(rels: list):
+    return [np.concatenate(cols) for cols in zip(*rels)]
+
+
+def _group(keys):
+    """
+    Sort keys and return the permutation, the start offset of each group in
+    sorted order and the order in which groups are first seen in the input.
+    """
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    # stable sort puts the first occurrence of each key at the start of its group
+    first_seen = np.argsort(order[starts], kind="stable")
+    return order, starts, first_seen
+
+
+# TODO handle multi-column case and aggregators other than sum
+def aggregate(rel, group_by_idx, over_idx, aggregator):
+    """
+    >>> rel = [np.array([3, 1, 3, 2, 1]), np.array([10, 20, 30, 40, 50])]
+    >>> [col.tolist() for col in aggregate(rel, 0, 1, "sum")]
+    [[3, 1, 2], [40, 70, 40]]
+    """
+    keys = rel[group_by_idx]
+    if not len(keys):
+        return _empty_rel(2)
+    order, starts, first_seen = _group(keys)
+    sums = np.add.reduceat(rel[over_idx][order], starts)
+    return [keys[order][starts][first_seen], sums[first_seen]]
+
+
+def aggregate_count(rel, group_by_idx):
+    keys = rel[group_by_idx]
+    if not len(keys):
+        return _empty_rel(2)
+    order, starts, first_seen = _group(keys)
+    counts = np.diff(np.append(starts, len(keys)))
+    return [keys[order][starts][first_seen], counts[first_seen]]
+
+
+def as_int(values):
+    """ Truncate towards zero, same as int() on the row-based runtime. """
+    if not np.all(np.isfinite(values)):
+        raise ZeroDivisionError("float division by zero")
+    return np.trunc(values).astype(INT_TYPE)
+
+
+def arithmetic_project(rel, target_col_idx, f):
+    """
+    Division by zero raises ZeroDivisionError, as on the row-based runtime, rather
+    than warning and producing garbage values.
+
+    >>> rel = [np.array([6, 7]), np.array([2, 0])]
+    >>> arithmetic_project(rel, 0, lambda cols : as_int(cols[0] / 1 / cols[1]))
+    Traceback (most recent call last):
+    ...
+    ZeroDivisionError: float division by zero
+
+    The target column must exist, as the row-based runtime never adds one:
+
+    >>> arithmetic_project(rel, 2, lambda cols : cols[0] * 2)
+    Traceback (most recent call last):
+    ...
+    Exception: arithmetic_project target column 2 out of range for 2 columns
+    """
+    if target_col_idx >= len(rel):
+        raise Exception("arithmetic_project target column {} out of range for {} columns"
+                        .format(target_col_idx, len(rel)))
+    with np.errstate(divide="raise", invalid="raise"):
+        try:
+            values = f(rel)
+        except FloatingPointError as e:
+            raise ZeroDivisionError("float division by zero") from e
+    values = np.broadcast_to(np.asarray(values, dtype=INT_TYPE), (num_rows(rel),)).copy()
+    return [values if idx == target_col_idx else col for idx, col in enumerate(rel)]
+
+
+def project_indeces(rel):
+    return [np.arange(num_rows(rel), dtype=INT_TYPE)] + rel
+
+
+def join_flags(left, right, left_col, right_col):
+    return [(left[left_col][:, None] == right[right_col][None, :]).ravel().astype(INT_TYPE)]
+
+
+def join(left, right, left_col, right_col):
+    """
+    Sort-merge join. Rows come out in right-row order and, within a key, in
+    left-row order, as with the hash join of the row-based runtime.
+
+    >>> left = [np.array([1, 2, 1]), np.array([7, 8, 9])]
+    >>> right = [np.array([5, 1, 2]), np.array([1, 1, 2])]
+    >>> [col.tolist() for col in join(left, right, 0, 1)]
+    [[1, 1, 1, 1, 2], [7, 9, 7, 9, 8], [5, 5, 1, 1, 2]]
+    """
+    right_keys = right[right_col]
+    left_idx, right_idx = _rows._match(left[left_col], right_keys)
+
+    vals_from_left = [col[left_idx] for (idx, col) in enumerate(left) if idx != left_col]
+    vals_from_right = [col[right_idx] for (idx, col) in enumerate(right) if idx != right_col]
+    return [right_keys[right_idx]] + vals_from_left + vals_from_right
+
+
+def index_agg(rel, over_col, distinct_keys, indeces, aggregator):
+    res = np.zeros(num_rows(distinct_keys), dtype=INT_TYPE)
+    if aggregator in {"+", "sum"}:
+        np.add.at(res, indeces[1], rel[over_col][indeces[0]])
+    elif aggregator == "count":
+        np.add.at(res, indeces[1], 1)
+    else:
+        raise Exception("Unknown aggregator {}".format(aggregator))
+    return [distinct_keys[0], res]
+
+
+def sort_by(rel, sort_by_col):
+    order = np.argsort(rel[sort_by_col], kind="stable")
+    return [col[order] for col in rel]
+
+
+def comp_neighs(rel, comp_col):
+    col = rel[comp_col]
+    return [(col[:-1] == col[1:]).astype(INT_TYPE)]
+
+
+def distinct(rel, selected_cols):
+    # TODO: general case
+    assert len(selected_cols) == 1
+    # the row-based runtime emits keys in set iteration order, which is unspecified;
+    # here they come out sorted
+    return [np.unique(rel[selected_cols[0]])]
+
+
+def indexes_to_flags(lookup, rel_size):
+    res = np.zeros(rel_size, dtype=INT_TYPE)
+    res[lookup[0]] = 1
+    return [res]
+
+
+def arrange_by_flags(lookups, indexes_and_flags):
+    lookup_keys, lookup_counts = np.unique(lookups[0], return_counts=True)
+    indexes, flags = indexes_and_flags[0], indexes_and_flags[1]
+    # sort by (-flag, index); lexsort is stable and treats the last key as primary
+    in_order = np.lexsort((indexes, -flags))
+    real_entries = in_order[:len(lookup_keys)]
+    # dummies are handed out from the back, as deque.pop() does
+    dummy_entries = in_order[len(lookup_keys):][::-1]
+    num_dummies = lookup_counts[np.searchsorted(lookup_keys, indexes[real_entries])] - 1
+
+    res = np.empty(len(real_entries) + num_dummies.sum(), dtype=INT_TYPE)
+    real_positions = np.arange(len(real_entries)) + np.cumsum(num_dummies) - num_dummies
+    is_dummy = np.ones(len(res), dtype=bool)
+    is_dummy[real_positions] = False
+    res[real_positions] = real_entries
+    res[is_dummy] = dummy_entries[:is_dummy.sum()]
+    return [res]
+
+
+def cc_filter(cond_lambda, rel):
+    mask = np.broadcast_to(np.asarray(cond_lambda(rel), dtype=bool), (num_rows(rel),))
+    return [col[mask] for col in rel]
+
+
+def distinct_count(rel, selected_col):
+    return [np.array([len(np.unique(rel[selected_col]))], dtype=INT_TYPE)]
+
+
+def key_union_as_rel(left: list, right: list, l: int, r: int):
+    return [np.unique(np.concatenate((left[l], right[r])))]
+
+
+def filter_by(rel: list, key_rel: list, key_col: int, use_not_in: bool = False):
+    mask = np.isin(rel[key_col], key_rel[0], invert=use_not_in)
+    return [col[mask] for col in rel]
+
+
+def _as_matrix(rel: list):
+    return np.column_stack(rel) if num_rows(rel) else np.empty((0, len(rel)), dtype=INT_TYPE)
+
+
+def _pub_join_part(idx_rel, rel: list, other_rel: list, key_col: int, me: int, num_left_cols: int,
+                   num_right_cols: int):
+    joined = _rows._reconstruct(_as_matrix(rel), _as_matrix(other_rel), key_col, key_col, idx_rel, me,
+                                num_left_cols, num_right_cols)
+    return [np.ascontiguousarray(col) for col in joined.T]
+
+
+def pub_intersect_as_server(host: str, port: int, my_rel: list, my_key_col: int):
+    return [_rows._pub_intersect_keys_as_server(host, port, my_rel[my_key_col]).astype(INT_TYPE)]
+
+
+def pub_intersect_as_client(host: str, port: int, my_rel: list, my_key_col: int):
+    return [_rows._pub_intersect_keys_as_client(host, port, my_rel[my_key_col]).astype(INT_TYPE)]
+
+
+def pub_join(host: str, port: int, is_server: bool, rel: list, key_col: int):
+    if is_server:
+        my_idx = _rows._pub_join_keys_as_server(host, port, rel[key_col])
+    else:
+        my_idx = _rows._pub_join_keys_as_client(host, port, rel[key_col])
+    return [col[my_idx] for col in rel]
+
+
+def pub_join_part(host: str, port: int, is_server: bool, rel: list, other_rel: list, key_col: int, num_left_cols: int,
+                  num_right_cols: int):
+    if is_server:
+        idx_rel = _rows._pub_join_part_keys_as_server(host, port, rel[key_col], other_rel[key_col])
+        return _pub_join_part(idx_rel, rel, other_rel, key_col, 0, num_left_cols, num_right_cols)
+    else:
+        idx_rel = _rows._pub_join_part_keys_as_client(host, port, rel[key_col], other_rel[key_col])
+        return _pub_join_part(idx_rel, rel, other_rel, key_col, 1, num_left_cols, num_right_cols)
@@ -0,0 +1,647 @@
+"""
+Hash-partitioned parallel runtime for generated Python code.
+
+A relation of at least MIN_ROWS rows is Partitioned: split into parts held by
+worker processes, forked once per job when the first such relation is read.
+Partition-local operators run where the parts are, so rows stay in the workers
+from the read to the write: workers read ranges of the input files, write their
+parts of the output files, and send rows to each other only when an operator needs
+a relation hash-partitioned on a column it isn't partitioned on yet.
+
+Smaller relations are lists of rows, on which operators run in the job's process
+as in conclave.codegen.libs.python, since moving them to the workers would cost
+more than the work on them. Operators whose output has fewer than MIN_ROWS rows
+bring it back into the job's process.
+
+Operators keep the order of rows wherever the rows engine defines it, except
+that relations are in partition order once they are hash-partitioned.
+"""
+import atexit
+import builtins
+import collections
+import heapq
+import importlib
+import io
+import itertools
+import marshal
+import mmap
+import multiprocessing
+import os
+import pickle
+import shutil
+import sys
+import traceback
+import types
+import weakref
+from array import array
+
+import conclave.codegen.libs.python as _rows
+
+NUM_PARTITIONS = os.cpu_count() or 1
+# relations with fewer rows are processed in the job's process
+MIN_ROWS = 100000
+
+# worker processes with the connections to them, and the process that forked them
+_workers = []
+_workers_pid = None
+# parts of relations are referred to by handles, counted by the relations sharing them
+_handles = itertools.count()
+_refs = collections.Counter()
+# handles no longer used, by worker, to be dropped with the next request to it
+_garbage = collections.defaultdict(list)
+
+
+def set_partitions(num_partitions: [int, None], min_rows: int = MIN_ROWS):
+    global NUM_PARTITIONS, MIN_ROWS
+    NUM_PARTITIONS = num_partitions or os.cpu_count() or 1
+    MIN_ROWS = min_rows
+
+
+class Partitioned:
+    """
+    Relation split into parts, (worker, handle, number of rows) triples. Unless key
+    is None, rows are hash-partitioned on column key: all rows of a key are held by
+    the same worker.
+    """
+
+    def __init__(self, parts: list, key: [int, None] = None):
+        self.parts = parts
+        self.key = key
+        handles = [(worker, handle) for worker, handle, _ in parts]
+        _refs.update(handle for _, handle in handles)
+        weakref.finalize(self, _release, handles)
+
+    def __iter__(self):
+        return iter(gather(self))
+
+    def __len__(self):
+        return sum(num_rows for _, _, num_rows in self.parts)
+
+    def __add__(self, other):
+        return concat([self, other])
+
+    def __radd__(self, other):
+        return concat([other, self])
+
+
+def _release(handles: list):
+    for worker, handle in handles:
+        _refs[handle] -= 1
+        if not _refs[handle]:
+            del _refs[handle]
+            _garbage[worker].append(handle)
+
+
+class _Ref:
+    """ Stands for the concatenation of the parts with the given handles in a task's arguments. """
+
+    def __init__(self, handles: tuple):
+        self.handles = handles
+
+
+class _Input:
+    """ Stands for the parts of the idx-th input held by a worker in the arguments of an operator. """
+
+    def __init__(self, idx: int):
+        self.idx = idx
+
+
+_PART = _Input(0)
+
+
+def _global_names(code: types.CodeType):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _global_names(const)
+    return names
+
+
+def _load_lambda(code: bytes, used_globals: dict):
+    return types.FunctionType(marshal.loads(code), dict(used_globals, __builtins__=builtins))
+
+
+class _TaskPickler(pickle.Pickler):
+    """
+    Pickles the lambdas generated code passes to operators by their code, along
+    with the globals they use, since the workers were forked before they existed.
+    """
+
+    def reducer_override(self, obj):
+        if isinstance(obj, types.FunctionType) and obj.__name__ == "<lambda>" and obj.__closure__ is None:
+            used_globals = {name: obj.__globals__[name]
+                            for name in _global_names(obj.__code__) if name in obj.__globals__}
+            return _load_lambda, (marshal.dumps(obj.__code__), used_globals)
+        if isinstance(obj, types.ModuleType):
+            return importlib.import_module, (obj.__name__,)
+        return NotImplemented
+
+
+def _dumps(obj):
+    with io.BytesIO() as buf:
+        _TaskPickler(buf, pickle.HIGHEST_PROTOCOL).dump(obj)
+        return buf.getvalue()
+
+
+def _resolve(store: dict, arg):
+    if not isinstance(arg, _Ref):
+        return arg
+    if len(arg.handles) == 1:
+        return store[arg.handles[0]]
+    return list(itertools.chain.from_iterable(store[handle] for handle in arg.handles))
+
+
+def _serve(conn, parent_conn):
+    """
+    Worker loop: drops the parts it is told to, then runs the tasks of the request,
+    (handle, f, args) triples, keeping the results of tasks with a handle and
+    replying with their number of rows, and with the results of the others.
+    """
+    # so that this worker and those forked before it see their connections close
+    parent_conn.close()
+    for _, inherited_conn in _workers:
+        inherited_conn.close()
+    store = {}
+    while True:
+        try:
+            drops = pickle.loads(conn.recv_bytes())
+            request = conn.recv_bytes()
+        except EOFError:
+            break
+        for handle in drops:
+            store.pop(handle, None)
+        try:
+            results = []
+            for handle, f, args in pickle.loads(request):
+                result = f(*[_resolve(store, arg) for arg in args])
+                if handle is not None:
+                    store[handle] = result
+                    result = len(result)
+                results.append(result)
+            conn.send((None, results))
+        except Exception:
+            conn.send((traceback.format_exc(), None))
+
+
+def _close_workers():
+    global _workers
+    # workers inherited from the parent process are the parent's to close
+    if _workers_pid == os.getpid():
+        for proc, conn in _workers:
+            conn.close()
+            proc.join(1)
+            if proc.is_alive():
+                proc.terminate()
+    _workers = []
+
+
+def _get_workers():
+    """ Returns the workers of this process, forking them the first time. """
+    global _workers, _workers_pid
+    if _workers and (_workers_pid != os.getpid() or len(_workers) != NUM_PARTITIONS):
+        _close_workers()
+    if not _workers:
+        ctx = multiprocessing.get_context("fork")
+        for _ in range(NUM_PARTITIONS):
+            conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(target=_serve, args=(child_conn, conn), daemon=True)
+            proc.start()
+            child_conn.close()
+            _workers.append((proc, conn))
+        _workers_pid = os.getpid()
+        _garbage.clear()
+    return _workers
+
+
+atexit.register(_close_workers)
+
+
+def _parallel():
+    return NUM_PARTITIONS > 1 and "fork" in multiprocessing.get_all_start_methods()
+
+
+def _call(requests: dict):
+    """
+    Sends each worker its list of tasks in requests, keyed by worker, and returns
+    their results, keyed the same way. Raises pickling errors before sending anything.
+    """
+    workers = _get_workers()
+    payloads = {worker: _dumps(tasks) for worker, tasks in requests.items()}
+    for worker, payload in payloads.items():
+        conn = workers[worker][1]
+        # parts released by a relation may since have been taken up by another one
+        drops = [handle for handle in _garbage.pop(worker, []) if handle not in _refs]
+        conn.send_bytes(pickle.dumps(drops))
+        conn.send_bytes(payload)
+    results = {}
+    error = None
+    # every worker replies before any error is raised, so the next request gets its own replies
+    for worker in payloads:
+        try:
+            worker_error, results[worker] = workers[worker][1].recv()
+        except EOFError:
+            worker_error = "worker {} exited".format(worker)
+        error = error or worker_error
+    if error is not None:
+        raise Exception("Parallel worker failed:\n{}".format(error))
+    return results
+
+
+def _run(tasks: list, key: [int, None] = None):
+    """ Returns the relation whose parts are the results of tasks, (worker, f, args) triples. """
+    requests = collections.defaultdict(list)
+    handles = []
+    for worker, f, args in tasks:
+        handle = next(_handles)
+        requests[worker].append((handle, f, args))
+        handles.append((worker, handle))
+    results = {worker: iter(sizes) for worker, sizes in _call(requests).items()}
+    return Partitioned([(worker, handle, next(results[worker])) for worker, handle in handles], key)
+
+
+def _settle(rel: Partitioned):
+    """ Brings rel into the job's process if it is small enough. """
+    if len(rel) < MIN_ROWS:
+        return gather(rel)
+    return rel
+
+
+def _rows_of(rows: list):
+    return rows
+
+
+def _parts_of(rel: Partitioned):
+    """ Returns the rows of each part of rel. """
+    requests = collections.defaultdict(list)
+    for worker, handle, _ in rel.parts:
+        requests[worker].append((None, _rows_of, (_Ref((handle,)),)))
+    results = {worker: iter(parts) for worker, parts in _call(requests).items()}
+    return [next(results[worker]) for worker, _, _ in rel.parts]
+
+
+def gather(rel):
+    if not isinstance(rel, Partitioned):
+        return rel
+    return list(itertools.chain.from_iterable(_parts_of(rel)))
+
+
+def _map(rel: Partitioned, f: callable, args: tuple, key: [int, None]):
+    """ Applies f to each part of rel, for which _PART stands in args, in the worker holding it. """
+    tasks = [(worker, f, tuple(_Ref((handle,)) if arg is _PART else arg for arg in args))
+             for worker, handle, _ in rel.parts]
+    try:
+        return _run(tasks, key)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        # e.g. lambdas that close over local variables
+        return list(itertools.chain.from_iterable(
+            f(*[part if arg is _PART else arg for arg in args]) for part in _parts_of(rel)))
+
+
+def _colocated(rels: list, f: callable, args: tuple, key: [int, None]):
+    """
+    Applies f, in each worker, to the rows of each of rels held by the worker, for
+    which _Input(idx) stands in args. rels are hash-partitioned on the same values.
+    """
+    tasks = []
+    for worker in range(NUM_PARTITIONS):
+        refs = [_Ref(tuple(handle for part_worker, handle, _ in rel.parts if part_worker == worker)) for rel in rels]
+        tasks.append((worker, f, tuple(refs[arg.idx] if isinstance(arg, _Input) else arg for arg in args)))
+    return _run(tasks, key)
+
+
+def _scatter(rows: list):
+    """ Splits rows into NUM_PARTITIONS contiguous parts held by the workers. """
+    size = -(-len(rows) // NUM_PARTITIONS)
+    return _run([(idx, _rows_of, (rows[idx * size:(idx + 1) * size],)) for idx in range(NUM_PARTITIONS)])
+
+
+def _bucket(rows: list, key_col: int, num_parts: int):
+    buckets = [[] for _ in range(num_parts)]
+    for row in rows:
+        buckets[hash(row[key_col]) % num_parts].append(row)
+    return buckets
+
+
+def _bucket_dumps(rows: list, key_col: int, num_parts: int):
+    return [pickle.dumps(bucket, pickle.HIGHEST_PROTOCOL) for bucket in _bucket(rows, key_col, num_parts)]
+
+
+def _loads_concat(buckets: list):
+    return list(itertools.chain.from_iterable(pickle.loads(bucket) for bucket in buckets))
+
+
+def _exchange(rel, key_col: int):
+    """ Hash-partitions rel on key_col, unless it already is. """
+    if not isinstance(rel, Partitioned):
+        buckets = _bucket(rel, key_col, NUM_PARTITIONS)
+        return _run([(idx, _rows_of, (bucket,)) for idx, bucket in enumerate(buckets)], key_col)
+    if rel.key == key_col:
+        return rel
+    requests = collections.defaultdict(list)
+    for worker, handle, _ in rel.parts:
+        requests[worker].append((None, _bucket_dumps, (_Ref((handle,)), key_col, NUM_PARTITIONS)))
+    # workers pickle their buckets, which are only passed on from here
+    buckets = [part_buckets for worker, results in sorted(_call(requests).items()) for part_buckets in results]
+    return _run([(idx, _loads_concat, ([part_buckets[idx] for part_buckets in buckets],))
+                 for idx in range(NUM_PARTITIONS)], key_col)
+
+
+def _read_rel_range(path_to_rel: str, start: int, end: int):
+    """
+    Reads the rows of the CSV relation at path_to_rel whose lines start at byte start up to end.
+
+    >>> import tempfile
+    >>> path = tempfile.mkdtemp() + "/rel.csv"
+    >>> with open(path, "w") as f:
+    ...     _ = f.write("a,b\\n1,2\\n30,40\\n5,6\\n")
+    >>> _read_rel_range(path, 0, 6)
+    skipped header
+    [[1, 2]]
+    >>> _read_rel_range(path, 6, 8), _read_rel_range(path, 8, 19)
+    ([], [[30, 40], [5, 6]])
+    """
+    rows = []
+    with open(path_to_rel, "rb") as f:
+        if start > 0:
+            # the line under way at start belongs to the previous range
+            f.seek(start - 1)
+            f.readline()
+        data = f.read(max(end - f.tell(), 0))
+        if data and not data.endswith(b"\n"):
+            data += f.readline()
+    for raw_row in data.split(b"\n"):
+        if not raw_row.strip():
+            continue
+        try:
+            rows.append([int(val) for val in raw_row.split(b",")])
+        except ValueError:
+            print("skipped header")
+    return rows
+
+
+def read_rel(path_to_rel):
+    if not _parallel() or _rows.read_rel_meta(path_to_rel)["rows"] < MIN_ROWS:
+        return _rows.read_rel(path_to_rel)
+    size = os.path.getsize(path_to_rel)
+    bounds = [size * idx // NUM_PARTITIONS for idx in range(NUM_PARTITIONS + 1)]
+    return _settle(_run([(idx, _read_rel_range, (path_to_rel, bounds[idx], bounds[idx + 1]))
+                         for idx in range(NUM_PARTITIONS)]))
+
+
+def _write_rel_part(rows: list, path: str):
+    with open(path, "w") as f:
+        for row in rows:
+            f.write(",".join([str(val) for val in row]) + "\n")
+
+
+def write_rel(job_dir, rel_name, rel, schema_header):
+    if not isinstance(rel, Partitioned):
+        return _rows.write_rel(job_dir, rel_name, rel, schema_header)
+    print("Will write to {}/{}".format(job_dir, rel_name))
+    path = "{}/{}".format(job_dir, rel_name)
+    part_paths = ["{}.part{}".format(path, idx) for idx in range(len(rel.parts))]
+    _call_parts(rel, _write_rel_part, part_paths)
+    with open(path, "wb") as f:
+        # hack header
+        f.write((schema_header + "\n").encode("utf-8"))
+        for part_path in part_paths:
+            with open(part_path, "rb") as part:
+                shutil.copyfileobj(part, f)
+            os.remove(part_path)
+    _rows.write_rel_meta(path, len(rel), schema_header)
+
+
+def _call_parts(rel: Partitioned, f: callable, part_args: list):
+    """ Calls f on each part of rel and its entry of part_args, in the worker holding the part. """
+    requests = collections.defaultdict(list)
+    for (worker, handle, _), arg in zip(rel.parts, part_args):
+        requests[worker].append((None, f, (_Ref((handle,)), arg)))
+    _call(requests)
+
+
+def _read_rel_bin_range(path_to_rel: str, start: int, end: int):
+    """ Reads rows start up to end of the binary relation at path_to_rel. """
+    with open(path_to_rel, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        num_cols, num_rows, offset = _rows._read_bin_header(buf, path_to_rel)
+        cols = []
+        for idx in range(num_cols):
+            col_offset = offset + idx * num_rows * _rows.BIN_INT_SIZE
+            col = array("q")
+            col.frombytes(buf[col_offset + start * _rows.BIN_INT_SIZE:col_offset + end * _rows.BIN_INT_SIZE])
+            if sys.byteorder == "big":
+                col.byteswap()
+            cols.append(col)
+    return [list(row) for row in zip(*cols)]
+
+
+def read_rel_bin(path_to_rel):
+    with open(path_to_rel, "rb") as f:
+        _, num_rows, _ = _rows._read_bin_header(f.read(_rows.BIN_HEADER.size), path_to_rel)
+    if not _parallel() or num_rows < MIN_ROWS:
+        return _rows.read_rel_bin(path_to_rel)
+    bounds = [num_rows * idx // NUM_PARTITIONS for idx in range(NUM_PARTITIONS + 1)]
+    return _run([(idx, _read_rel_bin_range, (path_to_rel, bounds[idx], bounds[idx + 1]))
+                 for idx in range(NUM_PARTITIONS)])
+
+
+def _write_rel_bin_part(rows: list, path_and_num_cols: tuple):
+    path, num_cols = path_and_num_cols
+    with open(path, "wb") as f:
+        for idx in range(num_cols):
+            col = array("q", (row[idx] for row in rows))
+            if sys.byteorder == "big":
+                col.byteswap()
+            f.write(col.tobytes())
+
+
+def write_rel_bin(job_dir, rel_name, rel, schema_header):
+    if not isinstance(rel, Partitioned):
+        return _rows.write_rel_bin(job_dir, rel_name, rel, schema_header)
+    print("Will write to {}/{}".format(job_dir, rel_name))
+    path = "{}/{}".format(job_dir, rel_name)
+    num_cols = len(schema_header.split(","))
+    part_paths = ["{}.part{}".format(path, idx) for idx in range(len(rel.parts))]
+    _call_parts(rel, _write_rel_bin_part, [(part_path, num_cols) for part_path in part_paths])
+    with open(path, "wb") as f:
+        _rows._write_bin_header(f, num_cols, len(rel), schema_header)
+        parts = [(open(part_path, "rb"), num_rows * _rows.BIN_INT_SIZE)
+                 for part_path, (_, _, num_rows) in zip(part_paths, rel.parts)]
+        # each part file holds its share of every column block
+        for _ in range(num_cols):
+            for part, col_size in parts:
+                f.write(part.read(col_size))
+        for part, _ in parts:
+            part.close()
+    for part_path in part_paths:
+        os.remove(part_path)
+
+
+def project(rel, selected_cols):
+    if not isinstance(rel, Partitioned):
+        return _rows.project(rel, selected_cols)
+    key = selected_cols.index(rel.key) if rel.key in selected_cols else None
+    return _map(rel, _rows.project, (_PART, selected_cols), key)
+
+
+def concat(rels: list):
+    if not any(isinstance(rel, Partitioned) for rel in rels):
+        return list(itertools.chain.from_iterable(rels))
+    keys = set(rel.key if isinstance(rel, Partitioned) else None for rel in rels)
+    if len(keys) == 1 and None not in keys:
+        # rows of a key stay with the same worker, so the result stays partitioned
+        return Partitioned(list(itertools.chain.from_iterable(rel.parts for rel in rels)), keys.pop())
+    # parts in input order, as the rows of the rows engine
+    parts = []
+    for rel in rels:
+        if not isinstance(rel, Partitioned):
+            rel = _scatter(rel) if rel else Partitioned([])
+        parts += rel.parts
+    return Partitioned(parts)
+
+
+def cc_filter(cond_lambda, rel):
+    if not isinstance(rel, Partitioned):
+        return _rows.cc_filter(cond_lambda, rel)
+    return _settle(_map(rel, _rows.cc_filter, (cond_lambda, _PART), rel.key))
+
+
+def arithmetic_project(rel, target_col_idx, f):
+    if not isinstance(rel, Partitioned):
+        return _rows.arithmetic_project(rel, target_col_idx, f)
+    key = rel.key if rel.key != target_col_idx else None
+    return _map(rel, _rows.arithmetic_project, (_PART, target_col_idx, f), key)
+
+
+def _index_part(rows: list, offset: int):
+    return [[offset + idx] + rest for (idx, rest) in enumerate(rows)]
+
+
+def project_indeces(rel):
+    if not isinstance(rel, Partitioned):
+        return _rows.project_indeces(rel)
+    offsets = itertools.accumulate([0] + [num_rows for _, _, num_rows in rel.parts[:-1]])
+    key = rel.key + 1 if rel.key is not None else None
+    return _run([(worker, _index_part, (_Ref((handle,)), offset))
+                 for (worker, handle, _), offset in zip(rel.parts, offsets)], key)
+
+
+def filter_by(rel: list, key_rel: list, key_col: int, use_not_in: bool = False):
+    if not isinstance(rel, Partitioned):
+        return _rows.filter_by(rel, gather(key_rel), key_col, use_not_in)
+    keys = set(row[0] for row in gather(key_rel))
+    f = _rows.filter_by_not_keys if use_not_in else _rows.filter_by_keys
+    return _settle(_map(rel, f, (_PART, keys, key_col), rel.key))
+
+
+def _merge_counts(partials: list):
+    """ Sums the values of partial aggregates in order, so keys stay in order of their first row. """
+    acc = {}
+    for key, value in partials:
+        acc[key] = acc.get(key, 0) + value
+    return [[key, value] for key, value in acc.items()]
+
+
+# TODO handle multi-column case and aggregators other than sum
+def aggregate(rel, group_by_idx, over_idx, aggregator):
+    if not isinstance(rel, Partitioned):
+        return _rows.aggregate(rel, group_by_idx, over_idx, aggregator)
+    if rel.key == group_by_idx:
+        return _settle(_colocated([rel], _rows.aggregate, (_PART, group_by_idx, over_idx, aggregator), 0))
+    # workers aggregate their parts, which are merged here
+    return _merge_counts(gather(_map(rel, _rows.aggregate, (_PART, group_by_idx, over_idx, aggregator), None)))
+
+
+def aggregate_count(rel, group_by_idx):
+    if not isinstance(rel, Partitioned):
+        return _rows.aggregate_count(rel, group_by_idx)
+    if rel.key == group_by_idx:
+        return _settle(_colocated([rel], _rows.aggregate_count, (_PART, group_by_idx), 0))
+    return _merge_counts(gather(_map(rel, _rows.aggregate_count, (_PART, group_by_idx), None)))
+
+
+def join(left, right, left_col, right_col):
+    left_partitioned = isinstance(left, Partitioned)
+    right_partitioned = isinstance(right, Partitioned)
+    if not left_partitioned and not right_partitioned:
+        return _rows.join(left, right, left_col, right_col)
+    # a small side is sent along to the parts of the other one
+    if not left_partitioned and len(left) < MIN_ROWS:
+        key = 0 if right.key == right_col else None
+        return _settle(_map(right, _rows.join, (left, _PART, left_col, right_col), key))
+    if not right_partitioned and len(right) < MIN_ROWS:
+        key = 0 if left.key == left_col else None
+        return _settle(_map(left, _rows.join, (_PART, right, left_col, right_col), key))
+    left = _exchange(left, left_col)
+    right = _exchange(right, right_col)
+    return _settle(_colocated([left, right], _rows.join, (_Input(0), _Input(1), left_col, right_col), 0))
+
+
+def sort_by(rel, sort_by_col):
+    if not isinstance(rel, Partitioned):
+        return _rows.sort_by(rel, sort_by_col)
+    sorted_parts = _parts_of(_run([(worker, _rows.sort_by, (_Ref((handle,)), sort_by_col))
+                                   for worker, handle, _ in rel.parts]))
+    # parts are merged in order, so ties keep their relative order as with a single sort
+    return list(heapq.merge(*sorted_parts, key=lambda row: row[sort_by_col]))
+
+
+def distinct(rel, selected_cols):
+    # TODO: general case
+    assert len(selected_cols) == 1
+    if not isinstance(rel, Partitioned):
+        return _rows.distinct(rel, selected_cols)
+    if rel.key == selected_cols[0]:
+        return _settle(_colocated([rel], _rows.distinct, (_PART, selected_cols), 0))
+    keys = set()
+    for part in _parts_of(_run([(worker, _rows.distinct, (_Ref((handle,)), selected_cols))
+                                for worker, handle, _ in rel.parts])):
+        keys.update(row[0] for row in part)
+    return [[key] for key in keys]
+
+
+def distinct_count(rel, selected_col):
+    return [[len(distinct(rel, [selected_col]))]]
+
+
+# the operators below need the whole relation and run in the job's process
+
+def comp_neighs(rel, comp_col):
+    return _rows.comp_neighs(gather(rel), comp_col)
+
+
+def join_flags(left, right, left_col, right_col):
+    return _rows.join_flags(gather(left), gather(right), left_col, right_col)
+
+
+def index_agg(rel, over_col, distinct_keys, indeces, aggregator):
+    return _rows.index_agg(gather(rel), over_col, gather(distinct_keys), gather(indeces), aggregator)
+
+
+def indexes_to_flags(lookup, rel_size):
+    return _rows.indexes_to_flags(gather(lookup), rel_size)
+
+
+def arrange_by_flags(lookups, indexes_and_flags):
+    return _rows.arrange_by_flags(gather(lookups), gather(indexes_and_flags))
+
+
+def key_union_as_rel(left: list, right: list, l: int, r: int):
+    return _rows.key_union_as_rel(gather(left), gather(right), l, r)
+
+
+def pub_intersect_as_server(host: str, port: int, my_rel: list, my_key_col: int):
+    return _rows.pub_intersect_as_server(host, port, gather(my_rel), my_key_col)
+
+
+def pub_intersect_as_client(host: str, port: int, my_rel: list, my_key_col: int):
+    return _rows.pub_intersect_as_client(host, port, gather(my_rel), my_key_col)
+
+
+def pub_join(host: str, port: int, is_server: bool, rel: list, key_col: int):
+    return _rows.pub_join(host, port, is_server, gather(rel), key_col)
+
+
+def pub_join_part(host: str, port: int, is_server: bool, rel: list, other_rel: list, key_col: int, num_left_cols: int,
+                  num_right_cols: int):
+    return _rows.pub_join_part(host, port, is_server, gather(rel), gather(other_rel), key_col,
+                               num_left_cols, num_right_cols)
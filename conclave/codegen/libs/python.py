@@ -1,19 +1,138 @@
+import json
+import mmap
+import os
 import socket
 import struct
-import time
+import sys
+from array import array
 from collections import deque
 
-INT_SIZE = 4
+import numpy as np
+
+from conclave.net.connect import connect, listen
+
+INT_SIZE = 8
+# elements are sent over sockets as little-endian 64-bit ints, the size of the keys
+# they carry, preceded by their count
+NET_INT_TYPE = np.dtype("<i8")
+
+# binary relation files: header, schema string padded to 8 bytes, then one
+# block of little-endian int64 values per column
+BIN_MAGIC = b"CCRL"
+BIN_HEADER = struct.Struct("<4sIQI")
+BIN_INT_SIZE = 8
+
+# CSV relation files get a sidecar with their row count, column count and schema,
+# so consumers don't have to scan them
+META_SUFFIX = ".meta.json"
 
 
 def write_rel(job_dir, rel_name, rel, schema_header):
     print("Will write to {}/{}".format(job_dir, rel_name))
     path = "{}/{}".format(job_dir, rel_name)
+    num_rows = 0
     with open(path, "w") as f:
         # hack header
         f.write(schema_header + "\n")
         for row in rel:
             f.write(",".join([str(val) for val in row]) + "\n")
+            num_rows += 1
+    write_rel_meta(path, num_rows, schema_header)
+
+
+def rel_version(path_to_rel):
+    """
+    Returns the size in bytes and the modification time in milliseconds of the relation
+    at path_to_rel, which tell whether it changed since its sidecar was written. For the
+    directories of part files Spark writes, these are the total size and the latest
+    modification time of the part files.
+    """
+    if os.path.isdir(path_to_rel):
+        stats = [entry.stat() for entry in os.scandir(path_to_rel)
+                 if entry.is_file() and not entry.name.startswith(("_", "."))]
+    else:
+        stats = [os.stat(path_to_rel)]
+    return sum(stat.st_size for stat in stats), max((stat.st_mtime_ns // 1000000 for stat in stats), default=0)
+
+
+def meta_is_current(meta: dict, path_to_rel):
+    """ Returns whether the relation at path_to_rel is unchanged since sidecar meta was written. """
+    return (meta.get("bytes"), meta.get("mtime")) == rel_version(path_to_rel)
+
+
+def save_rel_meta(path_to_rel, meta: dict):
+    """ Replaces the sidecar of the relation at path_to_rel, such that readers never see a partial one. """
+    meta_path = path_to_rel + META_SUFFIX
+    tmp_path = "{}.{}".format(meta_path, os.getpid())
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_rel_meta(path_to_rel, num_rows, schema_header):
+    """ Writes the sidecar of the CSV relation at path_to_rel, once the relation is complete. """
+    schema = schema_header.split(",")
+    num_bytes, mtime = rel_version(path_to_rel)
+    meta = {
+        "rows": num_rows,
+        "cols": len(schema),
+        "schema": schema,
+        # tell whether the relation was rewritten since
+        "bytes": num_bytes,
+        "mtime": mtime
+    }
+    save_rel_meta(path_to_rel, meta)
+
+
+def _scan_rel_meta(path_to_rel):
+    """ Counts the non-blank rows of a CSV relation with a header. """
+    num_rows = 0
+    with open(path_to_rel, "rb") as f:
+        header = f.readline()
+        for line in f:
+            if line.strip():
+                num_rows += 1
+    schema = header.decode("utf-8").strip().split(",")
+    return {"rows": num_rows, "cols": len(schema), "schema": schema}
+
+
+def read_rel_meta(path_to_rel, scan: bool = True):
+    """
+    Returns the row count, column count and schema of the CSV relation at path_to_rel,
+    from its sidecar if that is up to date and by scanning the relation otherwise
+    (or None, unless scan is set).
+
+    >>> import tempfile
+    >>> job_dir = tempfile.mkdtemp()
+    >>> write_rel(job_dir, "rel.csv", [[1, 2], [3, 4], [5, 6]], "a,b")  # doctest: +ELLIPSIS
+    Will write to .../rel.csv
+    >>> meta = read_rel_meta(job_dir + "/rel.csv")
+    >>> meta["rows"], meta["cols"], meta["schema"]
+    (3, 2, ['a', 'b'])
+
+    Rewriting the relation outdates the sidecar, even if the size stays the same, and
+    blank lines are not counted as rows:
+
+    >>> with open(job_dir + "/rel.csv", "w") as f:
+    ...     _ = f.write("a,b\\n1,2\\n\\n\\n3,4\\n\\n\\n")
+    >>> os.utime(job_dir + "/rel.csv", ns=(0, 0))
+    >>> read_rel_meta(job_dir + "/rel.csv") == {"rows": 2, "cols": 2, "schema": ["a", "b"]}
+    True
+    >>> read_rel_meta(job_dir + "/rel.csv", scan=False) is None
+    True
+    """
+    try:
+        with open(path_to_rel + META_SUFFIX, "r") as f:
+            meta = json.load(f)
+        if meta_is_current(meta, path_to_rel):
+            return meta
+    except (OSError, ValueError):
+        pass
+    return _scan_rel_meta(path_to_rel) if scan else None
 
 
 def read_rel(path_to_rel):
@@ -30,6 +149,53 @@ def read_rel(path_to_rel):
     return rows
 
 
+def _bin_schema(schema_header):
+    schema = schema_header.encode("utf-8")
+    padding = -(BIN_HEADER.size + len(schema)) % BIN_INT_SIZE
+    return schema + b"\0" * padding
+
+
+def _write_bin_header(f, num_cols, num_rows, schema_header):
+    schema = _bin_schema(schema_header)
+    f.write(BIN_HEADER.pack(BIN_MAGIC, num_cols, num_rows, len(schema)))
+    f.write(schema)
+
+
+def _read_bin_header(buf, path_to_rel):
+    """ Returns column count, row count and offset of the first column block. """
+    magic, num_cols, num_rows, schema_len = BIN_HEADER.unpack_from(buf, 0)
+    if magic != BIN_MAGIC:
+        raise Exception("{} is not a binary relation file".format(path_to_rel))
+    return num_cols, num_rows, BIN_HEADER.size + schema_len
+
+
+def write_rel_bin(job_dir, rel_name, rel, schema_header):
+    print("Will write to {}/{}".format(job_dir, rel_name))
+    path = "{}/{}".format(job_dir, rel_name)
+    num_cols = len(schema_header.split(","))
+    with open(path, "wb") as f:
+        _write_bin_header(f, num_cols, len(rel), schema_header)
+        for idx in range(num_cols):
+            col = array("q", (row[idx] for row in rel))
+            if sys.byteorder == "big":
+                col.byteswap()
+            f.write(col.tobytes())
+
+
+def read_rel_bin(path_to_rel):
+    with open(path_to_rel, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        num_cols, num_rows, offset = _read_bin_header(buf, path_to_rel)
+        cols = []
+        for _ in range(num_cols):
+            col = array("q")
+            col.frombytes(buf[offset:offset + num_rows * BIN_INT_SIZE])
+            if sys.byteorder == "big":
+                col.byteswap()
+            cols.append(col)
+            offset += num_rows * BIN_INT_SIZE
+    return [list(row) for row in zip(*cols)]
+
+
 def project(rel, selected_cols):
     return [[row[idx] for idx in selected_cols] for row in rel]
 
@@ -156,118 +322,114 @@ def distinct_count(rel, selected_col):
     return [[len(distinct(rel, [selected_col]))]]
 
 
-def receive_rel(sock: socket, num_cols: int):
-    num_elements_bytes = sock.recv(INT_SIZE)
-    num_elements = struct.unpack('i', num_elements_bytes)[0]
-    total_size = num_elements * INT_SIZE
-    byte_buf = bytearray(total_size)
-    view = memoryview(byte_buf)
-    while total_size:
-        received = sock.recv_into(view, total_size)
+def _recv_into(sock: socket, buf):
+    view = memoryview(buf).cast("B")
+    while view:
+        received = sock.recv_into(view)
+        if not received:
+            raise Exception("Connection closed before all data was received")
         view = view[received:]
-        total_size -= received
-    element_it = struct.iter_unpack("i", byte_buf)
-
-    rel = []
-    col_idx = 0
-    row = []
-    for el in element_it:
-        row.append(el[0])
-        col_idx += 1
-        if col_idx >= num_cols:
-            rel.append(row)
-            col_idx = 0
-            row = []
-    byte_buf = None
-    return rel
 
 
-def receive_set(sock: socket):
-    num_elements_bytes = sock.recv(INT_SIZE)
-    num_elements = struct.unpack('i', num_elements_bytes)[0]
-    total_size = num_elements * INT_SIZE
-    byte_buf = bytearray(total_size)
-    view = memoryview(byte_buf)
-    while total_size:
-        received = sock.recv_into(view, total_size)
-        view = view[received:]
-        total_size -= received
-    element_it = struct.iter_unpack("i", byte_buf)
+def receive_array(sock: socket):
+    """ Receives a flat array of ints sent with send_array straight into its buffer. """
+    num_elements = np.empty(1, dtype=NET_INT_TYPE)
+    _recv_into(sock, num_elements)
+    arr = np.empty(num_elements[0], dtype=NET_INT_TYPE)
+    _recv_into(sock, arr)
+    return arr
+
+
+def send_array(sock: socket, arr):
+    """
+    Sends a flat array of ints, raising OverflowError for ints that don't fit in 64 bits.
+
+    >>> left, right = socket.socketpair()
+    >>> send_array(left, [1, -2, 1 << 40])
+    >>> receive_array(right).tolist()
+    [1, -2, 1099511627776]
+    >>> send_array(left, [1 << 64])  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    OverflowError: Python int too large to convert to C long
+    """
+    arr = np.ascontiguousarray(arr, dtype=NET_INT_TYPE)
+    sock.sendall(struct.pack("<q", arr.size))
+    sock.sendall(arr)
 
-    rel = set()
-    for el in element_it:
-        rel.add(el[0])
-    byte_buf = None
-    return rel
+
+def receive_rel(sock: socket, num_cols: int):
+    return receive_array(sock).reshape(-1, num_cols).tolist()
+
+
+def receive_set(sock: socket):
+    return set(receive_array(sock).tolist())
 
 
 def send_rel(sock: socket, rel: list):
-    num_elements = len(rel) * (len(rel[0]) if rel else 0)
-    sock.sendall(struct.pack("i", num_elements))
-    as_bytes = bytearray(num_elements * INT_SIZE)
-    idx = 0
-    for row in rel:
-        for el in row:
-            struct.pack_into("i", as_bytes, idx, el)
-            idx += INT_SIZE
-    sock.sendall(as_bytes)
+    send_array(sock, np.array(rel, dtype=NET_INT_TYPE).reshape(-1))
 
 
-def public_join_as_server(host: str, port: int, rel: list, key_col: int):
-    import gc
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((host, port))
+def _key_array(rel: list, key_col: int):
+    return np.fromiter((row[key_col] for row in rel), dtype=np.int64, count=len(rel))
+
+
+def _match(left_keys, right_keys):
+    """
+    Returns the left and right positions of all pairs of equal keys. Pairs are in
+    right-row order and, within a right row, in left-row order, as from join.
+
+    >>> [idx.tolist() for idx in _match(np.array([1, 2, 1]), np.array([5, 1, 2]))]
+    [[0, 2, 1], [1, 1, 2]]
+    """
+    left_order = np.argsort(left_keys, kind="stable")
+    sorted_left_keys = left_keys[left_order]
+    lo = np.searchsorted(sorted_left_keys, right_keys, side="left")
+    counts = np.searchsorted(sorted_left_keys, right_keys, side="right") - lo
+    right_idx = np.repeat(np.arange(len(right_keys)), counts)
+    group_offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    left_idx = left_order[np.repeat(lo, counts) + group_offsets]
+    return left_idx, right_idx
+
 
-    server_socket.listen(5)
+def _match_by_key(left_keys, right_keys):
+    """ Same as _match, with pairs stably sorted by key, as from sort_by(join(...), 0). """
+    left_idx, right_idx = _match(left_keys, right_keys)
+    order = np.argsort(right_keys[right_idx], kind="stable")
+    return left_idx[order], right_idx[order]
+
+
+def _pub_join_keys_as_server(host: str, port: int, my_keys):
+    """ Returns the indexes of own rows in the joined relation, sending the client those of its rows. """
+    server_socket = listen(host, port, 5)
     print("server started and listening")
     client_socket, address = server_socket.accept()
-    other_rel = receive_rel(client_socket, 1)
+    other_keys = receive_array(client_socket)
     print("done receive")
-    my_keys = project_indeces(project(rel, [key_col]))
-    print("done project")
-
-    other_keys = project_indeces(other_rel)
-    gc.collect()
-    print("start join")
-    joined = sort_by(join(my_keys, other_keys, 1, 1), 0)
-    other_keys = None
-    my_keys = None
+    my_idx, other_idx = _match_by_key(my_keys, other_keys)
     print("done join")
-    other_cols = project(joined, [2])
-    print("done other project")
-    send_rel(client_socket, other_cols)
-    other_cols = None
+    send_array(client_socket, other_idx)
     print("done send")
-    res_rel = []
-    for idx in joined:
-        res_rel.append(rel[idx[1]])
     server_socket.close()
-    return res_rel
+    return my_idx
 
 
-def public_join_as_client(host: str, port: int, rel: list, key_col: int):
-    sock = None
-    connected = False
-    while not connected:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((host, port))
-            connected = True
-        except Exception as e:
-            print(e)
-            connected = False
-            time.sleep(.042)
-    send_rel(sock, project(rel, [key_col]))
-    rel_back = receive_rel(sock, 1)
-    res_rel = []
-    for idx in rel_back:
-        res_rel.append(rel[idx[0]])
+def _pub_join_keys_as_client(host: str, port: int, my_keys):
+    sock = connect(host, port)
+    send_array(sock, my_keys)
+    my_idx = receive_array(sock)
     sock.close()
-    # num_cols = len(rel[0]) if rel else 0
-    # cols_to_keep = [i for i in range(num_cols) if i != key_col]
-    return res_rel
-    # return project(res_rel, cols_to_keep)
+    return my_idx
+
+
+def public_join_as_server(host: str, port: int, rel: list, key_col: int):
+    my_idx = _pub_join_keys_as_server(host, port, _key_array(rel, key_col))
+    return [rel[idx] for idx in my_idx.tolist()]
+
+
+def public_join_as_client(host: str, port: int, rel: list, key_col: int):
+    my_idx = _pub_join_keys_as_client(host, port, _key_array(rel, key_col))
+    return [rel[idx] for idx in my_idx.tolist()]
 
 
 def key_union(left: list, right: list, l: int, r: int):
@@ -324,72 +486,110 @@ def construct_index_rel(keys: list, other_keys: list):
     return keys + other_keys
 
 
+def _with_dummy(rel, num_cols: int):
+    """ Returns rel as a matrix with a trailing row of ones standing in for the other party's rows. """
+    return np.vstack((np.asarray(rel, dtype=np.int64).reshape(-1, num_cols), np.ones((1, num_cols), dtype=np.int64)))
+
+
+def _reconstruct(left, right, left_col: int, right_col: int, idx_rel, me: int, num_left_cols: int,
+                 num_right_cols: int):
+    """ Same as reconstruct, on relations given as (rows, columns) matrices. Returns a matrix. """
+    idx_rel = np.asarray(idx_rel).reshape(-1, 4)
+    num_left_rows, num_right_rows = len(left), len(right)
+    left = _with_dummy(left, num_left_cols)
+    right = _with_dummy(right, num_right_cols)
+    left_side = left[np.where(idx_rel[:, 1] == me, idx_rel[:, 0], num_left_rows)]
+    right_side = right[np.where(idx_rel[:, 3] == me, idx_rel[:, 2], num_right_rows)]
+    return np.column_stack((right_side[:, right_col], np.delete(left_side, left_col, axis=1),
+                            np.delete(right_side, right_col, axis=1)))
+
+
 def reconstruct(
         left_rel: list,
         right_rel: list,
         left_col: int,
         right_col: int,
-        idx_rel: list,
+        idx_rel,
         me: int,
         num_left_cols: int,
         num_right_cols: int):
-    res_rel = []
-    left_dummy = [1 for _ in range(num_left_cols)]
-    right_dummy = [1 for _ in range(num_right_cols)]
+    return _reconstruct(left_rel, right_rel, left_col, right_col, idx_rel, me, num_left_cols, num_right_cols).tolist()
 
-    for left_idx, left_own, right_idx, right_own in idx_rel:
-        left_side = left_rel[left_idx] if left_own == me else left_dummy
-        right_side = right_rel[right_idx] if right_own == me else right_dummy
-        right_key = right_side[right_col]
 
-        from_left = [val for (idx, val) in enumerate(left_side) if idx != left_col]
-        from_right = [val for (idx, val) in enumerate(right_side) if idx != right_col]
+def _pub_intersect_keys_as_server(host: str, port: int, my_keys):
+    server_socket = listen(host, port)
+    print("server started and listening")
+    client_socket, address = server_socket.accept()
+    other_keys = receive_array(client_socket)
+    print("done receive")
+    res = np.intersect1d(my_keys, other_keys)
+    send_array(client_socket, res)
+    server_socket.close()
+    return res
+
 
-        joined_row = [right_key] + from_left + from_right
-        res_rel.append(joined_row)
-    return res_rel
+def _pub_intersect_keys_as_client(host: str, port: int, my_keys):
+    sock = connect(host, port)
+    send_array(sock, my_keys)
+    res = receive_array(sock)
+    sock.close()
+    return res
 
 
 def pub_intersect_as_server(host: str,
                             port: int,
                             my_rel: list,
                             my_key_col: int):
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((host, port))
+    res = _pub_intersect_keys_as_server(host, port, _key_array(my_rel, my_key_col))
+    return [[key] for key in res.tolist()]
 
-    server_socket.listen(1)
+
+def pub_intersect_as_client(host: str,
+                            port: int,
+                            my_rel: list,
+                            my_key_col: int):
+    res = _pub_intersect_keys_as_client(host, port, _key_array(my_rel, my_key_col))
+    return [[key] for key in res.tolist()]
+
+
+def _owned_indeces(num_mine: int, num_other: int):
+    """ Returns row indexes into the concatenation of both parties' rows, and the party owning each row. """
+    idx = np.concatenate((np.arange(num_mine), np.arange(num_other)))
+    owner = np.concatenate((np.zeros(num_mine, dtype=np.int64), np.ones(num_other, dtype=np.int64)))
+    return idx, owner
+
+
+def _pub_join_part_keys_as_server(host: str, port: int, my_left_keys, my_right_keys):
+    """
+    Returns the joined relation as rows of (left row index, left row owner, right row index,
+    right row owner), where the server owns rows 0 and the client rows 1, and sends it to the client.
+    """
+    server_socket = listen(host, port)
     print("server started and listening")
     client_socket, address = server_socket.accept()
-
-    other_keys = receive_set(client_socket)
-    my_keys = to_set(my_rel, my_key_col)
+    other_left_keys = receive_array(client_socket)
+    other_right_keys = receive_array(client_socket)
     print("done receive")
-    res = to_rel(my_keys & other_keys)
-    send_rel(client_socket, res)
+    left_idx, left_owner = _owned_indeces(len(my_left_keys), len(other_left_keys))
+    right_idx, right_owner = _owned_indeces(len(my_right_keys), len(other_right_keys))
+    left_matches, right_matches = _match_by_key(np.concatenate((my_left_keys, other_left_keys)),
+                                                np.concatenate((my_right_keys, other_right_keys)))
+    idx_rel = np.column_stack((left_idx[left_matches], left_owner[left_matches],
+                               right_idx[right_matches], right_owner[right_matches]))
+    print("done join")
+    send_array(client_socket, idx_rel)
+    print("done send")
     server_socket.close()
-    return res
+    return idx_rel
 
 
-def pub_intersect_as_client(host: str,
-                            port: int,
-                            my_rel: list,
-                            my_key_col: int):
-    sock = None
-    connected = False
-    while not connected:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((host, port))
-            connected = True
-        except Exception as e:
-            print(e)
-            connected = False
-            time.sleep(.042)
-    send_rel(sock, project(my_rel, [my_key_col]))
-    res = receive_rel(sock, 1)
+def _pub_join_part_keys_as_client(host: str, port: int, my_left_keys, my_right_keys):
+    sock = connect(host, port)
+    send_array(sock, my_left_keys)
+    send_array(sock, my_right_keys)
+    idx_rel = receive_array(sock)
     sock.close()
-    return res
+    return idx_rel
 
 
 def public_join_as_server_part(
@@ -401,37 +601,10 @@ def public_join_as_server_part(
         right_key_col: int,
         num_left_cols: int,
         num_right_cols: int):
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((host, port))
-
-    server_socket.listen(1)
-    print("server started and listening")
-    client_socket, address = server_socket.accept()
-
-    other_left_keys = receive_rel(client_socket, 1)
-    other_right_keys = receive_rel(client_socket, 1)
-    print("done receive")
-
-    left = construct_index_rel(project(my_left_rel, [left_key_col]), other_left_keys)
-    right = construct_index_rel(project(my_right_rel, [right_key_col]), other_right_keys)
-
-    print("done project")
-
-    # gc.collect()
-    print("start join")
-    joined = sort_by(join(left, right, 2, 2), 0)
-    print("done join")
-    idx_rel = project(joined, [1, 2, 3, 4])
-    joined = None
-    # gc.collect()
-    print("done other project")
-    send_rel(client_socket, idx_rel)
-    print("done send")
-    res_rel = reconstruct(my_left_rel, my_right_rel, left_key_col, right_key_col, idx_rel, 0, num_left_cols,
-                          num_right_cols)
-    server_socket.close()
-    return res_rel
+    idx_rel = _pub_join_part_keys_as_server(host, port, _key_array(my_left_rel, left_key_col),
+                                            _key_array(my_right_rel, right_key_col))
+    return reconstruct(my_left_rel, my_right_rel, left_key_col, right_key_col, idx_rel, 0, num_left_cols,
+                       num_right_cols)
 
 
 def public_join_as_client_part(
@@ -443,21 +616,8 @@ def public_join_as_client_part(
         right_key_col: int,
         num_left_cols: int,
         num_right_cols: int):
-    sock = None
-    connected = False
-    while not connected:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((host, port))
-            connected = True
-        except Exception as e:
-            print(e)
-            connected = False
-            time.sleep(.042)
-    send_rel(sock, project(left_rel, [left_key_col]))
-    send_rel(sock, project(right_rel, [right_key_col]))
-    idx_rel = receive_rel(sock, 4)
-    sock.close()
+    idx_rel = _pub_join_part_keys_as_client(host, port, _key_array(left_rel, left_key_col),
+                                            _key_array(right_rel, right_key_col))
     return reconstruct(left_rel, right_rel, left_key_col, right_key_col, idx_rel, 1, num_left_cols, num_right_cols)
 
 
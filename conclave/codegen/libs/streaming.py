@@ -0,0 +1,404 @@
+"""
+Streaming runtime for generated Python code.
+
+A relation is a Stream, a re-iterable sequence of row batches where each batch is a
+list of rows as in conclave.codegen.libs.python. Row-local operators are applied
+lazily, batch by batch. Blocking operators hold at most MEMORY_BUDGET rows in memory
+and spill sorted runs to disk beyond that.
+"""
+import atexit
+import heapq
+import itertools
+import mmap
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+from array import array
+
+import conclave.codegen.libs.python as _rows
+
+BATCH_SIZE = 10000
+MEMORY_BUDGET = 1000000
+
+_spill_dir = None
+
+
+def set_limits(batch_size: int, memory_budget: int):
+    global BATCH_SIZE, MEMORY_BUDGET
+    BATCH_SIZE = batch_size
+    MEMORY_BUDGET = memory_budget
+
+
+class Stream:
+    """ Relation whose batches are produced anew by calling batches() on each iteration. """
+
+    def __init__(self, batches: callable):
+        self._batches = batches
+
+    def __iter__(self):
+        return iter(self._batches())
+
+    def __add__(self, other):
+        return concat([self, other])
+
+    def __radd__(self, other):
+        return concat([other, self])
+
+    def __len__(self):
+        return sum(len(batch) for batch in self)
+
+
+def _batched(rows):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, BATCH_SIZE))
+        if not batch:
+            return
+        yield batch
+
+
+def _stream(rel):
+    """ Lets plain lists of rows be used wherever a Stream is expected. """
+    if isinstance(rel, Stream):
+        return rel
+    return Stream(lambda: _batched(rel))
+
+
+def _rows_of(rel):
+    return itertools.chain.from_iterable(_stream(rel))
+
+
+def materialize(rel):
+    return list(_rows_of(rel))
+
+
+def _spill_file():
+    global _spill_dir
+    if _spill_dir is None:
+        _spill_dir = tempfile.mkdtemp(prefix="conclave-spill-")
+        atexit.register(shutil.rmtree, _spill_dir, True)
+    fd, path = tempfile.mkstemp(suffix=".spill", dir=_spill_dir)
+    os.close(fd)
+    return path
+
+
+def _write_run(rows):
+    path = _spill_file()
+    with open(path, "wb") as f:
+        for batch in _batched(rows):
+            pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _read_run(path):
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def _result(rows):
+    """ Output of a blocking operator, kept in memory if it fits the budget and spilled otherwise. """
+    rows = iter(rows)
+    buffered = list(itertools.islice(rows, MEMORY_BUDGET + 1))
+    if len(buffered) <= MEMORY_BUDGET:
+        return buffered
+    path = _write_run(itertools.chain(buffered, rows))
+    return Stream(lambda: _read_run(path))
+
+
+def _sorted_rows(rows, key):
+    """ Stable external sort: sorted runs of MEMORY_BUDGET rows are spilled, then merged. """
+    runs = []
+    buffer = []
+    for row in rows:
+        buffer.append(row)
+        if len(buffer) >= MEMORY_BUDGET:
+            buffer.sort(key=key)
+            runs.append(_write_run(buffer))
+            buffer = []
+    buffer.sort(key=key)
+    if not runs:
+        return iter(buffer)
+    # heapq.merge prefers earlier runs on ties, which keeps the sort stable
+    run_rows = [itertools.chain.from_iterable(_read_run(run)) for run in runs]
+    return heapq.merge(*run_rows, buffer, key=key)
+
+
+def read_rel(path_to_rel):
+    def _read():
+        with open(path_to_rel, "r") as f:
+            rows = []
+            for raw_row in f:
+                try:
+                    rows.append([int(val) for val in raw_row.split(",")])
+                except ValueError:
+                    print("skipped header")
+                if len(rows) >= BATCH_SIZE:
+                    yield rows
+                    rows = []
+            if rows:
+                yield rows
+
+    return Stream(_read)
+
+
+def write_rel(job_dir, rel_name, rel, schema_header):
+    print("Will write to {}/{}".format(job_dir, rel_name))
+    path = "{}/{}".format(job_dir, rel_name)
+    num_rows = 0
+    with open(path, "w") as f:
+        # hack header
+        f.write(schema_header + "\n")
+        for batch in _stream(rel):
+            f.writelines(",".join([str(val) for val in row]) + "\n" for row in batch)
+            num_rows += len(batch)
+    _rows.write_rel_meta(path, num_rows, schema_header)
+
+
+def read_rel_bin(path_to_rel):
+    def _read():
+        with open(path_to_rel, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            num_cols, num_rows, offset = _rows._read_bin_header(buf, path_to_rel)
+            block_size = num_rows * _rows.BIN_INT_SIZE
+            for start in range(0, num_rows, BATCH_SIZE):
+                end = min(start + BATCH_SIZE, num_rows)
+                cols = []
+                for idx in range(num_cols):
+                    col = array("q")
+                    col_offset = offset + idx * block_size
+                    col.frombytes(buf[col_offset + start * _rows.BIN_INT_SIZE:col_offset + end * _rows.BIN_INT_SIZE])
+                    if sys.byteorder == "big":
+                        col.byteswap()
+                    cols.append(col)
+                yield [list(row) for row in zip(*cols)]
+
+    return Stream(_read)
+
+
+def write_rel_bin(job_dir, rel_name, rel, schema_header):
+    print("Will write to {}/{}".format(job_dir, rel_name))
+    path = "{}/{}".format(job_dir, rel_name)
+    num_cols = len(schema_header.split(","))
+    # the row count goes in the header, so column blocks are staged until the input is exhausted
+    col_paths = [_spill_file() for _ in range(num_cols)]
+    col_files = [open(col_path, "wb") for col_path in col_paths]
+    num_rows = 0
+    for batch in _stream(rel):
+        num_rows += len(batch)
+        for idx, col_file in enumerate(col_files):
+            col = array("q", (row[idx] for row in batch))
+            if sys.byteorder == "big":
+                col.byteswap()
+            col_file.write(col.tobytes())
+    for col_file in col_files:
+        col_file.close()
+    with open(path, "wb") as f:
+        _rows._write_bin_header(f, num_cols, num_rows, schema_header)
+        for col_path in col_paths:
+            with open(col_path, "rb") as col_file:
+                shutil.copyfileobj(col_file, f)
+            os.remove(col_path)
+
+
+def _pipeline(rel, f: callable):
+    """ Applies f to each batch of rel lazily. """
+    return Stream(lambda: (f(batch) for batch in _stream(rel)))
+
+
+def project(rel, selected_cols):
+    return _pipeline(rel, lambda batch: _rows.project(batch, selected_cols))
+
+
+def concat(rels: list):
+    return Stream(lambda: itertools.chain.from_iterable(_stream(rel) for rel in rels))
+
+
+def cc_filter(cond_lambda, rel):
+    return _pipeline(rel, lambda batch: _rows.cc_filter(cond_lambda, batch))
+
+
+def arithmetic_project(rel, target_col_idx, f):
+    return _pipeline(rel, lambda batch: _rows.arithmetic_project(batch, target_col_idx, f))
+
+
+def project_indeces(rel):
+    return Stream(lambda: _batched([idx] + rest for (idx, rest) in enumerate(_rows_of(rel))))
+
+
+def comp_neighs(rel, comp_col):
+    def _neighs():
+        vals = (row[comp_col] for row in _rows_of(rel))
+        prev = next(vals, None)
+        for val in vals:
+            yield [int(prev == val)]
+            prev = val
+
+    return Stream(lambda: _batched(_neighs()))
+
+
+def filter_by(rel: list, key_rel: list, key_col: int, use_not_in: bool = False):
+    keys = set(row[0] for row in _rows_of(key_rel))
+    if use_not_in:
+        return _pipeline(rel, lambda batch: _rows.filter_by_not_keys(batch, keys, key_col))
+    else:
+        return _pipeline(rel, lambda batch: _rows.filter_by_keys(batch, keys, key_col))
+
+
+def _aggregate(rel, group_by_idx, value: callable):
+    """
+    Hash aggregation that spills partial results, sorted by key, once more than
+    MEMORY_BUDGET groups are held. Groups are emitted in order of first appearance.
+    """
+    acc = {}
+    runs = []
+    for pos, row in enumerate(_rows_of(rel)):
+        key = row[group_by_idx]
+        if key not in acc:
+            if len(acc) >= MEMORY_BUDGET:
+                runs.append(_write_run(sorted([[key, first, total] for key, (first, total) in acc.items()])))
+                acc = {}
+            acc[key] = [pos, 0]
+        acc[key][1] += value(row)
+    if not runs:
+        return _result([key, total] for key, (first, total) in acc.items())
+
+    runs.append(_write_run(sorted([[key, first, total] for key, (first, total) in acc.items()])))
+    merged = heapq.merge(*[itertools.chain.from_iterable(_read_run(run)) for run in runs], key=lambda e: e[0])
+
+    def _combine():
+        for key, group in itertools.groupby(merged, lambda e: e[0]):
+            group = list(group)
+            yield [min(e[1] for e in group), key, sum(e[2] for e in group)]
+
+    return _result([key, total] for first, key, total in _sorted_rows(_combine(), key=lambda e: e[0]))
+
+
+# TODO handle multi-column case and aggregators other than sum
+def aggregate(rel, group_by_idx, over_idx, aggregator):
+    return _aggregate(rel, group_by_idx, lambda row: row[over_idx])
+
+
+def aggregate_count(rel, group_by_idx):
+    return _aggregate(rel, group_by_idx, lambda row: 1)
+
+
+def sort_by(rel, sort_by_col):
+    return _result(_sorted_rows(_rows_of(rel), key=lambda row: row[sort_by_col]))
+
+
+def distinct(rel, selected_cols):
+    # TODO: general case
+    assert len(selected_cols) == 1
+    # the row-based runtime emits keys in set iteration order, which is unspecified;
+    # here they come out sorted
+    keys = _sorted_rows((row[selected_cols[0]] for row in _rows_of(rel)), key=None)
+    return _result([key] for key, _ in itertools.groupby(keys))
+
+
+def distinct_count(rel, selected_col):
+    return [[len(distinct(rel, [selected_col]))]]
+
+
+def _joined_row(left_row, right_row, left_col, right_col):
+    vals_from_left = [val for (idx, val) in enumerate(left_row) if idx != left_col]
+    vals_from_right = [val for (idx, val) in enumerate(right_row) if idx != right_col]
+    return [right_row[right_col]] + vals_from_left + vals_from_right
+
+
+def _probe(left_row_map, right, left_col, right_col):
+    for right_row in _rows_of(right):
+        for left_row in left_row_map.get(right_row[right_col], ()):
+            yield _joined_row(left_row, right_row, left_col, right_col)
+
+
+def _merge_join(left, right, left_col, right_col):
+    """
+    Sort-merge join over spilled runs. Output rows are tagged with their right and
+    left positions and sorted on them to match the order of the hash join.
+    """
+    left_sorted = _sorted_rows(([row[left_col], pos, row] for pos, row in enumerate(_rows_of(left))),
+                               key=lambda e: e[0])
+    right_sorted = _sorted_rows(([row[right_col], pos, row] for pos, row in enumerate(_rows_of(right))),
+                                key=lambda e: e[0])
+
+    def _matches():
+        lefts = itertools.groupby(left_sorted, lambda e: e[0])
+        rights = itertools.groupby(right_sorted, lambda e: e[0])
+        left_group, right_group = next(lefts, None), next(rights, None)
+        while left_group is not None and right_group is not None:
+            if left_group[0] < right_group[0]:
+                left_group = next(lefts, None)
+            elif left_group[0] > right_group[0]:
+                right_group = next(rights, None)
+            else:
+                left_rows = list(left_group[1])
+                for _, right_pos, right_row in right_group[1]:
+                    for _, left_pos, left_row in left_rows:
+                        yield [right_pos, left_pos, _joined_row(left_row, right_row, left_col, right_col)]
+                left_group, right_group = next(lefts, None), next(rights, None)
+
+    return _result(row for _, _, row in _sorted_rows(_matches(), key=lambda e: (e[0], e[1])))
+
+
+def join(left, right, left_col, right_col):
+    left_row_map = dict()
+    for num_left, left_row in enumerate(_rows_of(left)):
+        if num_left >= MEMORY_BUDGET:
+            return _merge_join(left, right, left_col, right_col)
+        key = left_row[left_col]
+        if key not in left_row_map:
+            left_row_map[key] = []
+        left_row_map[key].append(left_row)
+    return Stream(lambda: _batched(_probe(left_row_map, right, left_col, right_col)))
+
+
+def join_flags(left, right, left_col, right_col):
+    right = _result(_rows_of(right))
+
+    def _flags():
+        for left_row in _rows_of(left):
+            for right_row in _rows_of(right):
+                yield [int(left_row[left_col] == right_row[right_col])]
+
+    return Stream(lambda: _batched(_flags()))
+
+
+# the operators below are only used around MPC boundaries and run on materialized relations
+
+def index_agg(rel, over_col, distinct_keys, indeces, aggregator):
+    return _rows.index_agg(materialize(rel), over_col, materialize(distinct_keys), materialize(indeces), aggregator)
+
+
+def indexes_to_flags(lookup, rel_size):
+    return _rows.indexes_to_flags(materialize(lookup), rel_size)
+
+
+def arrange_by_flags(lookups, indexes_and_flags):
+    return _rows.arrange_by_flags(materialize(lookups), materialize(indexes_and_flags))
+
+
+def key_union_as_rel(left: list, right: list, l: int, r: int):
+    return _rows.key_union_as_rel(materialize(left), materialize(right), l, r)
+
+
+def pub_intersect_as_server(host: str, port: int, my_rel: list, my_key_col: int):
+    return _rows.pub_intersect_as_server(host, port, materialize(my_rel), my_key_col)
+
+
+def pub_intersect_as_client(host: str, port: int, my_rel: list, my_key_col: int):
+    return _rows.pub_intersect_as_client(host, port, materialize(my_rel), my_key_col)
+
+
+def pub_join(host: str, port: int, is_server: bool, rel: list, key_col: int):
+    return _rows.pub_join(host, port, is_server, materialize(rel), key_col)
+
+
+def pub_join_part(host: str, port: int, is_server: bool, rel: list, other_rel: list, key_col: int, num_left_cols: int,
+                  num_right_cols: int):
+    return _rows.pub_join_part(host, port, is_server, materialize(rel), materialize(other_rel), key_col,
+                               num_left_cols, num_right_cols)
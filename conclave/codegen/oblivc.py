@@ -242,23 +242,52 @@ class OblivcCodeGen(CodeGen):
         Generate code for Join operations.
         """
 
-        if not self.config.use_leaky_ops:
+        left_join_col = join_op.left_join_cols[0].idx
+        right_join_col = join_op.right_join_cols[0].idx
+        unique_left = self._has_unique_keys(join_op.left_parent, left_join_col)
+        unique_right = self._has_unique_keys(join_op.right_parent, right_join_col)
+
+        if self.config.use_leaky_ops:
             template = open(
-                "{0}/join.tmpl".format(self.template_directory), 'r').read()
+                "{0}/join_leaky.tmpl".format(self.template_directory), 'r').read()
+        elif self.oc_config.sort_merge_join and (unique_left or unique_right):
+            # at most one output row per row of the other side, so the join can
+            # sort both sides together instead of comparing every pair of rows
+            template = open(
+                "{0}/join_sort_merge.tmpl".format(self.template_directory), 'r').read()
         else:
             template = open(
-                "{0}/join_leaky.tmpl".format(self.template_directory), 'r').read()
+                "{0}/join.tmpl".format(self.template_directory), 'r').read()
 
         data = {
-            "JOINCOL_ONE": join_op.left_join_cols[0].idx,
-            "JOINCOL_TWO": join_op.right_join_cols[0].idx,
+            "JOINCOL_ONE": left_join_col,
+            "JOINCOL_TWO": right_join_col,
             "LEFT": join_op.get_left_in_rel().name,
             "RIGHT": join_op.get_right_in_rel().name,
-            "OUTREL": join_op.out_rel.name
+            "OUTREL": join_op.out_rel.name,
+            "UNIQUE_LEFT": "true" if unique_left else "false"
         }
 
         return pystache.render(template, data)
 
+    @staticmethod
+    def _has_unique_keys(node: OpNode, key_col: int):
+        """
+        Return whether no two rows output by node have the same value in column key_col,
+        as is the case for the group column of an aggregation.
+        """
+
+        if isinstance(node, Aggregate):
+            return len(node.group_cols) == 1 and key_col == 0
+        elif isinstance(node, Distinct):
+            return len(node.selected_cols) == 1 and key_col == 0
+        elif isinstance(node, Project):
+            return OblivcCodeGen._has_unique_keys(node.parent, node.selected_cols[key_col].idx)
+        elif isinstance(node, (Close, Filter, SortBy, Limit)):
+            return OblivcCodeGen._has_unique_keys(node.parent, key_col)
+        else:
+            return False
+
     # TODO: opens to both parties for now, make configurable
     def _generate_open(self, open_op: Open):
         """
@@ -408,6 +437,9 @@ class OblivcCodeGen(CodeGen):
         else:
             leaky = 0
 
+        # inputs of MPC jobs are mostly outputs of the parties' local jobs, so their row counts
+        # are only known (and public) once the job runs. Sums and counts then compare every
+        # pair of rows instead of sorting them by key if there are at most PAIRWISE_ROWS.
         data = {
             "IN_REL": agg_op.get_in_rel().name,
             "OUT_REL": agg_op.out_rel.name,
@@ -415,7 +447,8 @@ class OblivcCodeGen(CodeGen):
             "AGG_COL": agg_op.agg_col.idx,
             "USE_LEAKY": leaky,
             "COUNT_COL": 2,
-            "LEAKY": "Leaky" if leaky else ""
+            "LEAKY": "Leaky" if leaky else "",
+            "PAIRWISE_ROWS": self.oc_config.pairwise_agg_rows
         }
 
         return pystache.render(template, data)
@@ -4,20 +4,43 @@ import pystache
 
 import conclave.dag as ccdag
 from conclave.codegen import CodeGen
+from conclave.config import PythonConfig
 from conclave.job import PythonJob
 from conclave.rel import Column
 
+# runtime library module under conclave.codegen.libs for each engine
+RUNTIMES = {
+    "rows": "python",
+    "columnar": "columnar",
+    "streaming": "streaming",
+    "parallel": "parallel"
+}
+
 
 class PythonCodeGen(CodeGen):
     """ Codegen subclass for generating Python code. """
 
     def __init__(self, config, dag: ccdag.Dag, space="    ",
-                 template_directory="{}/templates/python".format(os.path.dirname(os.path.realpath(__file__)))):
-        """ Initialize PythonCodeGen object. """
+                 template_directory="{}/templates/python".format(os.path.dirname(os.path.realpath(__file__))),
+                 intermediate_rels: [set, None] = None):
+        """
+        Initialize PythonCodeGen object.
+
+        Relations named in intermediate_rels are only handed between local python jobs,
+        so they are stored in the binary relation format instead of CSV.
+        """
         super(PythonCodeGen, self).__init__(config, dag)
         self.template_directory = template_directory
+        self.intermediate_rels = intermediate_rels if intermediate_rels is not None else set()
         # this belongs inside config
         self.space = space
+        if config is not None and "python" in config.system_configs:
+            self.python_config = config.system_configs["python"]
+        else:
+            self.python_config = PythonConfig()
+        self.columnar = self.python_config.engine == "columnar"
+        # the other engines already avoid per-op passes in their own way
+        self.fuse_ops = self.python_config.engine == "rows"
 
     def _generate_outputs(self, op_code: str):
         """ Generate code to save outputs to file. """
@@ -26,12 +49,29 @@ class PythonCodeGen(CodeGen):
             op_code += self._generate_output(leaf)
         return op_code
 
+    def _generate_setup(self):
+        """ Generate code that configures the runtime before any op runs. """
+        if self.python_config.engine == "streaming":
+            return "{}set_limits({}, {})\n".format(
+                self.space,
+                self.python_config.batch_size,
+                self.python_config.memory_budget
+            )
+        elif self.python_config.engine == "parallel":
+            return "{}set_partitions({}, {})\n".format(
+                self.space,
+                self.python_config.num_partitions,
+                self.python_config.partition_rows
+            )
+        return ""
+
     def _generate_job(self, job_name: str, code_directory: str, op_code: str):
         """ Top level code generation function. """
-        op_code = self._generate_outputs(op_code)
+        op_code = self._generate_setup() + self._generate_outputs(op_code)
         template = open("{}/top_level.tmpl"
                         .format(self.template_directory), 'r').read()
         data = {
+            'RUNTIME': RUNTIMES[self.python_config.engine],
             'OP_CODE': op_code
         }
 
@@ -41,7 +81,11 @@ class PythonCodeGen(CodeGen):
 
     def _generate_concat(self, concat_op: ccdag.Concat):
         """ Generate code for Concat operations. """
-        in_rel_str = " + ".join([in_rel.name for in_rel in concat_op.get_in_rels()])
+        in_rel_names = [in_rel.name for in_rel in concat_op.get_in_rels()]
+        if self.columnar:
+            in_rel_str = "concat([{}])".format(", ".join(in_rel_names))
+        else:
+            in_rel_str = " + ".join(in_rel_names)
         return "{}{} = {}\n".format(
             self.space,
             concat_op.out_rel.name,
@@ -70,14 +114,20 @@ class PythonCodeGen(CodeGen):
         else:
             raise Exception("Unknown aggregator {}".format(agg_op.aggregator))
 
-    @staticmethod
-    def _col_or_scalar(col):
-        return "row[{}]".format(col.idx) if isinstance(col, Column) else str(col)
+    def _col_or_scalar(self, col):
+        """
+        Row-based lambdas index into a single row, columnar ones into the relation's columns.
+        """
+        var = "cols" if self.columnar else "row"
+        return "{}[{}]".format(var, col.idx) if isinstance(col, Column) else str(col)
+
+    def _lambda_head(self):
+        return "lambda cols : " if self.columnar else "lambda row : "
 
     def _generate_multiply(self, mult_op: ccdag.Multiply):
         """ Generate code for Multiply operations. """
         operands = [self._col_or_scalar(col) for col in mult_op.operands]
-        lambda_expr = "lambda row : " + " * ".join([op for op in operands])
+        lambda_expr = self._lambda_head() + " * ".join([op for op in operands])
         return "{}{} = arithmetic_project({}, {}, {})\n".format(
             self.space,
             mult_op.out_rel.name,
@@ -97,9 +147,17 @@ class PythonCodeGen(CodeGen):
         >>> div = cc.divide(left, "div", "a", ["a", 1, "b"])
         >>> PythonCodeGen(None, Dag({}), "")._generate_divide(div)
         'div = arithmetic_project(left, 0, lambda row : int(row[0] / 1 / row[1]))\\n'
+        >>> from conclave.config import CodeGenConfig, PythonConfig
+        >>> conf = CodeGenConfig().with_python_config(PythonConfig("columnar"))
+        >>> PythonCodeGen(conf, Dag({}), "")._generate_divide(div)
+        'div = arithmetic_project(left, 0, lambda cols : as_int(cols[0] / 1 / cols[1]))\\n'
         """
         operands = [self._col_or_scalar(col) for col in div_op.operands]
-        lambda_expr = "lambda row : int({})".format(" / ".join([op for op in operands]))
+        lambda_expr = "{}{}({})".format(
+            self._lambda_head(),
+            "as_int" if self.columnar else "int",
+            " / ".join([op for op in operands])
+        )
         return "{}{} = arithmetic_project({}, {}, {})\n".format(
             self.space,
             div_op.out_rel.name,
@@ -108,30 +166,110 @@ class PythonCodeGen(CodeGen):
             lambda_expr
         )
 
-    def _generate_output(self, leaf: ccdag.OpNode):
-        """ Generate code for storing a single output. """
+    def _generate_write(self, leaf: ccdag.OpNode):
+        """ Generate code for writing a relation to a file, in binary format if no other backend reads it. """
         schema_header = ",".join(['"' + col.name + '"' for col in leaf.out_rel.columns])
-        return "{}write_rel('{}', '{}.csv', {}, '{}')\n".format(
+        return "{}{}('{}', '{}.{}', {}, '{}')\n".format(
             self.space,
+            "write_rel_bin" if leaf.out_rel.name in self.intermediate_rels else "write_rel",
             self.config.output_path,
             leaf.out_rel.name,
+            "rel" if leaf.out_rel.name in self.intermediate_rels else "csv",
             leaf.out_rel.name,
             schema_header
         )
 
-    def _generate_persist(self, leaf: ccdag.Persist):
-        """ Generate code for storing a single output via a Persist op. """
-        schema_header = ",".join(['"' + col.name + '"' for col in leaf.out_rel.columns])
-        return "{}write_rel('{}', '{}.csv', {}, '{}')\n".format(
+    def _generate_fused(self, ops: list):
+        """
+        Generate a single list comprehension for a chain of row-local ops. Column
+        expressions are substituted through the chain, so no intermediate rows are built.
+
+        >>> from conclave.utils import defCol
+        >>> import conclave.lang as cc
+        >>> from conclave.dag import Dag
+        >>> cols_in = [defCol("a", "INTEGER", 1), defCol("b", "INTEGER", 1)]
+        >>> inpt = cc.create("inpt", cols_in, {1})
+        >>> filtered = cc.cc_filter(inpt, "filtered", "a", "<", scalar=5)
+        >>> mult = cc.multiply(filtered, "mult", "c", ["a", "b"])
+        >>> indexed = cc.index(mult, "indexed", "idx")
+        >>> proj = cc.project(indexed, "proj", ["idx", "c"])
+        >>> PythonCodeGen(None, Dag({}), "")._generate_fused([filtered, mult, indexed, proj])
+        'proj = [[idx, row[2]] for idx, row in enumerate([row[0], row[1], (row[0] * row[1])] for row in inpt if row[0] < 5)]\\n'
+        """
+        source = ops[0].get_in_rel().name
+        loop_var = "row"
+        cols = ["row[{}]".format(col.idx) for col in ops[0].get_in_rel().columns]
+        conds = []
+
+        def _comprehension():
+            return "{} for {} in {}{}".format(
+                "[{}]".format(", ".join(cols)),
+                loop_var,
+                source,
+                " if " + " and ".join(conds) if conds else ""
+            )
+
+        for op in ops:
+            if isinstance(op, ccdag.Project):
+                cols = [cols[col.idx] for col in op.selected_cols]
+            elif isinstance(op, ccdag.Filter):
+                conds.append("{} {} {}".format(
+                    cols[op.filter_col.idx],
+                    op.operator,
+                    op.scalar if op.is_scalar else cols[op.other_col.idx]
+                ))
+            elif isinstance(op, (ccdag.Multiply, ccdag.Divide)):
+                operands = [cols[col.idx] if isinstance(col, Column) else str(col) for col in op.operands]
+                if isinstance(op, ccdag.Multiply):
+                    expr = "({})".format(" * ".join(operands))
+                else:
+                    expr = "int({})".format(" / ".join(operands))
+                if op.target_col.idx < len(cols):
+                    cols[op.target_col.idx] = expr
+                else:
+                    cols.append(expr)
+            elif isinstance(op, ccdag.Index):
+                # indeces count rows that survived the filters so far, so those are applied first
+                identity = ["row[{}]".format(idx) for idx in range(len(cols))]
+                if conds or cols != identity or loop_var != "row":
+                    source = "enumerate({})".format(_comprehension())
+                else:
+                    source = "enumerate({})".format(source)
+                loop_var = "idx, row"
+                cols = ["idx"] + ["row[{}]".format(idx) for idx in range(len(cols))]
+                conds = []
+            else:
+                raise Exception("Cannot fuse {}".format(type(op).__name__))
+
+        return "{}{} = [{}]\n".format(
             self.space,
-            self.config.output_path,
-            leaf.out_rel.name,
-            leaf.out_rel.name,
-            schema_header
+            ops[-1].out_rel.name,
+            _comprehension()
         )
 
+    def _generate_output(self, leaf: ccdag.OpNode):
+        """ Generate code for storing a single output. """
+        return self._generate_write(leaf)
+
+    def _generate_persist(self, leaf: ccdag.Persist):
+        """ Generate code for storing a single output via a Persist op. """
+        return self._generate_write(leaf)
+
     def _generate_create(self, create_op: ccdag.Create):
         """ Generate code for loading input data. """
+        if create_op.out_rel.name in self.intermediate_rels:
+            return "{}{} = read_rel_bin('{}')\n".format(
+                self.space,
+                create_op.out_rel.name,
+                self.config.input_path + "/" + create_op.out_rel.name + ".rel"
+            )
+        if self.columnar:
+            return "{}{} = read_rel('{}', {})\n".format(
+                self.space,
+                create_op.out_rel.name,
+                self.config.input_path + "/" + create_op.out_rel.name + ".csv",
+                len(create_op.out_rel.columns)
+            )
         return "{}{} = read_rel('{}')\n".format(
             self.space,
             create_op.out_rel.name,
@@ -172,10 +310,11 @@ class PythonCodeGen(CodeGen):
 
     def _generate_filter(self, filter_op: ccdag.Filter):
         """ Generate code for Filter operations. """
-        cond_lambda = "lambda row : row[{}] {} {}".format(
-            filter_op.filter_col.idx,
+        cond_lambda = "{}{} {} {}".format(
+            self._lambda_head(),
+            self._col_or_scalar(filter_op.filter_col),
             filter_op.operator,
-            filter_op.scalar if filter_op.is_scalar else "row[{}]".format(filter_op.other_col.idx)
+            filter_op.scalar if filter_op.is_scalar else self._col_or_scalar(filter_op.other_col)
         )
         return "{}{} = cc_filter({}, {})\n".format(
             self.space,
@@ -265,10 +404,11 @@ class PythonCodeGen(CodeGen):
         """ Generate code for IndexesToFlags operations. """
         stage = indexes_to_flags_op.stage
         if stage == 0:
-            return "{}{} = indexes_to_flags({}, len({}))\n".format(
+            return "{}{} = indexes_to_flags({}, {}({}))\n".format(
                 self.space,
                 indexes_to_flags_op.out_rel.name,
                 indexes_to_flags_op.get_right_in_rel().name,
+                "num_rows" if self.columnar else "len",
                 indexes_to_flags_op.get_left_in_rel().name
             )
         elif stage == 1:
@@ -283,6 +423,12 @@ class PythonCodeGen(CodeGen):
 
     def _generate_num_rows(self, num_rows_op: ccdag.NumRows):
         """ Generate code for NumRows operations. """
+        if self.columnar:
+            return "{}{} = [np.array([num_rows({})])]\n".format(
+                self.space,
+                num_rows_op.out_rel.name,
+                num_rows_op.get_in_rel().name
+            )
         return "{}{} = [[len({})]]\n".format(
             self.space,
             num_rows_op.out_rel.name,
@@ -319,6 +465,16 @@ class PythonCodeGen(CodeGen):
 
     def _generate_index_aggregate(self, index_agg_op: ccdag.IndexAggregate):
         # TODO: generalize
+        if self.columnar:
+            return "{}{} = index_agg({}, {}, {}, {}, '{}')\n".format(
+                self.space,
+                index_agg_op.out_rel.name,
+                index_agg_op.get_in_rel().name,
+                index_agg_op.agg_col.idx,
+                index_agg_op.sorted_keys_op.out_rel.name,
+                index_agg_op.eq_flag_op.out_rel.name,
+                index_agg_op.aggregator
+            )
         return "{}{} = index_agg({}, {}, {}, {}, lambda x, y: x {} y)\n".format(
             self.space,
             index_agg_op.out_rel.name,
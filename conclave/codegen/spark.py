@@ -3,15 +3,9 @@ import pystache
 
 import conclave.dag as saldag
 from conclave.codegen import CodeGen
+from conclave.config import SparkConfig
 from conclave.job import SparkJob
-
-
-def cache_var(op_node: saldag.OpNode):
-    """ Determines whether a Spark DF must be cached. """
-    if len(op_node.children) > 1:
-        return ".cache()"
-    else:
-        return ''
+from conclave.stats import estimate
 
 
 def convert_type(type_str: str):
@@ -25,15 +19,132 @@ def convert_type(type_str: str):
         raise Exception("Unsupported data type")
 
 
+def _leaves_below(node: saldag.OpNode):
+    """ Returns the leaves among node and its descendants. """
+
+    leaves = set()
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if current.is_leaf():
+            leaves.add(current)
+        stack.extend(current.children)
+
+    return leaves
+
+
 class SparkCodeGen(CodeGen):
     """ Codegen subclass for generating Spark code. """
 
+    fuse_ops = True
+
     def __init__(self, config, dag: saldag.Dag,
                  header_flag=True,
-                 template_directory="{}/templates/spark".format(os.path.dirname(os.path.realpath(__file__)))):
+                 template_directory="{}/templates/spark".format(os.path.dirname(os.path.realpath(__file__))),
+                 parquet_rels: [set, None] = None):
+        """
+        Initialize SparkCodeGen object.
+
+        Relations named in parquet_rels are not read by any other backend, so they are
+        stored as Parquet instead of CSV.
+        """
         super(SparkCodeGen, self).__init__(config, dag)
         self.template_directory = template_directory
         self.header_flag = header_flag
+        self.parquet_rels = parquet_rels if parquet_rels is not None else set()
+        self.spark_config = config.system_configs.get("spark", SparkConfig(None))
+        self.stats = None
+        # relations that are persisted, and leaves that have been stored so far
+        self.persisted = set()
+        self.stored = set()
+
+    def _estimate_rows(self, node: saldag.OpNode):
+        """
+        Returns the estimated number of rows of node's output relation, or None if it is
+        unknown. Estimates come from the statistics kept along with inputs, see conclave.stats.
+        """
+
+        if self.stats is None:
+            self.stats = estimate(self.dag, self.config.input_path, scan=False)
+
+        return self.stats[node].rows
+
+    def _is_small(self, node: saldag.OpNode):
+        """ Returns whether node's output relation is small enough to be broadcast. """
+
+        estimate = self._estimate_rows(node)
+        return estimate is not None and estimate <= self.spark_config.broadcast_rows
+
+    def _broadcast_side(self, join_op: saldag.Join):
+        """ Returns the parent of join_op that is broadcast to the other's partitions, if any. """
+
+        small = [parent for parent in [join_op.left_parent, join_op.right_parent] if self._is_small(parent)]
+        if not small:
+            return None
+        return min(small, key=self._estimate_rows)
+
+    def _shuffle_key(self, parent: saldag.OpNode, child: saldag.OpNode):
+        """
+        Returns the column of parent's output that child shuffles it by, if any.
+
+        >>> import conclave.lang as sal
+        >>> from conclave.config import CodeGenConfig
+        >>> from conclave.utils import defCol
+        >>> left = sal.create("left", [defCol("a", "INTEGER", [1]), defCol("b", "INTEGER", [1])], {1})
+        >>> right = sal.create("right", [defCol("c", "INTEGER", [1]), defCol("d", "INTEGER", [1])], {1})
+        >>> joined = sal.join(left, right, "joined", ["a"], ["c"])
+        >>> codegen = SparkCodeGen(CodeGenConfig("shuffle"), saldag.OpDag({left, right}))
+        >>> codegen._shuffle_key(left, joined), codegen._shuffle_key(right, joined)
+        ('a', 'c')
+        """
+
+        if isinstance(child, saldag.Aggregate) and len(child.group_cols) == 1:
+            return child.group_cols[0].name
+        elif isinstance(child, saldag.Join) and len(child.left_join_cols) == 1 \
+                and self._broadcast_side(child) is None:
+            # a self-join shuffles its input by both keys
+            if child.left_parent is child.right_parent:
+                return None
+            elif parent is child.right_parent:
+                return child.right_join_cols[0].name
+            return child.left_join_cols[0].name
+        return None
+
+    def _cache_var(self, op_node: saldag.OpNode):
+        """
+        Determines whether a Spark DF must be cached, and if so how. DFs that several
+        children shuffle by the same key are partitioned by it once, before caching.
+        """
+
+        if len(op_node.children) <= 1:
+            return ''
+
+        self.persisted.add(op_node)
+
+        code = ''
+        keys = [self._shuffle_key(op_node, child) for child in op_node.children]
+        keys = [key for key in keys if key is not None]
+        if len(keys) > 1 and len(set(keys)) == 1:
+            code += ".repartition('{}')".format(keys[0])
+
+        estimate = self._estimate_rows(op_node)
+        if estimate is not None and estimate <= self.spark_config.memory_rows:
+            code += ".cache()"
+        else:
+            code += ".persist(MEMORY_AND_DISK_SER)"
+
+        return code
+
+    def _unpersist_code(self):
+        """ Unpersist the DFs whose leaves have all been stored, i.e. that are no longer needed. """
+
+        code = ''
+        for node in sorted(self.persisted, key=lambda n: n.out_rel.name):
+            if all(leaf in self.stored for leaf in _leaves_below(node)):
+                code += "{}.unpersist()\n".format(node.out_rel.name)
+                self.persisted.remove(node)
+
+        return code
 
     def _generate_job(self, job_name: str, code_directory: str, op_code: str):
         """ Returns generated Spark code and Job object. """
@@ -51,20 +162,30 @@ class SparkCodeGen(CodeGen):
 
         return job, op_code
 
+    def _rel_path(self, directory: str, rel_name: str):
+        """ Returns the path relation rel_name is stored at in directory. """
+
+        extension = "parquet" if rel_name in self.parquet_rels else "csv"
+        return "{}/{}.{}".format(directory, rel_name, extension)
+
     def _generate_store(self, op: saldag.OpNode):
         """ Generate code for storing a relation. """
 
         store_code = ''
         if op.is_leaf():
+            template_name = "store_parquet" if op.out_rel.name in self.parquet_rels else "store"
             template = open(
-                "{}/store.tmpl".format(self.template_directory), 'r').read()
+                "{}/{}.tmpl".format(self.template_directory, template_name), 'r').read()
             data = {
                 'RELATION_NAME': op.out_rel.name,
-                'OUTPUT_PATH': self.config.output_path,
+                'PATH': self._rel_path(self.config.output_path, op.out_rel.name)
             }
 
             store_code += pystache.render(template, data)
 
+            self.stored.add(op)
+            store_code += self._unpersist_code()
+
         return store_code
 
     def _generate_sort_by(self, sort_op: saldag.SortBy):
@@ -80,7 +201,7 @@ class SparkCodeGen(CodeGen):
             'INREL': sort_op.get_in_rel().name,
             'OUTREL': sort_op.out_rel.name,
             'SORT_COL': sort_col,
-            'CACHE_VAR': cache_var(sort_op)
+            'CACHE_VAR': self._cache_var(sort_op)
         }
 
         return pystache.render(template, data) + store_code
@@ -97,7 +218,7 @@ class SparkCodeGen(CodeGen):
             'INREL': index_op.get_in_rel().name,
             'OUTREL': index_op.out_rel.name,
             'IDX_COL': index_op.idx_col_name,
-            'CACHE_VAR': cache_var(index_op)
+            'CACHE_VAR': self._cache_var(index_op)
         }
 
         return pystache.render(template, data) + store_code
@@ -113,7 +234,7 @@ class SparkCodeGen(CodeGen):
             'INREL': comp_neighs_op.get_in_rel().name,
             'OUTREL': comp_neighs_op.out_rel.name,
             'COMP_COL': comp_neighs_op.comp_col.name,
-            'CACHE_VAR': cache_var(comp_neighs_op)
+            'CACHE_VAR': self._cache_var(comp_neighs_op)
         }
 
         return pystache.render(template, data) + store_code
@@ -144,7 +265,7 @@ class SparkCodeGen(CodeGen):
             'AGGCOLS': aggcol_str,
             'INREL': agg_op.get_in_rel().name,
             'OUTREL': agg_op.out_rel.name,
-            'CACHE_VAR': cache_var(agg_op),
+            'CACHE_VAR': self._cache_var(agg_op),
             'OLD': old,
             'NEW': new
         }
@@ -168,13 +289,16 @@ class SparkCodeGen(CodeGen):
         data = {
             'INRELS': ', '.join(r.name for r in concat_op.get_in_rels()),
             'OUTREL': concat_op.out_rel.name,
-            'CACHE_VAR': cache_var(concat_op)
+            'CACHE_VAR': self._cache_var(concat_op)
         }
 
         return pystache.render(template, data) + store_code
 
     def _generate_create(self, create_op: saldag.Create):
 
+        if create_op.out_rel.name in self.parquet_rels:
+            return self._generate_create_parquet(create_op)
+
         template = open(
             "{}/create.tmpl".format(self.template_directory), 'r').read()
 
@@ -185,12 +309,53 @@ class SparkCodeGen(CodeGen):
             'RELATION_NAME': create_op.out_rel.name,
             'SCHEMA': 'StructType([' + ','.join(schema) + '])',
             'INPUT_PATH': self.config.input_path + '/' + create_op.out_rel.name + '.csv',
-            'CACHE_VAR': cache_var(create_op),
+            'CACHE_VAR': self._cache_var(create_op),
             'HEADER_FLAG': "True" if self.header_flag else "False"
         }
 
         return pystache.render(template, data)
 
+    @staticmethod
+    def _used_cols(create_op: saldag.Create):
+        """
+        Returns the names of the columns of create_op's relation that its children use,
+        or None if they may use all of them.
+        """
+
+        used = set()
+        for child in create_op.children:
+            if not isinstance(child, saldag.Project):
+                return None
+            used |= {col.name for col in child.selected_cols}
+
+        return used
+
+    def _generate_create_parquet(self, create_op: saldag.Create):
+        """ Generate code for loading a relation stored as Parquet, reading only the columns in use. """
+
+        template = open(
+            "{}/create_parquet.tmpl".format(self.template_directory), 'r').read()
+
+        cols = [col.name for col in create_op.out_rel.columns]
+        used_cols = self._used_cols(create_op)
+        if used_cols is not None:
+            cols = [col for col in cols if col in used_cols]
+
+        data = {
+            'RELATION_NAME': create_op.out_rel.name,
+            'INPUT_PATH': self._rel_path(self.config.input_path, create_op.out_rel.name),
+            'COLS': cols,
+            'CACHE_VAR': self._cache_var(create_op)
+        }
+
+        return pystache.render(template, data)
+
+    def _generate_persist(self, persist_op: saldag.Persist):
+        """ Generate code for Persist operations. """
+
+        return "\n{} = {}\n".format(persist_op.out_rel.name, persist_op.get_in_rel().name) \
+            + self._generate_store(persist_op)
+
     def _generate_join(self, join_op: saldag.Join):
         """ Generate code for Join operations. """
 
@@ -208,12 +373,20 @@ class SparkCodeGen(CodeGen):
         template = open(
             "{0}/{1}.tmpl".format(self.template_directory, 'join'), 'r').read()
 
+        left_parent = join_op.get_left_in_rel().name
+        right_parent = join_op.get_right_in_rel().name
+        broadcast_side = self._broadcast_side(join_op)
+        if broadcast_side is join_op.left_parent:
+            left_parent = "F.broadcast({})".format(left_parent)
+        elif broadcast_side is join_op.right_parent:
+            right_parent = "F.broadcast({})".format(right_parent)
+
         data = {
-            'LEFT_PARENT': join_op.get_left_in_rel().name,
-            'RIGHT_PARENT': join_op.get_right_in_rel().name,
+            'LEFT_PARENT': left_parent,
+            'RIGHT_PARENT': right_parent,
             'JOIN_COLS': [join_col.name for join_col in join_cols],
             'OUTREL': join_op.out_rel.name,
-            'CACHE_VAR': cache_var(join_op)
+            'CACHE_VAR': self._cache_var(join_op)
         }
 
         return pystache.render(template, data) + store_code
@@ -234,7 +407,7 @@ class SparkCodeGen(CodeGen):
             'COLS': [c.name for c in cols],
             'INREL': project_op.get_in_rel().name,
             'OUTREL': project_op.out_rel.name,
-            'CACHE_VAR': cache_var(project_op)
+            'CACHE_VAR': self._cache_var(project_op)
         }
 
         return pystache.render(template, data) + store_code
@@ -265,7 +438,7 @@ class SparkCodeGen(CodeGen):
             'TARGET': mult_op.target_col.name,
             'INREL': mult_op.get_in_rel().name,
             'OUTREL': mult_op.out_rel.name,
-            'CACHE_VAR': cache_var(mult_op)
+            'CACHE_VAR': self._cache_var(mult_op)
         }
 
         return pystache.render(template, data) + store_code
@@ -297,11 +470,85 @@ class SparkCodeGen(CodeGen):
             'INREL': div_op.get_in_rel().name,
             'OUTREL': div_op.out_rel.name,
             'TO_INT_CAST': ".cast('integer')" if div_op.target_col.type_str == "INTEGER" else "",
-            'CACHE_VAR': cache_var(div_op)
+            'CACHE_VAR': self._cache_var(div_op)
         }
 
         return pystache.render(template, data) + store_code
 
+    def _generate_filter(self, filter_op: saldag.Filter):
+        """ Generate code for Filter operations. """
+
+        return self._generate_fused([filter_op])
+
+    def _generate_fused(self, ops: list):
+        """
+        Generate a single where/select for a chain of row-local ops. Column expressions
+        are substituted through the chain; only Index needs an intermediate DataFrame.
+        """
+
+        template = open(
+            "{}/fused.tmpl".format(self.template_directory), 'r').read()
+
+        code = ''
+        in_rel = ops[0].get_in_rel()
+        cols = ["F.col('{}')".format(col.name) for col in in_rel.columns]
+        conds = []
+
+        def _operand(col):
+            return cols[col.idx] if hasattr(col, 'name') else "F.lit({})".format(col)
+
+        def _render(in_rel_name: str, op: saldag.OpNode):
+            data = {
+                'INREL': in_rel_name,
+                'OUTREL': op.out_rel.name,
+                'WHERE': " & ".join(conds),
+                'COLS': ", ".join("{}.alias('{}')".format(expr, col.name)
+                                  for expr, col in zip(cols, op.out_rel.columns)),
+                'CACHE_VAR': self._cache_var(op)
+            }
+            return pystache.render(template, data)
+
+        for idx, op in enumerate(ops):
+            if isinstance(op, saldag.Project):
+                cols = [cols[col.idx] for col in op.selected_cols]
+            elif isinstance(op, saldag.Filter):
+                conds.append("({} {} {})".format(
+                    cols[op.filter_col.idx],
+                    op.operator,
+                    "F.lit({})".format(op.scalar) if op.is_scalar else cols[op.other_col.idx]
+                ))
+            elif isinstance(op, saldag.Multiply):
+                expr = "({})".format(" * ".join(_operand(col) for col in op.operands))
+                if op.target_col.idx < len(cols):
+                    cols[op.target_col.idx] = expr
+                else:
+                    cols.append(expr)
+            elif isinstance(op, saldag.Divide):
+                expr = "({}){}".format(
+                    " / ".join(_operand(col) for col in op.operands),
+                    ".cast('integer')" if op.target_col.type_str == "INTEGER" else ""
+                )
+                if op.target_col.idx < len(cols):
+                    cols[op.target_col.idx] = expr
+                else:
+                    cols.append(expr)
+            elif isinstance(op, saldag.Index):
+                # row numbers depend on the partition sizes of the DataFrame so far, so flush the chain
+                if idx > 0:
+                    code += _render(in_rel.name, ops[idx - 1])
+                code += self._generate_index(op)
+                in_rel = op.out_rel
+                cols = ["F.col('{}')".format(col.name) for col in in_rel.columns]
+                conds = []
+            else:
+                raise Exception("Cannot fuse {}".format(type(op).__name__))
+
+        if not isinstance(ops[-1], saldag.Index):
+            code += _render(in_rel.name, ops[-1])
+            code += self._generate_store(ops[-1])
+
+        return code
+
     def _generate_distinct(self, distinct_op: saldag.Distinct):
         """ Generate code for Distinct operations. """
 
@@ -312,7 +559,7 @@ class SparkCodeGen(CodeGen):
             'COLS': [c.name for c in distinct_op.selected_cols],
             'OUTREL': distinct_op.out_rel.name,
             'INREL': distinct_op.get_in_rel().name,
-            'CACHE_VAR': cache_var(distinct_op)
+            'CACHE_VAR': self._cache_var(distinct_op)
         }
 
         return pystache.render(template, data)
@@ -7,6 +7,7 @@ import warnings
 import conclave.config as cc_conf
 import conclave.dag as ccdag
 import conclave.lang as cc
+import conclave.rel as rel
 import conclave.utils as utils
 from conclave.utils import defCol
 
@@ -121,6 +122,74 @@ def fork_node(node: ccdag.Concat):
         child.update_op_specific_cols()
 
 
+def move_children(children: list, old_parent: ccdag.OpNode, new_parent: ccdag.OpNode):
+    """ Makes new_parent the parent of children instead of old_parent. """
+
+    for child in children:
+        child.replace_parent(old_parent, new_parent)
+        old_parent.children.remove(child)
+        new_parent.children.add(child)
+
+
+def appends_target(node: [ccdag.Multiply, ccdag.Divide]):
+    """ Whether node stores its result in a new column, see cc.multiply. """
+
+    return node.target_col.name != getattr(node.operands[0], "name", None)
+
+
+def join_sources(node: ccdag.Join):
+    """ Returns (left index, right index) of the input columns of each output column of node. """
+
+    left_keys = [col.idx for col in node.left_join_cols]
+    right_keys = [col.idx for col in node.right_join_cols]
+    sources = list(zip(left_keys, right_keys))
+    sources += [(idx, None) for idx in range(len(node.get_left_in_rel().columns)) if idx not in left_keys]
+    sources += [(None, idx) for idx in range(len(node.get_right_in_rel().columns)) if idx not in right_keys]
+
+    return sources
+
+
+def update_op_cols_by_name(node: ccdag.OpNode):
+    """
+    Looks up the columns node refers to in its inputs by name, for after its inputs' columns
+    were dropped or re-ordered, when update_op_specific_cols can't go by their indexes.
+    """
+
+    def _find(columns: list, col):
+        return utils.find(columns, col.name) if isinstance(col, rel.Column) else col
+
+    if isinstance(node, ccdag.Create):
+        return
+    elif isinstance(node, ccdag.UnaryOpNode):
+        in_cols = node.get_in_rel().columns
+        if isinstance(node, ccdag.Filter):
+            node.filter_col = _find(in_cols, node.filter_col)
+            node.other_col = _find(in_cols, node.other_col)
+        elif isinstance(node, ccdag.SortBy):
+            node.sort_by_col = _find(in_cols, node.sort_by_col)
+        elif isinstance(node, (ccdag.Project, ccdag.Distinct)):
+            node.selected_cols = [_find(in_cols, col) for col in node.selected_cols]
+        elif isinstance(node, ccdag.DistinctCount):
+            node.selected_col = _find(in_cols, node.selected_col)
+        elif isinstance(node, ccdag.Aggregate):
+            node.group_cols = [_find(in_cols, col) for col in node.group_cols]
+            node.agg_col = _find(in_cols, node.agg_col)
+        elif isinstance(node, ccdag.PubIntersect):
+            node.col = _find(in_cols, node.col)
+        elif isinstance(node, (ccdag.Multiply, ccdag.Divide)):
+            target_cols = node.out_rel.columns if appends_target(node) else in_cols
+            node.target_col = _find(target_cols, node.target_col)
+            node.operands = [_find(in_cols, col) for col in node.operands]
+    elif isinstance(node, ccdag.FilterBy):
+        node.filter_col = _find(node.get_left_in_rel().columns, node.filter_col)
+    elif isinstance(node, ccdag.Union):
+        node.left_col = _find(node.get_left_in_rel().columns, node.left_col)
+        node.right_col = _find(node.get_right_in_rel().columns, node.right_col)
+    elif isinstance(node, ccdag.Join):
+        node.left_join_cols = [_find(node.get_left_in_rel().columns, col) for col in node.left_join_cols]
+        node.right_join_cols = [_find(node.get_right_in_rel().columns, col) for col in node.right_join_cols]
+
+
 class DagRewriter:
     """ Top level DAG rewrite class. Traverses DAG, reorders nodes, and applies optimizations to certain nodes. """
 
@@ -288,6 +357,394 @@ class DagRewriter:
         pass
 
 
+class SelectionPushDown(DagRewriter):
+    """
+    Moves Filter and FilterBy nodes towards the Create nodes, below the operators they
+    commute with: Joins (if they only read columns of one side, or keys), Concats, and
+    Aggregates (if they only read group columns), as well as row-wise operators. Filters
+    that end up above an MPC boundary run in the owning party's local job, which shrinks
+    every relation that is secret-shared and everything computed from it. Filters on
+    private columns aren't moved past joins on public keys, which run in the clear.
+    """
+
+    # operators whose output columns are read from the same column of their input,
+    # except for the target column of a Multiply or Divide.
+    # Subclasses of these hold extra state and aren't passed.
+    ROW_WISE_OPS = (ccdag.Project, ccdag.SortBy, ccdag.Shuffle, ccdag.Multiply, ccdag.Divide,
+                    ccdag.Close, ccdag.Filter, ccdag.FilterBy)
+
+    def __init__(self, conclave_config: cc_conf.CodeGenConfig):
+        super(SelectionPushDown, self).__init__(conclave_config)
+
+    @staticmethod
+    def _filter_cols(node: [ccdag.Filter, ccdag.FilterBy]):
+
+        if isinstance(node, ccdag.Filter) and not node.is_scalar:
+            return [node.filter_col, node.other_col]
+        return [node.filter_col]
+
+    @staticmethod
+    def _in_parent(node: ccdag.OpNode):
+        """ Returns the parent whose rows node outputs. """
+
+        return node.left_parent if isinstance(node, ccdag.BinaryOpNode) else node.parent
+
+    def _source_col(self, node: ccdag.OpNode, idx: int):
+        """
+        Returns the input column the output column at idx of node is read from,
+        or None if it is computed by node.
+        """
+
+        node_type = type(node)
+        in_cols = self._in_parent(node).out_rel.columns
+        if node_type is ccdag.Project:
+            return node.selected_cols[idx]
+        elif node_type in (ccdag.Multiply, ccdag.Divide):
+            return None if node.out_rel.columns[idx].name == node.target_col.name else in_cols[idx]
+        elif node_type is ccdag.Aggregate:
+            return node.group_cols[idx] if idx < len(node.group_cols) else None
+        elif node_type is ccdag.Distinct:
+            return node.selected_cols[idx]
+        return in_cols[idx]
+
+    @staticmethod
+    def _copy_filter(node: [ccdag.Filter, ccdag.FilterBy], parent: ccdag.OpNode, name: str, cols: list):
+        """ Returns a copy of node below parent that reads cols of parent instead. """
+
+        if isinstance(node, ccdag.Filter):
+            other_col_name = cols[1].name if len(cols) > 1 else None
+            copied = cc.cc_filter(parent, name, cols[0].name, node.operator, other_col_name, node.scalar)
+            copied.other_col = cols[1] if len(cols) > 1 else None
+        else:
+            copied = cc.filter_by(parent, name, cols[0].name, node.right_parent, node.use_not_in)
+        copied.filter_col = cols[0]
+
+        return copied
+
+    def _remove_filter(self, node: [ccdag.Filter, ccdag.FilterBy]):
+        """ Removes node, which was pushed into the inputs of its parent. """
+
+        parent = self._in_parent(node)
+        if isinstance(node, ccdag.FilterBy):
+            node.right_parent.children.remove(node)
+        children = node.get_sorted_children()
+        parent.children.remove(node)
+        for child in children:
+            child.replace_parent(node, parent)
+            parent.children.add(child)
+            child.update_op_specific_cols()
+        # the parent's output takes the place of a collected filter's
+        if not children:
+            parent.out_rel.rename(node.out_rel.name)
+            parent.out_rel.stored_with = node.out_rel.stored_with
+        node.make_orphan()
+        node.children = set()
+
+    def _swap(self, node: [ccdag.Filter, ccdag.FilterBy], parent: ccdag.OpNode, source_cols: list):
+        """ Moves node above parent, which has no other children, to read source_cols of parent's input. """
+
+        grand_parent = self._in_parent(parent)
+        children = node.get_sorted_children()
+
+        node.replace_parent(parent, grand_parent)
+        grand_parent.replace_child(parent, node)
+        parent.replace_parent(grand_parent, node)
+        node.children = {parent}
+        parent.children = set(children)
+        for child in children:
+            child.replace_parent(node, parent)
+            child.update_op_specific_cols()
+
+        if not children:
+            # the parent's output takes the place of a collected filter's
+            parent_name = parent.out_rel.name
+            parent.out_rel.rename(node.out_rel.name)
+            parent.out_rel.stored_with = node.out_rel.stored_with
+            node.out_rel.rename(parent_name)
+        node.out_rel.columns = copy.deepcopy(grand_parent.out_rel.columns)
+        node.out_rel.stored_with = copy.copy(grand_parent.out_rel.stored_with)
+        node.out_rel.update_columns()
+        node.filter_col = source_cols[0]
+        if isinstance(node, ccdag.Filter) and not node.is_scalar:
+            node.other_col = source_cols[1]
+        update_op_cols_by_name(parent)
+
+    def _push(self, node: [ccdag.Filter, ccdag.FilterBy]):
+        """ Pushes node down as far as it commutes with the operators above it. """
+
+        while True:
+            parent = self._in_parent(node)
+            # other children of the parent read the unfiltered relation
+            if len(parent.children) != 1:
+                return
+            # a FilterBy can't be moved next to the relation it filters by
+            if isinstance(node, ccdag.FilterBy) and node.right_parent in parent.parents | {parent}:
+                return
+            col_idxs = [col.idx for col in self._filter_cols(node)]
+            parent_type = type(parent)
+            if parent_type in self.ROW_WISE_OPS or parent_type in (ccdag.Aggregate, ccdag.Distinct):
+                source_cols = [self._source_col(parent, idx) for idx in col_idxs]
+                grand_parent = self._in_parent(parent)
+                if None in source_cols or isinstance(parent, ccdag.FilterBy) and parent.right_parent is grand_parent:
+                    return
+                self._swap(node, parent, source_cols)
+            elif parent_type is ccdag.Concat:
+                for idx, concat_parent in enumerate(copy.copy(parent.ordered)):
+                    cols = [concat_parent.out_rel.columns[col_idx] for col_idx in col_idxs]
+                    copied = self._copy_filter(node, concat_parent, "{}_{}".format(node.out_rel.name, idx), cols)
+                    move_children([parent], concat_parent, copied)
+                    self._push(copied)
+                self._remove_filter(node)
+                return
+            elif parent_type is ccdag.Join and parent.left_parent is not parent.right_parent:
+                # filtering by a private column first would keep a public join from
+                # being used, see HybridOperatorOpt
+                all_pids = set(self.conclave_config.all_pids)
+                if parent.out_rel.columns[0].trust_set == all_pids \
+                        and any(col.trust_set != all_pids for col in self._filter_cols(node)):
+                    return
+                sources = join_sources(parent)
+                join_parents = [parent.left_parent, parent.right_parent]
+                # keys are read from both sides
+                sides = [side for side in range(2) if all(sources[idx][side] is not None for idx in col_idxs)]
+                if not sides:
+                    return
+                for side in sides:
+                    join_parent = join_parents[side]
+                    cols = [join_parent.out_rel.columns[sources[idx][side]] for idx in col_idxs]
+                    copied = self._copy_filter(
+                        node, join_parent, "{}_{}".format(node.out_rel.name, side), cols)
+                    move_children([parent], join_parent, copied)
+                    parent.update_op_specific_cols()
+                    self._push(copied)
+                self._remove_filter(node)
+                return
+            else:
+                return
+
+    def rewrite(self, dag: ccdag.OpDag):
+        """
+        >>> cols_left = [defCol(name, "INTEGER", [1]) for name in ["a", "b"]]
+        >>> cols_right = [defCol(name, "INTEGER", [2]) for name in ["c", "d"]]
+        >>> left = cc.create("left", cols_left, {1})
+        >>> right = cc.create("right", cols_right, {2})
+        >>> joined = cc.join(left, right, "joined", ["a"], ["c"])
+        >>> filtered = cc.cc_filter(joined, "filtered", "b", "==", scalar=1)
+        >>> cc.collect(filtered, 1)
+        >>> SelectionPushDown(cc_conf.CodeGenConfig()).rewrite(ccdag.OpDag({left, right}))
+        SelectionPushDown rewriting left
+        SelectionPushDown rewriting right
+        SelectionPushDown rewriting joined
+        SelectionPushDown rewriting filtered
+        >>> left_filtered = next(iter(left.children))
+        >>> left_filtered.out_rel.dbg_str()
+        'filtered_0([a {1}, b {1}]) {1}'
+        >>> joined.left_parent is left_filtered, joined.out_rel.name, joined.out_rel.stored_with
+        (True, 'filtered', {1})
+        """
+
+        for node in dag.top_sort():
+            print(type(self).__name__, "rewriting", node.out_rel.name)
+            # filters pushed earlier may have been removed or moved
+            if type(node) in (ccdag.Filter, ccdag.FilterBy) and node.parents:
+                self._push(node)
+
+
+class ColumnPruning(DagRewriter):
+    """
+    Drops columns that no leaf or Persist node depends on. The columns each node must
+    output are computed backwards from the leaves, every output is narrowed down to those
+    (plus what its inputs still carry), and a Project is inserted after each Create with
+    unused columns, so that they are dropped by the input party's local job instead of
+    being secret-shared.
+    """
+
+    # operators whose output columns are those of their (left) input.
+    # Subclasses of the operators below hold extra state and are left as they are.
+    PASS_THROUGH_OPS = (ccdag.Filter, ccdag.SortBy, ccdag.Shuffle, ccdag.Limit,
+                        ccdag.Close, ccdag.Open, ccdag.FilterBy)
+    # operators whose output columns don't depend on which input columns are kept
+    FIXED_OUTPUT_OPS = (ccdag.Aggregate, ccdag.Distinct, ccdag.DistinctCount, ccdag.Union,
+                        ccdag.PubIntersect, ccdag.NumRows)
+    ARITHMETIC_OPS = (ccdag.Multiply, ccdag.Divide)
+
+    def __init__(self, conclave_config: cc_conf.CodeGenConfig):
+        super(ColumnPruning, self).__init__(conclave_config)
+        # by Join node, computed before any of its inputs are narrowed
+        self.join_sources = {}
+
+    @staticmethod
+    def _read_cols(node: ccdag.OpNode):
+        """ Returns the columns node reads from its (left) input, other than those it outputs. """
+
+        if isinstance(node, ccdag.Filter):
+            return [node.filter_col] if node.is_scalar else [node.filter_col, node.other_col]
+        elif isinstance(node, ccdag.SortBy):
+            return [node.sort_by_col]
+        elif isinstance(node, ccdag.FilterBy):
+            return [node.filter_col]
+        elif isinstance(node, ccdag.Aggregate):
+            return node.group_cols + ([node.agg_col] if isinstance(node.agg_col, rel.Column) else [])
+        elif isinstance(node, ccdag.Distinct):
+            return node.selected_cols
+        elif isinstance(node, ccdag.DistinctCount):
+            return [node.selected_col]
+        elif isinstance(node, ccdag.PubIntersect):
+            return [node.col]
+        elif isinstance(node, ColumnPruning.ARITHMETIC_OPS):
+            return [col for col in node.operands if isinstance(col, rel.Column)]
+        return []
+
+    def _demands(self, node: ccdag.OpNode, needed: set):
+        """ Returns (parent, indexes of the parent's columns node reads) for the parents of node. """
+
+        node_type = type(node)
+        if node_type in self.PASS_THROUGH_OPS and node_type is not ccdag.FilterBy:
+            return [(node.parent, needed | {col.idx for col in self._read_cols(node)})]
+        elif node_type is ccdag.FilterBy:
+            right_width = len(node.get_right_in_rel().columns)
+            return [(node.left_parent, needed | {node.filter_col.idx}),
+                    (node.right_parent, set(range(right_width)))]
+        elif node_type is ccdag.Project:
+            return [(node.parent, {node.selected_cols[idx].idx for idx in needed})]
+        elif node_type in self.ARITHMETIC_OPS:
+            in_width = len(node.get_in_rel().columns)
+            return [(node.parent, {idx for idx in needed if idx < in_width}
+                     | {col.idx for col in self._read_cols(node)})]
+        elif node_type is ccdag.Index:
+            return [(node.parent, {idx - 1 for idx in needed if idx > 0})]
+        elif node_type is ccdag.Union:
+            return [(node.left_parent, {node.left_col.idx}), (node.right_parent, {node.right_col.idx})]
+        elif node_type in self.FIXED_OUTPUT_OPS:
+            return [(node.parent, {col.idx for col in self._read_cols(node)})]
+        elif node_type is ccdag.Join:
+            sources = self.join_sources[node] = join_sources(node)
+            left = {col.idx for col in node.left_join_cols}
+            right = {col.idx for col in node.right_join_cols}
+            left |= {sources[idx][0] for idx in needed if sources[idx][0] is not None}
+            right |= {sources[idx][1] for idx in needed if sources[idx][1] is not None}
+            return [(node.left_parent, left), (node.right_parent, right)]
+        elif node_type is ccdag.Concat:
+            return [(parent, set(needed)) for parent in node.ordered]
+        # anything else reads all of its inputs
+        return [(parent, set(range(len(parent.out_rel.columns)))) for parent in node.parents]
+
+    @staticmethod
+    def _insert_project(parent: ccdag.OpNode, children: list, name: str, col_idxs: list):
+        """ Inserts a Project of the columns at col_idxs of parent between parent and children. """
+
+        proj = cc.project(parent, name, [parent.out_rel.columns[idx].name for idx in col_idxs])
+        move_children(children, parent, proj)
+
+        return proj
+
+    def _kept_cols(self, node: ccdag.OpNode, needed: set, kept: dict):
+        """
+        Returns the indexes of node's output columns that are kept, given the indexes
+        kept of each parent's output.
+        """
+
+        node_type = type(node)
+        width = len(node.out_rel.columns)
+        if node_type in self.PASS_THROUGH_OPS:
+            parent = node.left_parent if node_type is ccdag.FilterBy else node.parent
+            return kept[parent]
+        elif node_type in (ccdag.Project, ccdag.Concat):
+            return sorted(needed)
+        elif node_type in self.ARITHMETIC_OPS:
+            return kept[node.parent] + ([width - 1] if appends_target(node) else [])
+        elif node_type is ccdag.Index:
+            return [0] + [idx + 1 for idx in kept[node.parent]]
+        elif node_type is ccdag.Join:
+            left, right = set(kept[node.left_parent]), set(kept[node.right_parent])
+            return [idx for idx, (left_idx, right_idx) in enumerate(self.join_sources[node])
+                    if left_idx in left or right_idx in right]
+        return list(range(width))
+
+    def rewrite(self, dag: ccdag.OpDag):
+        """
+        >>> cols_in = [defCol(name, "INTEGER", [1]) for name in ["a", "b", "c", "d"]]
+        >>> in_op = cc.create("rel", cols_in, {1})
+        >>> filtered = cc.cc_filter(in_op, "filtered", "b", "==", scalar=1)
+        >>> agged = cc.aggregate(filtered, "agged", ["a"], "c", "sum", "total")
+        >>> ColumnPruning(None).rewrite(ccdag.OpDag({in_op}))
+        ColumnPruning rewriting rel
+        ColumnPruning rewriting filtered
+        ColumnPruning rewriting agged
+        >>> pruned = next(iter(in_op.children))
+        >>> pruned.out_rel.name, [col.name for col in pruned.out_rel.columns]
+        ('rel_pruned', ['a', 'b', 'c'])
+        >>> filtered.parent is pruned, [col.name for col in filtered.out_rel.columns]
+        (True, ['a', 'b', 'c'])
+        >>> agged.parent.out_rel.name, [col.name for col in agged.parent.out_rel.columns]
+        ('filtered_pruned', ['a', 'c'])
+        >>> agged.agg_col.name, agged.agg_col.idx
+        ('c', 1)
+
+        Columns a branch doesn't read are dropped before it is joined with other parties' data,
+        even if the relation it branches off from keeps them for another branch:
+
+        >>> in_op = cc.create("rel", [defCol(name, "INTEGER", [1]) for name in ["a", "b", "c", "d"]], {1})
+        >>> other = cc.create("other", [defCol(name, "INTEGER", [2]) for name in ["a", "e"]], {2})
+        >>> local = cc.aggregate(in_op, "local", ["a"], "c", "sum", "total")
+        >>> filtered = cc.cc_filter(in_op, "filtered", "b", "<", scalar=5)
+        >>> joined = cc.join(filtered, other, "joined", ["a"], ["a"])
+        >>> agged = cc.aggregate(joined, "agged", ["a"], "e", "sum", "total")
+        >>> ColumnPruning(None).rewrite(ccdag.OpDag({in_op, other}))  # doctest: +ELLIPSIS
+        ColumnPruning rewriting ...
+        >>> [col.name for col in filtered.parent.out_rel.columns]
+        ['a', 'b', 'c']
+        >>> joined.left_parent.out_rel.name, [col.name for col in joined.left_parent.out_rel.columns]
+        ('filtered_pruned', ['a'])
+        >>> [col.name for col in joined.out_rel.columns]
+        ['a', 'e']
+        """
+
+        ordered = dag.top_sort()
+
+        # indexes of the output columns of each node that its children read
+        needed = {}
+        for node in ordered[::-1]:
+            if node.is_leaf() or isinstance(node, (ccdag.Persist, ccdag.Store)):
+                needed[node] = set(range(len(node.out_rel.columns)))
+            # relations keep at least one column, e.g. to count their rows
+            needed[node] = needed.get(node) or {0}
+            for parent, col_idxs in self._demands(node, needed[node]):
+                needed.setdefault(parent, set()).update(col_idxs)
+
+        # indexes of the original output columns each node has left
+        kept = {}
+        for node in ordered:
+            print(type(self).__name__, "rewriting", node.out_rel.name)
+            columns = node.out_rel.columns
+            if isinstance(node, ccdag.Concat):
+                # all inputs must have the same columns
+                for parent in copy.copy(node.ordered):
+                    if kept[parent] != sorted(needed[node]):
+                        proj = self._insert_project(
+                            parent, [node], "{}_{}_pruned".format(parent.out_rel.name, node.out_rel.name),
+                            [kept[parent].index(idx) for idx in sorted(needed[node])])
+                        kept[proj] = sorted(needed[node])
+            if isinstance(node, ccdag.Project):
+                node.selected_cols = [node.selected_cols[idx] for idx in sorted(needed[node])]
+
+            kept[node] = self._kept_cols(node, needed[node], kept)
+            if len(kept[node]) < len(columns):
+                node.out_rel.columns = [columns[idx] for idx in kept[node]]
+                node.out_rel.update_columns()
+            update_op_cols_by_name(node)
+
+            # columns that only node itself read, e.g. a Filter's, are dropped right after it,
+            # which keeps them out of the MPC jobs of its children.
+            # Inputs that are already secret-shared are left as they are.
+            is_shared_input = isinstance(node, ccdag.Create) and len(node.out_rel.stored_with) > 1
+            if node.children and len(needed[node]) < len(kept[node]) and not is_shared_input:
+                proj = self._insert_project(
+                    node, node.get_sorted_children(), node.out_rel.name + "_pruned",
+                    [kept[node].index(idx) for idx in sorted(needed[node])])
+                kept[proj] = sorted(needed[node])
+
+
 class MPCPushDown(DagRewriter):
     """ DagRewriter subclass for pushing MPC boundaries down in workflows. """
 
@@ -1416,8 +1873,48 @@ class EliminateSorts(DagRewriter):
             self.sorted_by = None
 
 
+class FuseRowOps(DagRewriter):
+    """
+    Marks maximal chains of local, row-local unary operators (see ccdag.ROW_LOCAL_OPS) so
+    that local codegens can emit each chain as a single pass over its input instead of
+    materializing every intermediate relation.
+    """
+
+    def __init__(self, conclave_config: cc_conf.CodeGenConfig):
+        super(FuseRowOps, self).__init__(conclave_config)
+
+    @staticmethod
+    def _fuse(node: ccdag.UnaryOpNode):
+        parent = node.parent
+        # the parent's output can only be skipped if nothing else reads it
+        node.fuse_with_parent = isinstance(parent, ccdag.ROW_LOCAL_OPS) \
+            and not node.is_mpc \
+            and not parent.is_mpc \
+            and len(parent.children) == 1 \
+            and parent.out_rel.stored_with == node.out_rel.stored_with
+
+    def _rewrite_project(self, node: ccdag.Project):
+        self._fuse(node)
+
+    def _rewrite_filter(self, node: ccdag.Filter):
+        self._fuse(node)
+
+    def _rewrite_multiply(self, node: ccdag.Multiply):
+        self._fuse(node)
+
+    def _rewrite_divide(self, node: ccdag.Divide):
+        self._fuse(node)
+
+    def _rewrite_index(self, node: ccdag.Index):
+        self._fuse(node)
+
+
 def rewrite_dag(dag: ccdag.OpDag, conclave_config: cc_conf.CodeGenConfig):
     """ Combines and calls all rewrite operations. """
+    # trust sets tell SelectionPushDown which joins can be done as public joins
+    TrustSetPropDown(conclave_config).rewrite(dag)
+    SelectionPushDown(conclave_config).rewrite(dag)
+    ColumnPruning(conclave_config).rewrite(dag)
     MPCPushDown(conclave_config).rewrite(dag)
     UpdateColumns(conclave_config).rewrite(dag)
     MPCPushUp(conclave_config).rewrite(dag)
@@ -1427,6 +1924,7 @@ def rewrite_dag(dag: ccdag.OpDag, conclave_config: cc_conf.CodeGenConfig):
     ExpandCompositeOps(conclave_config).rewrite(dag)
     StoredWithSimplifier(conclave_config).rewrite(dag)
     EliminateSorts(conclave_config).rewrite(dag)
+    FuseRowOps(conclave_config).rewrite(dag)
     return dag
 
 
@@ -51,8 +51,52 @@ class SharemindCodeGenConfig:
 class SparkConfig:
     """ Spark configuration."""
 
-    def __init__(self, spark_master_url):
+    def __init__(self, spark_master_url, broadcast_rows: int = 100000, memory_rows: int = 1000000,
+                 driver_address: [str, None] = None):
         self.spark_master_url = spark_master_url
+        # with a driver_address ("host:port"), jobs run in a long-running driver service
+        # there (see conclave.dispatch.spark_driver), started on first use if none is
+        # listening, instead of each in a new spark-submit. It must be a loopback address.
+        self.driver_address = driver_address
+        # join inputs estimated to have at most broadcast_rows rows are broadcast, and
+        # relations used more than once are cached in memory if estimated to have at
+        # most memory_rows rows, and persisted serialized with spill to disk otherwise
+        self.broadcast_rows = broadcast_rows
+        self.memory_rows = memory_rows
+
+
+class PythonConfig:
+    """ Python backend configuration. """
+
+    def __init__(self, engine: str = "rows", batch_size: int = 10000, memory_budget: int = 1000000,
+                 num_partitions: [int, None] = None, partition_rows: int = 100000, worker_pool: bool = False,
+                 isolation: str = "fork", job_timeout: [float, None] = None):
+        # "rows" runs on lists of rows, "columnar" on one NumPy array per column,
+        # "streaming" on batches of batch_size rows, spilling to disk once a blocking
+        # operator holds more than memory_budget rows, and "parallel" on num_partitions
+        # partitions held by worker processes (one per core of the executing machine by
+        # default). "parallel" only partitions relations of at least partition_rows rows,
+        # and runs operators on smaller ones in the job's process as "rows" does. Relations
+        # hash-partitioned by "parallel" are in partition order, so their rows may come out
+        # in a different order than with the other engines
+        if engine not in {"rows", "columnar", "streaming", "parallel"}:
+            raise Exception("Unknown python engine {}".format(engine))
+        self.engine = engine
+        self.batch_size = batch_size
+        self.memory_budget = memory_budget
+        self.num_partitions = num_partitions
+        self.partition_rows = partition_rows
+        # with worker_pool, jobs run in interpreters started once with the runtime imported
+        # rather than each in a new one. Workers start as jobs need them, up to the python
+        # dispatch limit, and are kept for later workflows. Isolation "fork" runs every job
+        # in a fresh fork of its worker, "none" in the worker itself, where it sees state
+        # earlier jobs left.
+        # Jobs taking longer than job_timeout seconds (None waits forever) are killed.
+        if isolation not in {"fork", "none"}:
+            raise Exception("Unknown python isolation {}".format(isolation))
+        self.worker_pool = worker_pool
+        self.isolation = isolation
+        self.job_timeout = job_timeout
 
 
 class OblivcConfig:
@@ -60,20 +104,45 @@ class OblivcConfig:
     Obliv-c configuration.
     """
 
-    def __init__(self, oc_path: str, ip_and_port: str):
+    def __init__(self, oc_path: str, ip_and_port: str,
+                 cache_dir: [str, None] = os.path.join(os.path.expanduser("~"), ".cache", "conclave", "oblivc"),
+                 bucket_rows: bool = False, sort_merge_join: bool = False, pairwise_agg_rows: int = 32,
+                 ready_timeout: [float, None] = 600.0):
         self.oc_path = oc_path
         self.ip_and_port = ip_and_port
+        # compiled jobs are kept in cache_dir (None disables caching) and reused when the
+        # generated code, header and compiler are the same. With bucket_rows, input row
+        # counts are padded to the next power of two, so one build serves many input sizes.
+        # Cached builds are run, so cache_dir is only used if it belongs to the current user
+        # and no one else can write to it.
+        self.cache_dir = cache_dir
+        self.bucket_rows = bucket_rows
+        # with sort_merge_join, joins where one side has unique keys sort both sides together
+        # instead of comparing every pair of rows, once the inputs are big enough to pay off
+        self.sort_merge_join = sort_merge_join
+        # sums and counts over at most pairwise_agg_rows rows compare every pair of rows
+        # instead of sorting them by key, which takes fewer gates for small inputs
+        self.pairwise_agg_rows = pairwise_agg_rows
+        # the evaluator gives up on a garbler that isn't ready ready_timeout seconds after
+        # the evaluator's own build (None waits forever)
+        self.ready_timeout = ready_timeout
 
 
 class JiffConfig:
     """ Jiff configuration. """
 
-    def __init__(self, jiff_path: str, party_count: int, server_ip: str, server_port: int, server_pid: int):
+    def __init__(self, jiff_path: str, party_count: int, server_ip: str, server_port: int, server_pid: int,
+                 sort_method: str = "odd-even"):
+        # "odd-even" sorts with Batcher's odd-even merge sort network, which takes
+        # O(log^2 n) rounds, "bubble" with the O(n^2) bubble sort it replaced
+        if sort_method not in {"odd-even", "bubble"}:
+            raise Exception("Unknown jiff sort method {}".format(sort_method))
         self.jiff_path = jiff_path
         self.party_count = party_count
         self.server_ip = server_ip
         self.server_port = server_port
         self.server_pid = server_pid
+        self.sort_method = sort_method
         self.use_openshift = False
 
 
@@ -92,12 +161,22 @@ class CodeGenConfig:
         else:
             self.code_path = tempfile.mkdtemp(suffix="-code", prefix="salmon-")
             self.name = os.path.basename(self.code_path)
+        # tags the messages of this workflow on connections shared with other workflows,
+        # so it has to be the same for all parties
+        self.workflow_id = job_name if job_name is not None else ""
         self.use_leaky_ops = False
         self.data_backend = "local"
         self.use_swift = False
         self.input_path = '/tmp'
         self.output_path = '/tmp'
         self.system_configs = {}
+        # conclave.partition.cost.CostModel used to choose among local frameworks (defaults if None)
+        self.cost_model = None
+        # max number of jobs per backend that dispatch_all runs at once
+        self.dispatch_limits = {
+            "python": os.cpu_count() or 1,
+            "spark": 1
+        }
         self.pid = pid
         self.all_pids = [1, 2, 3]
         self.network_config = {
@@ -150,6 +229,39 @@ class CodeGenConfig:
 
         return self
 
+    def with_workflow_id(self, workflow_id: str):
+        """ Set the ID that tells this workflow's messages apart from those of others sharing the connections. """
+
+        if not self.inited:
+            self.__init__()
+
+        self.workflow_id = workflow_id
+
+        return self
+
+    def with_dispatch_limits(self, limits: dict):
+        """
+        Set how many jobs of each backend (e.g. {"python": 4, "spark": 2}) may run
+        at once. Jobs that talk to other parties always run one at a time.
+        """
+
+        if not self.inited:
+            self.__init__()
+
+        self.dispatch_limits.update(limits)
+
+        return self
+
+    def with_cost_model(self, cost_model):
+        """ Set the cost model local frameworks are chosen with, see conclave.partition.cost. """
+
+        if not self.inited:
+            self.__init__()
+
+        self.cost_model = cost_model
+
+        return self
+
     def with_sharemind_config(self, cfg: SharemindCodeGenConfig):
         """ Add SharemindCodeGenConfig object to this object. """
 
@@ -179,6 +291,16 @@ class CodeGenConfig:
 
         return self
 
+    def with_python_config(self, cfg: PythonConfig):
+        """ Add PythonConfig object to this object. """
+
+        if not self.inited:
+            self.__init__()
+
+        self.system_configs["python"] = cfg
+
+        return self
+
     def with_jiff_config(self, cfg: JiffConfig):
         """ Add jiffConfig object to this object. """
 
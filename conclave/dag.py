@@ -51,6 +51,9 @@ class OpNode(Node):
         self.is_local = False
         self.is_mpc = False
         self.skip = False
+        # Set by comp.FuseRowOps when this node and its parent can be
+        # evaluated in a single pass over the parent's input
+        self.fuse_with_parent = False
 
     def is_boundary(self):
         """ Returns whether this node is at an MPC boundary. """
@@ -1009,6 +1012,11 @@ class Dag:
         return ordered
 
 
+# Unary operators that transform rows one at a time (Index only needs a running counter)
+# and can therefore be evaluated together in a single pass over their input
+ROW_LOCAL_OPS = (Project, Filter, Multiply, Divide, Index)
+
+
 class OpDag(Dag):
 
     def __init__(self, roots: set):
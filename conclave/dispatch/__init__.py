@@ -1,6 +1,23 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
 import conclave.job
+from conclave.config import PythonConfig
 from . import sharemind, spark, python, oblivc, single_party, jiff
 
+# backend names used as keys of CodeGenConfig.dispatch_limits
+BACKENDS = {
+    conclave.job.SharemindJob: "sharemind",
+    conclave.job.SparkJob: "spark",
+    conclave.job.PythonJob: "python",
+    conclave.job.OblivCJob: "obliv-c",
+    conclave.job.SinglePartyJob: "single-party",
+    conclave.job.JiffJob: "jiff"
+}
+
+# backends whose dispatchers drive the networked peer's event loop
+NETWORKED_BACKENDS = {"sharemind", "obliv-c", "single-party", "jiff"}
+
 
 def _synchronize(networked_peer):
     """
@@ -11,35 +28,127 @@ def _synchronize(networked_peer):
         pass
 
 
+def _dependencies(job_queue: list):
+    """
+    Maps each job to the earlier jobs it has to wait for: those that write one of its
+    input relations, and, for jobs that talk to other parties, the previous such job,
+    so that all parties run those in the same order.
+    """
+    dependencies = {}
+    last_networked = None
+    for idx, job in enumerate(job_queue):
+        dependencies[job] = {other for other in job_queue[:idx] if other.output_rels & job.input_rels}
+        if BACKENDS[type(job)] in NETWORKED_BACKENDS:
+            if last_networked is not None:
+                dependencies[job].add(last_networked)
+            last_networked = job
+    return dependencies
+
+
+def _wait_any(networked_peer, futures):
+    """
+    Waits for any of futures to finish and returns those that have. The networked peer's
+    event loop keeps running meanwhile, so that messages from other parties are handled
+    while local jobs run rather than once they are done.
+    """
+    if networked_peer is None:
+        return wait(futures, return_when=FIRST_COMPLETED)[0]
+    loop = networked_peer.loop
+    loop.run_until_complete(asyncio.wait(
+        [asyncio.wrap_future(future, loop=loop) for future in futures], return_when=asyncio.FIRST_COMPLETED))
+    return {future for future in futures if future.done()}
+
+
 def dispatch_all(conclave_config, networked_peer, job_queue: list):
     """
     Dispatches jobs in job queue.
     """
 
+    python_config = conclave_config.system_configs.get("python", PythonConfig())
+
     # create a lookup from job class to instantiated dispatcher
     dispatchers = {
         conclave.job.SharemindJob:
             sharemind.SharemindDispatcher(networked_peer) if networked_peer else None,
         conclave.job.SparkJob:
             spark.SparkDispatcher(
-                conclave_config.system_configs["spark"].spark_master_url)
+                conclave_config.system_configs["spark"].spark_master_url,
+                conclave_config.system_configs["spark"].driver_address)
             if "spark" in conclave_config.system_configs else None,
-        conclave.job.PythonJob: python.PythonDispatcher(),
+        conclave.job.PythonJob: python.PythonDispatcher(
+            python_config.worker_pool, conclave_config.dispatch_limits["python"], python_config.isolation,
+            python_config.job_timeout),
         conclave.job.OblivCJob: oblivc.OblivCDispatcher(
             networked_peer, conclave_config) if networked_peer else None,
         conclave.job.SinglePartyJob: single_party.SinglePartyDispatcher(networked_peer) if networked_peer else None,
         conclave.job.JiffJob: jiff.JiffDispatcher(networked_peer, conclave_config) if networked_peer else None
     }
 
-    # dispatch each job
+    dependencies = _dependencies(job_queue)
+    limits = conclave_config.dispatch_limits
+    running = {}
+    active = {backend: 0 for backend in BACKENDS.values()}
+    done = set()
+    pending = []
+    # jobs that raised, by job, and those not run since a job they depend on did not finish
+    failed = {}
+    cancelled = set()
+
     for job in job_queue:
-        if not job.skip:
-            try:
-                # look up dispatcher and dispatch
-                dispatchers[type(job)].dispatch(job)
-            except Exception as e:
-                print(e)
-        else:
+        if job.skip:
             print("Skipping other party's job: ", job)
+            done.add(job)
+        else:
+            pending.append(job)
+
+    def _dispatch(job):
+        # look up dispatcher and dispatch
+        dispatchers[type(job)].dispatch(job)
+
+    def _fail(job, e):
+        print("Job {} failed: {}".format(job.name, e))
+        failed[job] = e
+
+    with ThreadPoolExecutor(max_workers=max(sum(limits.values()), 1)) as executor:
+        while pending or running:
+            # start ready jobs in queue order
+            for job in list(pending):
+                backend = BACKENDS[type(job)]
+                if dependencies[job] & (failed.keys() | cancelled):
+                    # jobs come after those they depend on, so this cancels their dependents too
+                    print("Not running job {}, as a job it depends on failed".format(job.name))
+                    pending.remove(job)
+                    cancelled.add(job)
+                    continue
+                if not dependencies[job] <= done:
+                    continue
+                if backend in NETWORKED_BACKENDS:
+                    # the peer's event loop is not thread-safe, so these run on this thread
+                    pending.remove(job)
+                    try:
+                        _dispatch(job)
+                        done.add(job)
+                    except Exception as e:
+                        _fail(job, e)
+                elif active[backend] < limits.get(backend, 1):
+                    pending.remove(job)
+                    active[backend] += 1
+                    running[executor.submit(_dispatch, job)] = job
+            if not running:
+                if pending and not any(dependencies[job] <= done for job in pending):
+                    raise Exception("Unsatisfiable job dependencies: {}".format([job.name for job in pending]))
+                continue
+            finished = _wait_any(networked_peer, running)
+            for future in finished:
+                job = running.pop(future)
+                active[BACKENDS[type(job)]] -= 1
+                if future.exception() is not None:
+                    _fail(job, future.exception())
+                else:
+                    done.add(job)
+
+    # raised once all jobs that were running have finished
+    if failed:
+        raise Exception("Jobs failed: {}".format([job.name for job in failed])) from next(iter(failed.values()))
 
     _synchronize(networked_peer)
@@ -1,4 +1,9 @@
-from subprocess import call
+import asyncio
+
+from conclave.dispatch.ready import run_async, start_until_ready_async
+
+# logged by the JIFF server once it accepts connections, see server.tmpl
+READY_LINE = "listening on"
 
 
 class JiffDispatcher:
@@ -15,24 +20,79 @@ class JiffDispatcher:
         self.to_wait_on = {}
         self.early = set()
 
-    def dispatch(self, job):
+    def _wait_on(self, parties: list):
+        """ Wait until each of parties has sent a DoneMsg for the current phase. """
 
-        # register self as current dispatcher with peer
-        self.peer.register_dispatcher(self)
+        for party in parties:
+            if party not in self.early:
+                self.to_wait_on[party] = asyncio.Future()
 
-        if self.peer.pid == self.server_pid:
-            cmd = "bash {0}/run_server.sh & bash {0}/run.sh".format(job.code_dir)
-        else:
-            cmd = "bash {0}/run.sh".format(job.code_dir)
+        futures = self.to_wait_on.values()
+        self.loop.run_until_complete(asyncio.gather(*futures))
+
+        self.to_wait_on = {}
+        self.early = set()
+
+    def _run_party(self, job):
+
+        cmd = "{0}/run.sh".format(job.code_dir)
 
         print("Jiff: {0}/run.sh dispatching"
               .format(job.code_dir))
 
         try:
-            call(cmd, shell=True)
+            self.loop.run_until_complete(run_async(["bash", cmd]))
         except Exception as e:
             print(e)
 
+    def _dispatch_as_server(self, job):
+        """
+        Start the JIFF server, let the other parties start theirs once it is listening,
+        and stop it once they are all done.
+        """
+
+        others = [party for party in self.peer.parties if party != self.peer.pid]
+
+        server = self.loop.run_until_complete(
+            start_until_ready_async(["bash", "{0}/run_server.sh".format(job.code_dir)], READY_LINE))
+        for party in others:
+            self.peer.send_done_msg(party, job.name + ".ready")
+
+        self._run_party(job)
+
+        self._wait_on(others)
+        server.terminate()
+        self.loop.run_until_complete(server.wait())
+
+    def _dispatch_as_party(self, job):
+        """ Start party once the JIFF server is listening, and report back when done. """
+
+        self._wait_on([self.server_pid])
+
+        self._run_party(job)
+
+        self.peer.send_done_msg(self.server_pid, job.name + ".done")
+
+    def dispatch(self, job):
+
+        # register self as current dispatcher with peer
+        self.peer.register_dispatcher(self)
+
+        if self.peer.pid == self.server_pid:
+            self._dispatch_as_server(job)
+        else:
+            self._dispatch_as_party(job)
+
         self.peer.dispatcher = None
         self.to_wait_on = {}
         self.early = set()
+
+    def receive_msg(self, msg):
+        """ Receive message from other party in computation. """
+
+        done_peer = msg.pid
+        if done_peer in self.to_wait_on:
+            self.to_wait_on[done_peer].set_result(True)
+        else:
+            self.early.add(done_peer)
+            print("early message", msg)
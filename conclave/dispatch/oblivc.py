@@ -1,10 +1,55 @@
 import asyncio
+import hashlib
 import json
-import time
-from subprocess import call
+import os
+import shutil
+import tempfile
+from stat import S_ISDIR, S_IWGRP, S_IWOTH
 
 import pystache
 
+from conclave.codegen.libs.python import read_rel_meta
+from conclave.dispatch.ready import check_returncode, run_async, start_until_ready_async
+
+# printed by the garbler once it accepts connections, see c_controller.tmpl
+READY_LINE = "conclave: garbler listening"
+# ends the name of the message the garbler sends instead of the ready one if it can't start
+FAILED_SUFFIX = ".failed"
+
+
+def row_bucket(num_rows: int):
+    """
+    Returns the smallest power of two that is at least num_rows.
+
+    >>> [row_bucket(n) for n in [0, 1, 5, 8, 9]]
+    [1, 1, 8, 8, 16]
+    """
+    return 1 << max(num_rows - 1, 0).bit_length()
+
+
+def trusted_cache_dir(path: str):
+    """
+    Creates directory path (mode 0700) if it doesn't exist, and returns whether it is safe
+    to run binaries from it: it must be owned by the current user, and neither group nor
+    others may write to it.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "cache")
+    >>> trusted_cache_dir(path), oct(os.stat(path).st_mode & 0o777)
+    (True, '0o700')
+    >>> os.chmod(path, 0o777)
+    >>> trusted_cache_dir(path)
+    False
+    """
+
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        stat = os.lstat(path)
+    except OSError:
+        return False
+
+    return stat.st_uid == os.getuid() and S_ISDIR(stat.st_mode) and not stat.st_mode & (S_IWGRP | S_IWOTH)
+
 
 class OblivCDispatcher:
 
@@ -15,6 +60,8 @@ class OblivCDispatcher:
         self.loop = peer.loop
         self.to_wait_on = {}
         self.early = set()
+        self.early_failed = set()
+        self.oc_config = config.system_configs["oblivc"]
         self.header_template = \
             """
             #include <obliv.h>
@@ -58,19 +105,18 @@ class OblivCDispatcher:
         with open("{0}/header_params.json".format(job.code_dir), 'r') as conf:
             params = json.load(conf)
 
-        row_count = 0
-        with open(params["IN_PATH"], 'r') as input_data:
-            file_data = input_data.read()
-            rows = file_data.split("\n")
-            for r in rows:
-                if r != '':
-                    row_count += 1
-            cols = len(rows[0].split(","))
+        # the sidecar written along with the input saves scanning it
+        meta = read_rel_meta(params["IN_PATH"])
+        num_rows = meta["rows"]
+
+        if self.oc_config.bucket_rows:
+            # the generated program reads in the actual number of rows, ROWS only bounds it
+            num_rows = row_bucket(num_rows)
 
         data = {
             "TYPE": params["TYPE"],
-            "ROWS": row_count - 1,
-            "COLS": cols
+            "ROWS": num_rows,
+            "COLS": meta["cols"]
         }
 
         header_file = pystache.render(self.header_template, data)
@@ -79,36 +125,109 @@ class OblivCDispatcher:
         header = open("{}/workflow.h".format(job.code_dir), 'w')
         header.write(header_file)
 
-    def _dispatch(self, job):
+        return header_file
+
+    def _cached_binary(self, job, header_file: str):
         """
-        Dispatch Obliv-C job.
+        Return the path a build of job with this header is cached at. Builds are keyed by
+        everything that goes into them: the generated code, the header and the compiler.
         """
 
-        self.generate_header(job)
+        key = hashlib.sha256()
+        for file_name in ["workflow.oc", "workflow.c"]:
+            with open("{}/{}".format(job.code_dir, file_name), 'rb') as code:
+                key.update(code.read())
+        key.update(header_file.encode())
+        key.update(self.oc_config.oc_path.encode())
 
-        cmd = "{}/bash.sh".format(job.code_dir)
+        return "{}/{}".format(self.oc_config.cache_dir, key.hexdigest())
 
-        print("{}: {}/bash.sh dispatching Obliv-C job. "
-              .format(job.name, job.code_dir))
+    def _store_binary(self, binary: str, cached: str):
+        """ Copy binary to cached, such that concurrent jobs never see a partial file. """
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.oc_config.cache_dir)
+        os.close(fd)
+        shutil.copy2(binary, tmp_path)
+        os.replace(tmp_path, cached)
+
+    def _build(self, job):
+        """
+        Generate header and compile Obliv-C job, unless there is a cached build of it.
+        """
+
+        header_file = self.generate_header(job)
+
+        # bash.sh only compiles the job if there is no a.out yet
+        binary = "{}/a.out".format(job.code_dir)
+        if os.path.exists(binary):
+            os.remove(binary)
+
+        cached = None
+        if self.oc_config.cache_dir is not None and not trusted_cache_dir(self.oc_config.cache_dir):
+            print("{}: not using build cache {}, as it isn't a directory only the current user can write to"
+                  .format(job.name, self.oc_config.cache_dir))
+        elif self.oc_config.cache_dir is not None:
+            cached = self._cached_binary(job, header_file)
+            if os.path.exists(cached):
+                print("{}: using cached build {}".format(job.name, cached))
+                shutil.copy2(cached, binary)
+
+        # a failed build must neither be run nor cached
+        cmd = ["/bin/bash", "{}/bash.sh".format(job.code_dir), "compile"]
+        check_returncode(cmd, self.loop.run_until_complete(run_async(cmd)))
+        if not os.path.exists(binary):
+            raise Exception("{}: compiling produced no {}".format(job.name, binary))
+
+        if cached is not None and not os.path.exists(cached):
+            self._store_binary(binary, cached)
+
+    def dispatch_as_garbler(self, job):
+        """
+        Start Obliv-C job and tell the evaluator once it accepts connections.
+        """
+
+        cmd = ["/bin/bash", "{}/bash.sh".format(job.code_dir)]
 
         try:
-            call(["/bin/bash", cmd])
-        except Exception as e:
-            print(e)
+            self._build(job)
+
+            print("{}: {}/bash.sh dispatching Obliv-C job. "
+                  .format(job.name, job.code_dir))
+
+            proc = self.loop.run_until_complete(start_until_ready_async(cmd, READY_LINE))
+        except Exception:
+            # so that the evaluator doesn't wait for a garbler that won't come
+            self.peer.send_done_msg(job.evaluator_party, job.name + FAILED_SUFFIX)
+            raise
+
+        self.peer.send_done_msg(job.evaluator_party, job.name + '.ready')
+        check_returncode(cmd, self.loop.run_until_complete(proc.wait()))
 
     def dispatch_as_evaluator(self, job):
         """
-        Wait until submit party is ready.
+        Compile Obliv-C job while the garbler does, and start it once the garbler is ready.
         """
 
+        self._build(job)
+
         if job.submit_party not in self.early:
             self.to_wait_on[job.submit_party] = asyncio.Future()
 
         future = self.to_wait_on.values()
-        self.loop.run_until_complete(asyncio.gather(*future))
+        try:
+            self.loop.run_until_complete(asyncio.wait_for(asyncio.gather(*future), self.oc_config.ready_timeout))
+        except asyncio.TimeoutError:
+            raise Exception("{}: garbler (party {}) not ready after {} seconds"
+                            .format(job.name, job.submit_party, self.oc_config.ready_timeout))
+        if job.submit_party in self.early_failed:
+            raise Exception("{}: garbler (party {}) failed to start".format(job.name, job.submit_party))
+
+        cmd = ["/bin/bash", "{}/bash.sh".format(job.code_dir)]
+
+        print("{}: {}/bash.sh dispatching Obliv-C job. "
+              .format(job.name, job.code_dir))
 
-        time.sleep(10)
-        self._dispatch(job)
+        check_returncode(cmd, self.loop.run_until_complete(run_async(cmd)))
 
     def dispatch(self, job):
 
@@ -117,8 +236,7 @@ class OblivCDispatcher:
 
         if int(self.peer.pid) == int(job.submit_party):
             print("Dispatching as Garbler.\n")
-            self.peer.send_done_msg(job.evaluator_party, job.name + '.submit')
-            self._dispatch(job)
+            self.dispatch_as_garbler(job)
         elif int(self.peer.pid) == int(job.evaluator_party):
             print("Dispatching as Evaluator.\n")
             self.dispatch_as_evaluator(job)
@@ -128,14 +246,23 @@ class OblivCDispatcher:
         self.peer.dispatcher = None
         self.to_wait_on = {}
         self.early = set()
+        self.early_failed = set()
 
     def receive_msg(self, msg):
         """ Receive message from other party in computation. """
 
         done_peer = msg.pid
+        failed = msg.task_name.endswith(FAILED_SUFFIX)
         if done_peer in self.to_wait_on:
             print("Obliv-C DoneMsg received.\n")
-            self.to_wait_on[done_peer].set_result(True)
+            if failed:
+                self.to_wait_on[done_peer].set_exception(
+                    Exception("{}: garbler (party {}) failed to start"
+                              .format(msg.task_name[:-len(FAILED_SUFFIX)], done_peer)))
+            else:
+                self.to_wait_on[done_peer].set_result(True)
         else:
             self.early.add(done_peer)
+            if failed:
+                self.early_failed.add(done_peer)
             print("early message", msg)
@@ -1,9 +1,203 @@
-from subprocess import call
+import asyncio
+import atexit
+import os
+import runpy
+import signal
+import sys
+import threading
+import time
+import traceback
+from multiprocessing.connection import Connection, Pipe
+from subprocess import Popen
+
+from conclave.dispatch.ready import run_async
+
+# modules generated jobs import, loaded once by the pool instead of by every job
+RUNTIME_MODULES = [
+    "conclave.codegen.libs.python",
+    "conclave.codegen.libs.columnar",
+    "conclave.codegen.libs.streaming",
+    "conclave.codegen.libs.parallel"
+]
+
+
+def _run(path: str):
+    """ Runs the generated job at path as a script, returns the formatted error if it fails. """
+
+    try:
+        runpy.run_path(path, run_name="__main__")
+    except SystemExit as e:
+        if e.code not in {None, 0}:
+            return traceback.format_exc()
+    except BaseException:
+        return traceback.format_exc()
+    return None
+
+
+def _run_forked(path: str):
+    """ Runs _run in a child forked off the worker, so that the job can't change the worker's state. """
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        error = _run(path)
+        # cleanup registered by the runtime, e.g. removing spill files
+        atexit._run_exitfuncs()
+        with os.fdopen(write_fd, 'w') as f:
+            f.write(error or "")
+        os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'r') as f:
+        error = f.read()
+    _, status = os.waitpid(pid, 0)
+    if status != 0 and not error:
+        error = "{} exited with status {}".format(path, status)
+
+    return error or None
+
+
+def _serve(fd: int, isolate: bool):
+    """ Worker loop: runs the job paths sent on fd and answers with (error, seconds). """
+
+    conn = Connection(fd)
+    for module in RUNTIME_MODULES:
+        __import__(module)
+
+    while True:
+        path = conn.recv()
+        if path is None:
+            break
+        start = time.monotonic()
+        error = _run_forked(path) if isolate else _run(path)
+        conn.send((error, time.monotonic() - start))
+
+
+class _Worker:
+    """ Interpreter of a WorkerPool, with the runtime already imported. """
+
+    def __init__(self, isolate: bool):
+        self.conn, worker_conn = Pipe()
+        code = "from conclave.dispatch.python import _serve; _serve({}, {})".format(worker_conn.fileno(), isolate)
+        # a new session lets the pool kill a job that times out together with the child it runs in
+        self.proc = Popen([sys.executable, "-c", code], pass_fds=[worker_conn.fileno()], start_new_session=True)
+        worker_conn.close()
+
+    def run(self, path: str, timeout: [float, None]):
+        """ Returns (error, seconds) for the job at path, or raises if it doesn't finish within timeout. """
+
+        self.conn.send(path)
+        if not self.conn.poll(timeout):
+            self.kill()
+            raise Exception("{} did not finish within {} seconds".format(path, timeout))
+        try:
+            return self.conn.recv()
+        except EOFError:
+            raise Exception("Worker running {} exited with {}".format(path, self.proc.wait()))
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def kill(self):
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.proc.wait()
+
+    def close(self):
+        if self.alive():
+            self.conn.send(None)
+            self.proc.wait()
+
+
+class WorkerPool:
+    """
+    Python interpreters, started once, that run generated jobs. With isolate, each job runs
+    in a child forked off its worker, otherwise in the worker itself, which is faster
+    but lets jobs see module state left behind by earlier ones.
+    """
+
+    def __init__(self, size: int, isolate: bool = True):
+        self.isolate = isolate
+        # workers are started as jobs need them, up to size
+        self.size = size
+        self.started = 0
+        self.idle = []
+        self.available = threading.Condition()
+
+    def _acquire(self):
+        """ Returns a free worker, starting one if none is free and fewer than size are running. """
+
+        with self.available:
+            self.available.wait_for(lambda: self.idle or self.started < self.size)
+            if self.idle:
+                return self.idle.pop()
+            self.started += 1
+
+        try:
+            return _Worker(self.isolate)
+        except BaseException:
+            with self.available:
+                self.started -= 1
+                self.available.notify()
+            raise
+
+    def run(self, path: str, timeout: [float, None] = None):
+        """ Runs the job at path in a free worker, returns (error, seconds). """
+
+        worker = self._acquire()
+
+        try:
+            return worker.run(path, timeout)
+        finally:
+            # workers that were killed or died are replaced
+            if not worker.alive():
+                worker = _Worker(self.isolate)
+            with self.available:
+                self.idle.append(worker)
+                self.available.notify()
+
+    def close(self):
+        with self.available:
+            for worker in self.idle:
+                worker.close()
+            self.started -= len(self.idle)
+            self.idle = []
+
+
+# pools by (size, isolate), kept warm for later workflows
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _close_pools():
+    for pool in _pools.values():
+        pool.close()
+
+
+atexit.register(_close_pools)
+
+
+def _pool(size: int, isolate: bool):
+    with _pools_lock:
+        if (size, isolate) not in _pools:
+            _pools[(size, isolate)] = WorkerPool(size, isolate)
+        return _pools[(size, isolate)]
 
 
 class PythonDispatcher:
     """ Dispatches Python jobs. """
 
+    def __init__(self, worker_pool: bool = False, pool_size: int = 1, isolation: str = "fork",
+                 job_timeout: [float, None] = None):
+        # without a worker_pool, each job runs in a new interpreter
+        self.worker_pool = worker_pool and hasattr(os, "fork")
+        self.pool_size = pool_size
+        self.isolation = isolation
+        self.job_timeout = job_timeout
+
     def dispatch(self, job):
 
         cmd = "{}/workflow.py".format(job.code_dir)
@@ -11,7 +205,13 @@ class PythonDispatcher:
         print("{}: {}/workflow.py running"
               .format(job.name, job.code_dir))
 
-        try:
-            call(["python", cmd])
-        except Exception as e:
-            print(e)
+        if self.worker_pool:
+            error, seconds = _pool(self.pool_size, self.isolation == "fork").run(cmd, self.job_timeout)
+            if error is not None:
+                raise Exception("Python job {} failed:\n{}".format(job.name, error))
+            print("{}: done in {:.3f}s".format(job.name, seconds))
+            return
+
+        returncode = asyncio.run(run_async(["python", cmd]))
+        if returncode != 0:
+            raise Exception("Python job {} failed: {} exited with {}".format(job.name, cmd, returncode))
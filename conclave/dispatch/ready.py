@@ -0,0 +1,92 @@
+"""
+Subprocesses of dispatchers. A process that other parties connect to prints a known
+line once it accepts connections, and the dispatcher that started it tells the other
+parties' dispatchers, which then start their processes right away.
+
+Dispatchers that talk to other parties run their processes with the asyncio variants
+below on the networked peer's event loop, which keeps handling messages from other
+parties while the processes run.
+"""
+import asyncio
+import threading
+from subprocess import Popen, PIPE, STDOUT
+
+
+def _echo(stream):
+    for line in stream:
+        print(line, end="")
+
+
+def start_until_ready(cmd: list, ready_line: str):
+    """
+    Starts cmd and returns its process once it prints a line starting with ready_line.
+    Output is passed on to stdout throughout.
+    """
+
+    proc = Popen(cmd, stdout=PIPE, stderr=STDOUT, universal_newlines=True)
+
+    for line in proc.stdout:
+        print(line, end="")
+        if line.startswith(ready_line):
+            break
+    else:
+        proc.wait()
+        raise Exception("{} exited with {} before it was ready".format(cmd, proc.returncode))
+
+    # keeps the process from blocking on a full pipe
+    threading.Thread(target=_echo, args=(proc.stdout,), daemon=True).start()
+
+    return proc
+
+
+async def _echo_async(stream: asyncio.StreamReader, ready_line: [str, None] = None):
+    """ Passes lines from stream on to stdout, returns once one starts with ready_line. """
+
+    while True:
+        line = await stream.readline()
+        if not line:
+            return False
+        line = line.decode(errors="replace")
+        print(line, end="")
+        if ready_line is not None and line.startswith(ready_line):
+            return True
+
+
+def check_returncode(cmd: list, returncode: int):
+    """
+    Raises if cmd exited with a non-zero returncode.
+
+    >>> check_returncode(["true"], 0)
+    >>> check_returncode(["false"], 1)
+    Traceback (most recent call last):
+    ...
+    Exception: ['false'] exited with 1
+    """
+
+    if returncode != 0:
+        raise Exception("{} exited with {}".format(cmd, returncode))
+
+
+async def run_async(cmd: list):
+    """ Runs cmd to completion, passing its output on to stdout, and returns its exit code. """
+
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=PIPE, stderr=STDOUT)
+    await _echo_async(proc.stdout)
+
+    return await proc.wait()
+
+
+async def start_until_ready_async(cmd: list, ready_line: str):
+    """
+    Asynchronous counterpart of start_until_ready. The rest of the output is passed on
+    for as long as the event loop runs, so callers keep it running until the process exits.
+    """
+
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=PIPE, stderr=STDOUT)
+
+    if not await _echo_async(proc.stdout, ready_line):
+        raise Exception("{} exited with {} before it was ready".format(cmd, await proc.wait()))
+
+    asyncio.ensure_future(_echo_async(proc.stdout))
+
+    return proc
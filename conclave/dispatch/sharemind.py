@@ -1,5 +1,6 @@
 import asyncio
-from subprocess import call
+
+from conclave.dispatch.ready import run_async
 
 
 class SharemindDispatcher:
@@ -20,7 +21,7 @@ class SharemindDispatcher:
         )
         print("Will run data submission: " + cmd)
         try:
-            call(["bash", cmd])
+            self.loop.run_until_complete(run_async(["bash", cmd]))
         except Exception:
             print("Failed data input")
 
@@ -32,7 +33,7 @@ class SharemindDispatcher:
         )
         print("Will submit jobs to miners: " + cmd)
         try:
-            call(["bash", cmd])
+            self.loop.run_until_complete(run_async(["bash", cmd]))
         except Exception:
             print("Failed job")
 
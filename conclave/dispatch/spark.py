@@ -1,21 +1,98 @@
-from subprocess import call
+import asyncio
+import atexit
+import json
+import os
+import socket
+import sys
+import threading
+from conclave.dispatch.ready import run_async, start_until_ready
+
+# printed by the driver service (see conclave.dispatch.spark_driver) once it takes jobs
+READY_LINE = "conclave: spark driver listening"
+
+
+def token_path(address: str):
+    """ Returns the path of the file the driver service at address keeps its token in. """
+
+    return os.path.join(os.path.expanduser("~"), ".cache", "conclave", "spark-driver-{}.token"
+                        .format(address.replace(":", "-")))
+
+
+# driver services started by this process, by address, kept for later jobs and workflows
+_drivers = {}
+_drivers_lock = threading.Lock()
+
+
+def _ensure_driver(master_url: str, address: str):
+    """ Starts a driver service at address, unless one is already listening there. """
+
+    host, port = address.split(":")
+    with _drivers_lock:
+        if address in _drivers and _drivers[address].poll() is None:
+            return
+        try:
+            socket.create_connection((host, int(port))).close()
+            return
+        except OSError:
+            pass
+
+        print("starting Spark driver service at {} for master {}".format(address, master_url))
+        proc = start_until_ready(
+            [sys.executable, "-m", "conclave.dispatch.spark_driver", master_url, address], READY_LINE)
+        atexit.register(proc.terminate)
+        _drivers[address] = proc
 
 
 class SparkDispatcher:
     """ Dispatches Spark jobs. """
 
-    def __init__(self, master_url):
+    def __init__(self, master_url, driver_address: [str, None] = None):
         """ Initialize SparkDispatcher object """
         self.master = master_url
+        self.driver_address = driver_address
+
+    def _submit(self, job):
+        """ Runs job in the driver service and returns its response. """
+
+        _ensure_driver(self.master, self.driver_address)
+
+        host, port = self.driver_address.split(":")
+        with open(token_path(self.driver_address), 'r') as f:
+            token = f.read().strip()
+        request = {"name": job.name, "path": "{}/workflow.py".format(job.code_dir), "token": token}
+        with socket.create_connection((host, int(port))) as conn, conn.makefile('rw') as stream:
+            stream.write(json.dumps(request) + "\n")
+            stream.flush()
+            line = stream.readline()
+
+        if not line:
+            raise Exception("Spark driver at {} closed the connection while running {}"
+                            .format(self.driver_address, job.name))
+
+        return json.loads(line)
 
     def dispatch(self, job):
         """ Dispatch Spark job. """
+
+        if self.driver_address is not None:
+            print("{}: {}/workflow.py dispatching to Spark driver at {}"
+                  .format(job.name, job.code_dir, self.driver_address))
+
+            response = self._submit(job)
+            if response["status"] != "ok":
+                raise Exception("Spark job {} failed:\n{}".format(job.name, response["error"]))
+            print("{}: done in {:.2f}s, {} Spark jobs, {} stages, {} tasks"
+                  .format(job.name, response["seconds"], response["spark_jobs"], response["stages"],
+                          response["tasks"]))
+            return
+
         cmd = "{}/bash.sh".format(job.code_dir)
 
         print("{}: {}/bash.sh dispatching to Spark master at {}"
               .format(job.name, job.code_dir, self.master))
 
         try:
-            call(["/bin/bash", cmd, self.master])
+            # runs on one of dispatch_all's threads, so on an event loop of its own
+            asyncio.run(run_async(["/bin/bash", cmd, self.master]))
         except Exception as e:
             print(e)
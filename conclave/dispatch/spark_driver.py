@@ -0,0 +1,145 @@
+"""
+Long-running Spark driver. It holds one SparkSession and runs the generated Spark jobs
+submitted to it over a local socket in that session, so that jobs don't each pay for
+starting a JVM and creating a session, as they do when run with spark-submit. Start it with
+
+    python -m conclave.dispatch.spark_driver <MASTER URL> <HOST:PORT>
+
+Requests and responses are single lines of JSON. A request names the job and the path
+of its workflow.py, the response says whether it ran through and how long it took, and
+counts the Spark jobs, stages and tasks it ran.
+
+Since the driver runs whatever code it is sent, it only listens on loopback addresses,
+and every request must carry the token it writes to token_path(address), which only the
+user running it can read.
+"""
+import hmac
+import ipaddress
+import itertools
+import json
+import os
+import secrets
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from conclave.dispatch.spark import READY_LINE, token_path
+from conclave.net.connect import listen
+
+# __name__ generated jobs run under, which tells them not to stop the session
+JOB_MODULE = "conclave_spark_job"
+
+# tells the job groups of submissions of the same job apart
+_submission_ids = itertools.count()
+
+
+def _metrics(sc, group: str):
+    """ Counts the Spark jobs run in group, and their stages and tasks. """
+
+    tracker = sc.statusTracker()
+    job_ids = tracker.getJobIdsForGroup(group)
+    stages, tasks, failed_tasks = 0, 0, 0
+    for job_id in job_ids:
+        job_info = tracker.getJobInfo(job_id)
+        if job_info is None:
+            continue
+        for stage_id in job_info.stageIds:
+            stage_info = tracker.getStageInfo(stage_id)
+            if stage_info is None:
+                continue
+            stages += 1
+            tasks += stage_info.numTasks
+            failed_tasks += stage_info.numFailedTasks
+
+    return {"spark_jobs": len(job_ids), "stages": stages, "tasks": tasks, "failed_tasks": failed_tasks}
+
+
+def run_job(sp, name: str, path: str):
+    """ Runs the generated job at path in session sp, returns the response to send back. """
+
+    sc = sp.sparkContext
+    group = "{}-{}".format(name, next(_submission_ids))
+    # job groups are per thread, so concurrent submissions are counted separately
+    sc.setJobGroup(group, "conclave job {}".format(name))
+
+    start = time.monotonic()
+    try:
+        with open(path, 'r') as f:
+            code = compile(f.read(), path, "exec")
+        exec(code, {"__name__": JOB_MODULE, "__file__": path})
+        response = {"status": "ok"}
+    except Exception:
+        response = {"status": "error", "error": traceback.format_exc()}
+    response["seconds"] = time.monotonic() - start
+    response.update(_metrics(sc, group))
+
+    return response
+
+
+def _serve_connection(sp, conn, token: str):
+    """ Answers the requests sent on conn until the other side closes it. """
+
+    with conn, conn.makefile('rw') as stream:
+        for line in stream:
+            request = json.loads(line)
+            if not hmac.compare_digest(str(request.get("token", "")), token):
+                response = {"status": "error", "error": "invalid token"}
+            else:
+                print("{}: running {}".format(request["name"], request["path"]), flush=True)
+                response = run_job(sp, request["name"], request["path"])
+            stream.write(json.dumps(response) + "\n")
+            stream.flush()
+
+
+def _write_token(address: str):
+    """ Writes a new token to token_path(address), readable only by the current user. """
+
+    token = secrets.token_hex(32)
+    path = token_path(address)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token)
+
+    return token
+
+
+def serve(master_url: str, address: str):
+    """ Creates a session on master_url and runs the jobs submitted to address. """
+
+    host, port = address.split(":")
+    if not ipaddress.ip_address(socket.gethostbyname(host)).is_loopback:
+        raise Exception("Spark driver must listen on a loopback address, not {}".format(host))
+
+    import pyspark.sql as psql
+
+    sp = psql.SparkSession \
+        .builder \
+        .master(master_url) \
+        .appName("conclave-spark-driver") \
+        .getOrCreate()
+
+    server_socket = listen(host, int(port), backlog=16)
+    token = _write_token(address)
+    print(READY_LINE, flush=True)
+
+    try:
+        while True:
+            conn, _ = server_socket.accept()
+            threading.Thread(target=_serve_connection, args=(sp, conn, token), daemon=True).start()
+    finally:
+        server_socket.close()
+        sp.stop()
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 3:
+        print("usage: python -m conclave.dispatch.spark_driver <MASTER URL> <HOST:PORT>")
+        sys.exit(1)
+
+    serve(sys.argv[1], sys.argv[2])
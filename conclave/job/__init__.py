@@ -10,6 +10,9 @@ class Job:
         self.code_dir = code_dir
         # set skip to True if dispatching party is not involved in it
         self.skip = False
+        # names of the relations this job reads and writes, used to order dispatch
+        self.input_rels = set()
+        self.output_rels = set()
 
 
 class SharemindJob(Job):
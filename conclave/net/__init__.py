@@ -1,6 +1,21 @@
 import asyncio
-import functools
 import pickle
+import struct
+
+from conclave.net.connect import DEADLINE, create_connection
+
+# every message is framed as (message type, payload length) followed by the payload
+FRAME_HEADER = struct.Struct("!BI")
+MSG_PICKLED = 0
+MSG_IAM = 1
+MSG_DONE = 2
+# IAM payloads are just the pid, Done payloads the pid and the length of the workflow ID
+# followed by the utf-8 workflow ID and task name
+PID_PAYLOAD = struct.Struct("!I")
+DONE_PAYLOAD = struct.Struct("!IH")
+
+# connected peers by network configuration, reused across workflows
+_peers = {}
 
 
 class IAMMsg:
@@ -16,9 +31,10 @@ class IAMMsg:
 class DoneMsg:
     """ Message signifying that peer has finished a task. """
 
-    def __init__(self, pid: int, task_name: str):
+    def __init__(self, pid: int, task_name: str, workflow_id: str = ""):
         self.pid = pid
         self.task_name = task_name
+        self.workflow_id = workflow_id
 
     def __str__(self):
         return "DoneMsg({})".format(self.pid)
@@ -31,6 +47,48 @@ class FailMsg:
     pass
 
 
+def encode_msg(msg):
+    """
+    Returns the framed wire representation of msg.
+
+    >>> encode_msg(DoneMsg(2, "job", "wf"))
+    b'\\x02\\x00\\x00\\x00\\x0b\\x00\\x00\\x00\\x02\\x00\\x02wfjob'
+    """
+
+    if isinstance(msg, IAMMsg):
+        msg_type, payload = MSG_IAM, PID_PAYLOAD.pack(msg.pid)
+    elif isinstance(msg, DoneMsg):
+        workflow_id = msg.workflow_id.encode("utf-8")
+        payload = DONE_PAYLOAD.pack(msg.pid, len(workflow_id)) + workflow_id + msg.task_name.encode("utf-8")
+        msg_type = MSG_DONE
+    else:
+        msg_type, payload = MSG_PICKLED, pickle.dumps(msg)
+    return FRAME_HEADER.pack(msg_type, len(payload)) + payload
+
+
+def decode_msg(msg_type: int, payload: memoryview):
+    """
+    Inverse of encode_msg for a single frame's type and payload.
+
+    >>> frame = encode_msg(DoneMsg(2, "job", "wf"))
+    >>> msg = decode_msg(frame[0], memoryview(frame)[FRAME_HEADER.size:])
+    >>> msg.pid, msg.task_name, msg.workflow_id
+    (2, 'job', 'wf')
+    """
+
+    if msg_type == MSG_IAM:
+        return IAMMsg(PID_PAYLOAD.unpack_from(payload)[0])
+    elif msg_type == MSG_DONE:
+        pid, workflow_id_len = DONE_PAYLOAD.unpack_from(payload)
+        task_start = DONE_PAYLOAD.size + workflow_id_len
+        workflow_id = bytes(payload[DONE_PAYLOAD.size:task_start]).decode("utf-8")
+        return DoneMsg(pid, bytes(payload[task_start:]).decode("utf-8"), workflow_id)
+    elif msg_type == MSG_PICKLED:
+        return pickle.loads(payload)
+    else:
+        raise Exception("Unknown message type: " + str(msg_type))
+
+
 class SalmonProtocol(asyncio.Protocol):
     """
     The Salmon network protocol defines what messages salmon
@@ -41,23 +99,28 @@ class SalmonProtocol(asyncio.Protocol):
         """ Initialize SalmonProtocol object. """
 
         self.peer = peer
-        self.buffer = b""
+        self.buffer = bytearray()
         self.transport = None
 
     def connection_made(self, transport):
 
         self.transport = transport
 
+    def connection_lost(self, exc):
+
+        # a peer with a broken connection has to be set up from scratch
+        self.peer.connected = False
+
     def data_received(self, data):
 
         self.buffer += data
-        self.handle_lines()
+        self.handle_frames()
 
-    def parse_line(self, line):
+    def parse_frame(self, msg_type, payload):
 
         msg = None
         try:
-            msg = pickle.loads(line)
+            msg = decode_msg(msg_type, payload)
         except Exception as e:
             print(e)
         return msg
@@ -74,14 +137,19 @@ class SalmonProtocol(asyncio.Protocol):
             conn.set_result((self.transport, self))
         else:
             raise Exception("Unexpected peer registration attempt")
+        # peers with higher pids connect to us and wait for our IAM in turn,
+        # which tells them we are ready to take messages
+        if other_pid > self.peer.pid:
+            self.transport.write(encode_msg(IAMMsg(self.peer.pid)))
 
     def _handle_done_msg(self, done_msg):
 
         print("done msg received", done_msg)
-        if self.peer.dispatcher:
-            self.peer.dispatcher.receive_msg(done_msg)
+        dispatcher = self.peer.dispatchers.get(done_msg.workflow_id)
+        if dispatcher:
+            dispatcher.receive_msg(done_msg)
         else:
-            self.peer.msg_buffer.append(done_msg)
+            self.peer.msg_buffers.setdefault(done_msg.workflow_id, []).append(done_msg)
 
     def handle_msg(self, msg):
 
@@ -92,17 +160,27 @@ class SalmonProtocol(asyncio.Protocol):
         else:
             raise Exception("Weird message: " + str(msg))
 
-    def handle_lines(self):
+    def handle_frames(self):
 
-        # using delimiters for now
-        # TODO: switch to sending length flags
-        while b"\n\n\n" in self.buffer:
-            line, self.buffer = self.buffer.split(b"\n\n\n", 1)
-            parsed = self.parse_line(line)
-            if parsed:
-                self.handle_msg(parsed)
-            else:
-                print("failed to parse line:", line)
+        # parse all complete frames in place, then drop them from the buffer at once
+        offset = 0
+        view = memoryview(self.buffer)
+        try:
+            while len(self.buffer) - offset >= FRAME_HEADER.size:
+                msg_type, length = FRAME_HEADER.unpack_from(self.buffer, offset)
+                end = offset + FRAME_HEADER.size + length
+                if len(self.buffer) < end:
+                    break
+                with view[offset + FRAME_HEADER.size:end] as payload:
+                    parsed = self.parse_frame(msg_type, payload)
+                    if not parsed:
+                        print("failed to parse frame:", bytes(payload))
+                offset = end
+                if parsed:
+                    self.handle_msg(parsed)
+        finally:
+            view.release()
+            del self.buffer[:offset]
 
 
 class SalmonPeer:
@@ -118,78 +196,76 @@ class SalmonPeer:
         self.host = self.parties[self.pid]["host"]
         self.port = self.parties[self.pid]["port"]
         self.peer_connections = {}
-        self.dispatcher = None
-        self.msg_buffer = []
+        # frames waiting to be written to each receiver in a single write
+        self.out_buffers = {}
+        # current dispatcher and messages that arrived before it registered, by workflow ID
+        self.dispatchers = {}
+        self.msg_buffers = {}
+        self.connected = False
         self.server = loop.create_server(
             lambda: SalmonProtocol(self),
             host=self.host, port=self.port)
         self.loop = loop
 
-    def register_dispatcher(self, dispatcher):
+    @property
+    def dispatcher(self):
+
+        return self.dispatchers.get("")
+
+    @dispatcher.setter
+    def dispatcher(self, dispatcher):
+
+        if dispatcher is None:
+            self.dispatchers.pop("", None)
+        else:
+            self.register_dispatcher(dispatcher)
 
-        # HACK
-        # having a message buffer per connection might
-        # make more sense
-        self.dispatcher = dispatcher
+    def register_dispatcher(self, dispatcher, workflow_id: str = ""):
+
+        self.dispatchers[workflow_id] = dispatcher
         # early messages got buffered so we need to
         # forward them to newly-registered the dispatcher
-        for msg in self.msg_buffer:
+        for msg in self.msg_buffers.pop(workflow_id, []):
             print("msgmsg", msg)
-            if isinstance(msg, DoneMsg):
-                self.dispatcher.receive_msg(msg)
-        self.msg_buffer = [msg for msg in self.msg_buffer if isinstance(msg, DoneMsg)]
-
-    def connect_to_others(self):
-
-        @asyncio.coroutine
-        def _create_connection_retry(f, other_host, other_port):
-            while True:
-                conn = None
-                try:
-                    conn = yield from self.loop.create_connection(f, other_host, other_port)
-                except OSError:
-                    print("Retrying connection to {} {}".format(other_host, other_port))
-                    yield from asyncio.sleep(1)
-                else:
-                    return conn
-
-        def _send_IAM(pid, conn):
-
-            msg = IAMMsg(pid)
-            formatted = pickle.dumps(msg) + b"\n\n\n"
-            transport, protocol = conn.result()
-            transport.write(formatted)
+            dispatcher.receive_msg(msg)
+
+    def session(self, workflow_id: str):
+        """ Returns a view of this peer whose messages belong to workflow_id. """
+
+        return PeerSession(self, workflow_id)
+
+    def connect_to_others(self, deadline: float = DEADLINE):
+
+        async def _dial(other_host, other_port):
+            transport, protocol = await create_connection(
+                self.loop, lambda: SalmonProtocol(self), other_host, other_port, deadline)
+            # register own ID with other peer, which answers with its own once ready
+            transport.write(encode_msg(IAMMsg(self.pid)))
 
         to_wait_on = []
         for other_pid in self.parties.keys():
+            if other_pid == self.pid:
+                continue
+            # either way the connection is ready once the other peer's IAM arrives
+            ready = asyncio.Future(loop=self.loop)
+            self.peer_connections[other_pid] = ready
+            to_wait_on.append(ready)
             if other_pid < self.pid:
                 other_host = self.parties[other_pid]["host"]
                 other_port = self.parties[other_pid]["port"]
                 print("Will connect to {} at {}:{}".format(
                     other_pid, other_host, other_port))
-
-                # create connection
-                # using deprecated asyncio.async for 3.4.3 support
-                conn = asyncio.async(_create_connection_retry(
-                    lambda: SalmonProtocol(self), other_host, other_port))
-
-                self.peer_connections[other_pid] = conn
-                # once connection is ready, register own ID with other peer
-                conn.add_done_callback(functools.partial(_send_IAM, self.pid))
-                # TODO: figure out way to wait on message delivery
-                # instead of on connection
-                to_wait_on.append(conn)
-            elif other_pid > self.pid:
+                # all peers are dialed at once
+                to_wait_on.append(asyncio.ensure_future(_dial(other_host, other_port), loop=self.loop))
+            else:
                 print("Will wait for {} to connect".format(other_pid))
-                # expect connection from other peer
-                connection_made = asyncio.Future()
-                self.peer_connections[other_pid] = connection_made
-                to_wait_on.append(connection_made)
-        self.loop.run_until_complete(asyncio.gather(*to_wait_on))
+        try:
+            self.loop.run_until_complete(asyncio.wait_for(asyncio.gather(*to_wait_on), deadline))
+        except asyncio.TimeoutError:
+            raise Exception("Could not connect to all parties within {} seconds".format(deadline))
         # prevent new incoming connections
         self.server.close()
         self.loop.run_until_complete(self.server.wait_closed())
-        # TODO: think about another round of synchronization here
         # done connecting
         # unwrap futures that hold ready connections
         for pid in self.peer_connections:
@@ -197,20 +273,76 @@ class SalmonPeer:
             # the result is a (transport, protocol) tuple
             # we only want the transport
             self.peer_connections[pid] = completed_future.result()[0]
+        self.connected = True
+
+    def close(self):
+
+        for transport in self.peer_connections.values():
+            if not isinstance(transport, asyncio.Future):
+                transport.close()
+        self.connected = False
+
+    def _flush(self, receiver):
+
+        pending = self.out_buffers.pop(receiver, None)
+        if pending:
+            self.peer_connections[receiver].write(b"".join(pending))
 
     def _send_msg(self, receiver, msg):
 
-        # sends formatted message
-        formatted = pickle.dumps(msg) + b"\n\n\n"
-        self.peer_connections[receiver].write(formatted)
+        # messages sent while the loop runs are coalesced into one write at the end
+        # of the current iteration; otherwise nothing would flush them, so write now
+        pending = self.out_buffers.setdefault(receiver, [])
+        pending.append(encode_msg(msg))
+        if not self.loop.is_running():
+            self._flush(receiver)
+        elif len(pending) == 1:
+            self.loop.call_soon(self._flush, receiver)
 
-    def send_done_msg(self, receiver, task_name):
+    def send_done_msg(self, receiver, task_name, workflow_id: str = ""):
 
         # sends message indicating task completion
-        done_msg = DoneMsg(self.pid, task_name)
+        done_msg = DoneMsg(self.pid, task_name, workflow_id)
         self._send_msg(receiver, done_msg)
 
 
+class PeerSession:
+    """
+    A single workflow's view of a shared SalmonPeer. It offers the peer interface
+    dispatchers use, but only sees and sends messages tagged with its workflow ID,
+    so that several workflows can run over the same connections.
+    """
+
+    def __init__(self, peer: SalmonPeer, workflow_id: str):
+
+        self.peer = peer
+        self.workflow_id = workflow_id
+        self.pid = peer.pid
+        self.parties = peer.parties
+        self.loop = peer.loop
+
+    @property
+    def dispatcher(self):
+
+        return self.peer.dispatchers.get(self.workflow_id)
+
+    @dispatcher.setter
+    def dispatcher(self, dispatcher):
+
+        if dispatcher is None:
+            self.peer.dispatchers.pop(self.workflow_id, None)
+        else:
+            self.register_dispatcher(dispatcher)
+
+    def register_dispatcher(self, dispatcher):
+
+        self.peer.register_dispatcher(dispatcher, self.workflow_id)
+
+    def send_done_msg(self, receiver, task_name):
+
+        self.peer.send_done_msg(receiver, task_name, self.workflow_id)
+
+
 def setup_peer(config):
     """
     Creates a peer and connects peer to all other peers. Blocks until connection succeeds.
@@ -222,3 +354,21 @@ def setup_peer(config):
     peer.server = loop.run_until_complete(peer.server)
     peer.connect_to_others()
     return peer
+
+
+def get_peer(config):
+    """
+    Returns a connected peer for config, reusing the one set up by an earlier call unless
+    its connections were lost since. Blocks until connection succeeds.
+    :param config: network configuration
+    :return: connected peer
+    """
+    parties = tuple(sorted((pid, party["host"], party["port"]) for pid, party in config["parties"].items()))
+    key = (config["pid"], parties)
+    peer = _peers.get(key)
+    if peer is None or not peer.connected:
+        if peer is not None:
+            peer.close()
+        peer = setup_peer(config)
+        _peers[key] = peer
+    return peer
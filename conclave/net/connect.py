@@ -0,0 +1,69 @@
+"""
+Connection establishment shared by networked peers and the socket helpers of
+generated code. Failed attempts are retried after jittered, exponentially growing
+delays until an overall deadline passes.
+"""
+import asyncio
+import random
+import socket
+import time
+
+INITIAL_DELAY = 0.01
+MAX_DELAY = 1.0
+# seconds after which connecting is given up on
+DEADLINE = 300.0
+
+
+def backoff_delays(initial_delay: float = INITIAL_DELAY, max_delay: float = MAX_DELAY):
+    """
+    Yields delays drawn uniformly from [0, d], where d starts at initial_delay and
+    doubles up to max_delay, so that parties retrying at once spread out.
+
+    >>> delays = backoff_delays(1.0, 4.0)
+    >>> all(0 <= next(delays) <= limit for limit in [1.0, 2.0, 4.0, 4.0])
+    True
+    """
+    delay = initial_delay
+    while True:
+        yield random.uniform(0, delay)
+        delay = min(2 * delay, max_delay)
+
+
+def _give_up(host: str, port: int, deadline: float):
+    raise Exception("Could not connect to {}:{} within {} seconds".format(host, port, deadline))
+
+
+def connect(host: str, port: int, deadline: float = DEADLINE):
+    """ Returns a socket connected to host:port. """
+    give_up_at = time.monotonic() + deadline
+    for delay in backoff_delays():
+        try:
+            return socket.create_connection((host, port))
+        except OSError:
+            remaining = give_up_at - time.monotonic()
+            if remaining <= 0:
+                _give_up(host, port, deadline)
+            # the last attempt is made right at the deadline
+            time.sleep(min(delay, remaining))
+
+
+def listen(host: str, port: int, backlog: int = 1):
+    """ Returns a socket listening on host:port. """
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind((host, port))
+    server_socket.listen(backlog)
+    return server_socket
+
+
+async def create_connection(loop, protocol_factory: callable, host: str, port: int, deadline: float = DEADLINE):
+    """ Asynchronous counterpart of connect, returns a (transport, protocol) pair. """
+    give_up_at = loop.time() + deadline
+    for delay in backoff_delays():
+        try:
+            return await loop.create_connection(protocol_factory, host, port)
+        except OSError:
+            remaining = give_up_at - loop.time()
+            if remaining <= 0:
+                _give_up(host, port, deadline)
+            await asyncio.sleep(min(delay, remaining))
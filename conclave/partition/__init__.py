@@ -3,6 +3,7 @@ from copy import copy, deepcopy
 from conclave.codegen.scotch import ScotchCodeGen
 from conclave.config import CodeGenConfig
 from conclave.dag import OpDag, Dag, Create, Open, Persist, OpNode
+from conclave.partition.part import assign_backends
 
 
 def heupart(dag: Dag, mpc_frameworks: list, local_frameworks: list):
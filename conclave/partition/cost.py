@@ -0,0 +1,182 @@
+"""
+Cost model for choosing backends. Each backend has a per-job overhead (interpreter or
+JVM start-up, MPC set-up) and, per operator type, the seconds it takes per input row:
+the inverse of the rows per second local backends process, and for MPC backends the
+time the gates or communication rounds of one row take. Relations handed off between
+jobs cost seconds per row written and read back, which depends on the format they are
+stored in.
+
+The defaults are rough figures for a single machine. calibrate_python measures the
+Python backend on the machine it runs on, and figures measured elsewhere (e.g. with
+Spark micro-benchmarks on the cluster) can be saved and loaded as JSON.
+"""
+import contextlib
+import io
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from conclave.dag import OpDag, OpNode, Join
+from conclave.stats import estimate
+
+MPC_BACKENDS = {"sharemind", "obliv-c", "jiff"}
+
+# used for relations of unknown size
+DEFAULT_ROWS = 10000
+
+# seconds to start a Python job: in a new interpreter that imports the runtime, and in
+# a worker of a warm pool (PythonConfig.worker_pool), see conclave.dispatch.python
+PYTHON_START_SECS = 0.15
+PYTHON_POOLED_START_SECS = 0.01
+
+
+class CostModel:
+    """ Estimated seconds for running operators and handing off relations in each backend. """
+
+    def __init__(self, job_overhead: [dict, None] = None, secs_per_row: [dict, None] = None,
+                 handoff_secs_per_row: [dict, None] = None, python_worker_pool: bool = False):
+
+        self.job_overhead = {
+            "python": PYTHON_POOLED_START_SECS if python_worker_pool else PYTHON_START_SECS,
+            "spark": 15.0,
+            "sharemind": 5.0,
+            "obliv-c": 2.0,
+            "jiff": 3.0
+        }
+        # per backend, by operator class name, with "default" for others
+        self.secs_per_row = {
+            "python": {"default": 1e-6, "Join": 2e-6, "Aggregate": 1e-6, "SortBy": 3e-6},
+            "spark": {"default": 1e-7, "Join": 3e-7, "Aggregate": 2e-7, "SortBy": 4e-7},
+            "sharemind": {"default": 1e-5, "Join": 1e-4, "Aggregate": 5e-4, "SortBy": 5e-4},
+            "obliv-c": {"default": 1e-5, "Join": 1e-5, "Aggregate": 2e-4, "SortBy": 2e-4},
+            "jiff": {"default": 1e-4, "Join": 1e-4, "Aggregate": 2e-3, "SortBy": 2e-3}
+        }
+        # by storage format, see conclave.generate_code
+        self.handoff_secs_per_row = {
+            "csv": 2e-6,
+            "bin": 2e-7,
+            "parquet": 3e-7
+        }
+        self.job_overhead.update(job_overhead or {})
+        for backend, costs in (secs_per_row or {}).items():
+            self.secs_per_row.setdefault(backend, {}).update(costs)
+        self.handoff_secs_per_row.update(handoff_secs_per_row or {})
+
+    def save(self, path: str):
+
+        with open(path, 'w') as f:
+            json.dump({
+                "job_overhead": self.job_overhead,
+                "secs_per_row": self.secs_per_row,
+                "handoff_secs_per_row": self.handoff_secs_per_row
+            }, f, indent=2)
+
+    @staticmethod
+    def load(path: str):
+        """ Returns the defaults, overridden by the figures saved at path. """
+
+        with open(path, 'r') as f:
+            return CostModel(**json.load(f))
+
+    def op_cost(self, node: OpNode, backend: str, rows: dict):
+        """
+        Returns the estimated seconds node takes in backend, given the estimated
+        row counts of all nodes.
+
+        >>> import conclave.lang as sal
+        >>> from conclave.utils import defCol
+        >>> left = sal.create("left", [defCol("a", "INTEGER", [1])], {1})
+        >>> right = sal.create("right", [defCol("a", "INTEGER", [1])], {1})
+        >>> joined = sal.join(left, right, "joined", ["a"], ["a"])
+        >>> rows = {left: 100, right: 10}
+        >>> CostModel().op_cost(joined, "python", rows) == 110 * 2e-6
+        True
+        >>> CostModel().op_cost(joined, "obliv-c", rows) == 1000 * 1e-5
+        True
+        """
+
+        costs = self.secs_per_row[backend]
+        per_row = costs.get(type(node).__name__, costs["default"])
+        input_rows = [rows[parent] for parent in node.parents]
+        if isinstance(node, Join) and backend in MPC_BACKENDS:
+            # oblivious joins compare all pairs of rows
+            work = math.prod(input_rows)
+        else:
+            work = sum(input_rows)
+
+        return per_row * work
+
+    def handoff_cost(self, num_rows: int, fmt: str):
+
+        return self.handoff_secs_per_row[fmt] * num_rows
+
+
+def estimate_rows(dag: OpDag, input_path: str):
+    """ Returns estimated row counts by node, see conclave.stats. """
+
+    return {node: stats.rows if stats.rows is not None else DEFAULT_ROWS
+            for node, stats in estimate(dag, input_path).items()}
+
+
+def _time_per_row(f: callable, num_rows: int, repeat: int = 3):
+
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+
+    return best / num_rows
+
+
+def _python_start_secs(repeat: int = 3):
+    """ Returns the seconds it takes to start a Python job in a new interpreter. """
+
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import conclave.codegen.libs.python"], check=True)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def calibrate_python(num_rows: int = 100000, python_worker_pool: bool = False):
+    """
+    Returns a CostModel whose Python figures are measured on this machine. The job
+    overhead is measured unless jobs run in a warm worker pool.
+    """
+
+    import conclave.codegen.libs.python as runtime
+
+    rel = [[idx % 1000, idx, num_rows - idx] for idx in range(num_rows)]
+    secs_per_row = {
+        "default": _time_per_row(lambda: runtime.project(rel, [2, 0]), num_rows),
+        "Filter": _time_per_row(lambda: runtime.cc_filter(lambda row: row[1] > row[2], rel), num_rows),
+        "Aggregate": _time_per_row(lambda: runtime.aggregate(rel, 0, 1, "+"), num_rows),
+        "SortBy": _time_per_row(lambda: runtime.sort_by(rel, 2), num_rows),
+        "Join": _time_per_row(lambda: runtime.join(rel, rel[:1000], 0, 0), num_rows + 1000)
+    }
+
+    job_dir = tempfile.mkdtemp()
+    path = os.path.join(job_dir, "rel")
+
+    def _round_trip(write: callable, read: callable):
+        write(job_dir, "rel", rel, "a,b,c")
+        read(path)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        handoff_secs_per_row = {
+            "csv": _time_per_row(lambda: _round_trip(runtime.write_rel, runtime.read_rel), num_rows),
+            "bin": _time_per_row(lambda: _round_trip(runtime.write_rel_bin, runtime.read_rel_bin), num_rows)
+        }
+    shutil.rmtree(job_dir)
+
+    job_overhead = {} if python_worker_pool else {"python": _python_start_secs()}
+
+    return CostModel(job_overhead, {"python": secs_per_row}, handoff_secs_per_row, python_worker_pool)
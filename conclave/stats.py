@@ -0,0 +1,386 @@
+"""
+Relation statistics. Inputs are summarized in one streaming pass: row count, and per
+column the min and max (of numeric columns), a HyperLogLog sketch of the distinct
+values and whether any value is missing. Summaries are kept in the relation's metadata
+sidecar (see conclave.codegen.libs.python), so inputs are only scanned once.
+
+estimate propagates them through a dag: joins keep |L| * |R| / max(distinct keys) rows,
+aggregations one row per group, and filters the fraction of rows a uniform
+distribution between min and max would let through.
+"""
+import csv
+import hashlib
+import json
+import math
+import os
+
+from conclave.codegen.libs.python import META_SUFFIX, rel_version, save_rel_meta
+import conclave.dag as saldag
+
+HLL_PRECISION = 10
+HLL_REGISTERS = 1 << HLL_PRECISION
+
+
+class HyperLogLog:
+    """
+    Sketch of the number of distinct values added to it, within about 3% with 1024 registers.
+
+    >>> sketch = HyperLogLog()
+    >>> for value in range(10000):
+    ...     sketch.add(str(value % 5000))
+    >>> 4800 < sketch.count() < 5200
+    True
+    """
+
+    def __init__(self, registers: [bytearray, None] = None):
+        self.registers = registers if registers is not None else bytearray(HLL_REGISTERS)
+
+    def add(self, value: str):
+
+        hashed = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "little")
+        idx = hashed & (HLL_REGISTERS - 1)
+        rest = hashed >> HLL_PRECISION
+        rank = 64 - HLL_PRECISION - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other):
+        """ Returns a sketch of the values added to either sketch. """
+
+        return HyperLogLog(bytearray(max(mine, theirs) for mine, theirs in zip(self.registers, other.registers)))
+
+    def count(self):
+
+        alpha = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+        estimate = alpha * HLL_REGISTERS ** 2 / sum(2.0 ** -register for register in self.registers)
+        empty = self.registers.count(0)
+        # small range correction
+        if estimate <= 2.5 * HLL_REGISTERS and empty:
+            estimate = HLL_REGISTERS * math.log(HLL_REGISTERS / empty)
+
+        return int(round(estimate))
+
+
+class ColumnStats:
+    """ Summary of one column. min and max are None for non-numeric or unknown columns. """
+
+    def __init__(self, min_val: [float, None] = None, max_val: [float, None] = None,
+                 sketch: [HyperLogLog, None] = None, null_free: bool = True, distinct: [int, None] = None):
+        self.min = min_val
+        self.max = max_val
+        self.sketch = sketch
+        self.null_free = null_free
+        # if set, overrides the sketch (e.g. after a filter kept fewer rows than it counted)
+        self._distinct = distinct
+
+    @property
+    def distinct(self):
+
+        if self._distinct is not None:
+            return self._distinct
+        return self.sketch.count() if self.sketch is not None else None
+
+    def capped(self, num_rows: [int, None]):
+        """ Returns these stats for a relation of num_rows rows, which can't have more distinct values. """
+
+        distinct = self.distinct
+        if distinct is not None and num_rows is not None and distinct > num_rows:
+            distinct = num_rows
+        return ColumnStats(self.min, self.max, self.sketch, self.null_free, distinct)
+
+    def to_dict(self):
+
+        return {
+            "min": self.min,
+            "max": self.max,
+            "hll": self.sketch.registers.hex() if self.sketch is not None else None,
+            "null_free": self.null_free,
+            "distinct": self._distinct
+        }
+
+    @staticmethod
+    def from_dict(d: dict):
+
+        sketch = HyperLogLog(bytearray.fromhex(d["hll"])) if d["hll"] is not None else None
+        return ColumnStats(d["min"], d["max"], sketch, d["null_free"], d["distinct"])
+
+
+class RelStats:
+    """ Row count (None if unknown) and column summaries, in the order of the relation's columns. """
+
+    def __init__(self, rows: [int, None], columns: list):
+        self.rows = rows
+        self.columns = columns
+
+    def col(self, idx: int):
+
+        if idx < len(self.columns) and self.columns[idx] is not None:
+            return self.columns[idx]
+        return ColumnStats()
+
+    def distinct(self, idx: int):
+
+        distinct = self.col(idx).distinct
+        return distinct if distinct is not None else self.rows
+
+
+def _as_number(value: str):
+
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+
+def scan_stats(path_to_rel: str):
+    """
+    Summarizes the CSV relation (with a header) at path_to_rel in one pass.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "rel.csv")
+    >>> with open(path, "w") as f:
+    ...     _ = f.write("a,b\\n1,x\\n3,y\\n2,\\n3,x\\n\\n")
+    >>> stats = scan_stats(path)
+    >>> stats.rows, stats.col(0).min, stats.col(0).max, stats.col(0).distinct, stats.col(0).null_free
+    (4, 1, 3, 3, True)
+    >>> stats.col(1).min, stats.col(1).null_free
+    (None, False)
+    """
+
+    with open(path_to_rel, "r", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        columns = [ColumnStats(sketch=HyperLogLog()) for _ in header]
+        numeric = [True for _ in header]
+        num_rows = 0
+        for row in reader:
+            # blank lines
+            if len(row) < 2 and not "".join(row).strip():
+                continue
+            num_rows += 1
+            for idx, col in enumerate(columns):
+                value = row[idx] if idx < len(row) else ""
+                if value == "":
+                    col.null_free = False
+                    continue
+                col.sketch.add(value)
+                if not numeric[idx]:
+                    continue
+                number = _as_number(value)
+                if number is None:
+                    numeric[idx] = False
+                    col.min, col.max = None, None
+                    continue
+                col.min = number if col.min is None else min(col.min, number)
+                col.max = number if col.max is None else max(col.max, number)
+
+    return RelStats(num_rows, columns)
+
+
+def read_rel_stats(path_to_rel: str, scan: bool = True):
+    """
+    Returns the statistics of the CSV relation at path_to_rel from its sidecar if they
+    are up to date. Otherwise, unless scan is unset, they are computed and added to
+    the sidecar, and if it is, only the row count in the sidecar is used. Returns None
+    for missing relations.
+    """
+
+    meta_path = path_to_rel + META_SUFFIX
+    try:
+        # taken before any scan, so that a relation rewritten meanwhile is scanned again
+        version = rel_version(path_to_rel)
+    except OSError:
+        return None
+
+    meta = {}
+    current = False
+    try:
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        current = (meta.get("bytes"), meta.get("mtime")) == version
+        if current and "stats" in meta:
+            return RelStats(meta["rows"], [ColumnStats.from_dict(col) for col in meta["stats"]])
+    except (OSError, ValueError):
+        pass
+
+    if not scan:
+        if current and "rows" in meta:
+            return RelStats(meta["rows"], [])
+        return None
+
+    stats = scan_stats(path_to_rel)
+    if not current:
+        with open(path_to_rel, "r") as f:
+            schema = f.readline().strip().split(",")
+        meta = {"cols": len(schema), "schema": schema}
+    meta["bytes"], meta["mtime"] = version
+    meta.update({"rows": stats.rows, "stats": [col.to_dict() for col in stats.columns]})
+    try:
+        save_rel_meta(path_to_rel, meta)
+    except OSError as e:
+        # e.g. read-only or shared input directories, whose inputs are then scanned again next time
+        print("Couldn't save statistics of {}: {}".format(path_to_rel, e))
+
+    return stats
+
+
+def _filter_selectivity(node: saldag.Filter, stats: RelStats):
+    """ Returns the fraction of rows node is estimated to keep. """
+
+    col = stats.col(node.filter_col.idx)
+    if node.operator == "==":
+        if node.is_scalar:
+            distinct = stats.distinct(node.filter_col.idx)
+            return 1.0 / distinct if distinct else 1.0
+        distinct = max(stats.distinct(node.filter_col.idx) or 1, stats.distinct(node.other_col.idx) or 1)
+        return 1.0 / distinct
+    if node.is_scalar and col.min is not None and col.max is not None:
+        if col.max == col.min:
+            return 1.0 if col.min < node.scalar else 0.0
+        return min(max((node.scalar - col.min) / (col.max - col.min), 0.0), 1.0)
+    # column against column, or no range known
+    return 1.0 / 3
+
+
+def _join_stats(node: saldag.Join, left: RelStats, right: RelStats):
+
+    left_keys = [col.idx for col in node.left_join_cols]
+    right_keys = [col.idx for col in node.right_join_cols]
+    rows = None
+    if left.rows is not None and right.rows is not None:
+        distinct = max(max(left.distinct(left_idx) or 1, right.distinct(right_idx) or 1)
+                       for left_idx, right_idx in zip(left_keys, right_keys))
+        rows = int(math.ceil(left.rows * right.rows / distinct))
+
+    key_cols = []
+    for left_idx, right_idx in zip(left_keys, right_keys):
+        left_col, right_col = left.col(left_idx), right.col(right_idx)
+        distinct = min(d for d in [left_col.distinct, right_col.distinct, rows] if d is not None) \
+            if left_col.distinct is not None or right_col.distinct is not None else None
+        min_val = max(left_col.min, right_col.min) if None not in [left_col.min, right_col.min] else None
+        max_val = min(left_col.max, right_col.max) if None not in [left_col.max, right_col.max] else None
+        key_cols.append(ColumnStats(min_val, max_val, None, left_col.null_free and right_col.null_free, distinct))
+
+    left_cols = [left.col(idx) for idx in range(len(node.left_parent.out_rel.columns)) if idx not in left_keys]
+    right_cols = [right.col(idx) for idx in range(len(node.right_parent.out_rel.columns)) if idx not in right_keys]
+
+    return RelStats(rows, key_cols + left_cols + right_cols)
+
+
+def _concat_stats(parents: list):
+
+    rows = None if None in [stats.rows for stats in parents] else sum(stats.rows for stats in parents)
+    columns = []
+    for idx in range(max(len(stats.columns) for stats in parents)):
+        cols = [stats.col(idx) for stats in parents]
+        mins, maxs = [col.min for col in cols], [col.max for col in cols]
+        sketch = None
+        if all(col.sketch is not None and col._distinct is None for col in cols):
+            sketch = cols[0].sketch
+            for col in cols[1:]:
+                sketch = sketch.merge(col.sketch)
+        distinct = None
+        if sketch is None and None not in [col.distinct for col in cols]:
+            distinct = sum(col.distinct for col in cols)
+        columns.append(ColumnStats(
+            min(mins) if None not in mins else None, max(maxs) if None not in maxs else None,
+            sketch, all(col.null_free for col in cols), distinct))
+
+    return RelStats(rows, columns)
+
+
+def _groups(stats: RelStats, idxs: list):
+    """ Returns the estimated number of distinct combinations of the columns at idxs. """
+
+    if stats.rows is None:
+        return None
+    groups = 1
+    for idx in idxs:
+        distinct = stats.distinct(idx)
+        groups *= distinct if distinct is not None else stats.rows
+    return min(groups, stats.rows)
+
+
+def _node_stats(node: saldag.OpNode, parents: list):
+    """ Returns the estimated statistics of node's output, given those of its parents. """
+
+    if isinstance(node, saldag.Join):
+        return _join_stats(node, parents[0], parents[1])
+    elif isinstance(node, saldag.Concat):
+        return _concat_stats(parents)
+    elif isinstance(node, saldag.Blackbox) or not parents:
+        return RelStats(None, [])
+
+    stats = parents[0]
+    num_cols = len(node.out_rel.columns)
+    if isinstance(node, saldag.Project):
+        return RelStats(stats.rows, [stats.col(col.idx) for col in node.selected_cols])
+    elif isinstance(node, saldag.Filter):
+        rows = None if stats.rows is None else int(math.ceil(stats.rows * _filter_selectivity(node, stats)))
+        return RelStats(rows, [col.capped(rows) for col in stats.columns])
+    elif isinstance(node, saldag.Aggregate):
+        group_idxs = [col.idx for col in node.group_cols]
+        rows = _groups(stats, group_idxs)
+        return RelStats(rows, [stats.col(idx).capped(rows) for idx in group_idxs] + [ColumnStats()])
+    elif isinstance(node, saldag.Distinct):
+        idxs = [col.idx for col in node.selected_cols]
+        rows = _groups(stats, idxs)
+        return RelStats(rows, [stats.col(idx).capped(rows) for idx in idxs])
+    elif isinstance(node, (saldag.DistinctCount, saldag.NumRows)):
+        return RelStats(1, [ColumnStats()])
+    elif isinstance(node, saldag.Limit):
+        rows = node.num if stats.rows is None else min(node.num, stats.rows)
+        return RelStats(rows, [col.capped(rows) for col in stats.columns])
+    elif isinstance(node, (saldag.Multiply, saldag.Divide)):
+        columns = [stats.col(idx) for idx in range(num_cols)]
+        columns[node.target_col.idx] = ColumnStats()
+        return RelStats(stats.rows, columns)
+    elif isinstance(node, saldag.Index):
+        return RelStats(stats.rows, [ColumnStats(0, stats.rows, None, True, stats.rows)] + stats.columns)
+
+    # order, placement or encoding of rows change, but not their values
+    return RelStats(stats.rows, [stats.col(idx) for idx in range(num_cols)])
+
+
+def estimate(dag: saldag.OpDag, input_path: str, scan: bool = True):
+    """
+    Returns estimated statistics by node. Inputs are looked up as CSV relations in
+    input_path (see read_rel_stats), and have unknown statistics if they aren't there.
+
+    >>> import tempfile
+    >>> import conclave.lang as sal
+    >>> from conclave.utils import defCol
+    >>> input_path = tempfile.mkdtemp()
+    >>> with open(os.path.join(input_path, "orders.csv"), "w") as f:
+    ...     _ = f.write("customer,amount\\n" + "".join("{},{}\\n".format(i % 100, i) for i in range(1000)))
+    >>> with open(os.path.join(input_path, "customers.csv"), "w") as f:
+    ...     _ = f.write("customer,region\\n" + "".join("{},{}\\n".format(i, i % 4) for i in range(100)))
+    >>> orders = sal.create("orders", [defCol("customer", "INTEGER", [1]), defCol("amount", "INTEGER", [1])], {1})
+    >>> customers = sal.create("customers", [defCol("customer", "INTEGER", [1]), defCol("region", "INTEGER", [1])], {1})
+    >>> big = sal.cc_filter(orders, "big", "amount", "<", scalar=250)
+    >>> joined = sal.join(big, customers, "joined", ["customer"], ["customer"])
+    >>> by_region = sal.aggregate(joined, "by_region", ["region"], "amount", "sum", "total")
+    >>> stats = estimate(saldag.OpDag({orders, customers}), input_path)
+    >>> stats[big].rows, 240 < stats[joined].rows < 260, stats[by_region].rows
+    (251, True, 4)
+    """
+
+    stats = {}
+    for node in dag.top_sort():
+        if isinstance(node, saldag.Create):
+            path = os.path.join(input_path, node.out_rel.name + ".csv")
+            input_stats = read_rel_stats(path, scan)
+            stats[node] = input_stats if input_stats is not None else RelStats(None, [])
+        else:
+            if isinstance(node, saldag.BinaryOpNode):
+                parents = [node.left_parent, node.right_parent]
+            elif isinstance(node, (saldag.Concat, saldag.Blackbox)):
+                parents = node.ordered
+            else:
+                parents = list(node.parents)
+            stats[node] = _node_stats(node, [stats[parent] for parent in parents])
+
+    return stats